@@ -0,0 +1 @@
+PLUGIN_HELP = 'Run the pylot commands in a newline delimited json file in one process.'
@@ -0,0 +1,55 @@
+from .. import batch
+from pylot.plugins.helpers.session import Session, read_commands
+
+
+def return_parser(subparsers):
+    example = '{"id": "reingest", "command": "cumulus reingest granule granule_id=G1", "after": ["update"]}'
+    subparser = subparsers.add_parser(
+        'batch',
+        help=batch.PLUGIN_HELP,
+        description='Runs the pylot commands in a newline delimited json file in one process so they share the '
+                    'plugin imports, the Cumulus API client and the AWS connection pools. Each line is a command line '
+                    'string, a list of arguments or an object with a "command", an optional "id" (defaults to the '
+                    'line number) and an optional "after" listing the ids of the commands that must succeed first. '
+                    'Commands without "after" run concurrently.\n'
+                    f'Example line: {example}'
+    )
+    subparser.add_argument('commands', help='The newline delimited json file of commands.', metavar='commands.ndjson')
+    subparser.add_argument(
+        '-w', '--workers',
+        help='The maximum number of commands running at the same time. Defaults to 8.',
+        metavar='',
+        type=int,
+        default=8
+    )
+    subparser.add_argument(
+        '-d', '--results-dir',
+        help='The directory the output of each command, <id>.log, and summary.ndjson are written to. The default '
+             'output files of each command, e.g. query_results.json, are written to <id>/ in this directory. '
+             'Defaults to pylot_batch_results.',
+        metavar='',
+        default='pylot_batch_results'
+    )
+    subparser.add_argument(
+        '-r', '--max-rate',
+        help='Maximum number of Cumulus API requests per second of all the commands together. The commands can not be '
+             'given their own --max-rate.',
+        metavar='N',
+        type=float
+    )
+    subparser.add_argument(
+        '--sequential',
+        help='Run every command after the previous one succeeded, as a shell script with set -e would.',
+        action='store_true'
+    )
+
+
+def main(commands, workers=8, results_dir='pylot_batch_results', sequential=False, max_rate=None, **kwargs):
+    command_list = read_commands(commands)
+    if sequential:
+        for previous, command in zip(command_list, command_list[1:]):
+            command.update({'after': [*command.get('after'), previous.get('id')]})
+
+    results = Session().run_batch(command_list, workers, results_dir, max_rate)
+
+    return 0 if all(result.get('status') == 'succeeded' for result in results) else 1
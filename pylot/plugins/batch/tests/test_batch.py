@@ -0,0 +1,118 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from pylot.plugins.batch.main import main
+from pylot.plugins.helpers.session import Session, parse_command, read_commands
+from pylot.tests.fake_stack import FakeStack
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.results_dir = os.path.join(self.tmp_dir.name, 'results')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def write_commands(self, commands):
+        file = os.path.join(self.tmp_dir.name, 'commands.ndjson')
+        with open(file, 'w', encoding='utf-8') as _file:
+            _file.writelines(f'{json.dumps(command)}\n' for command in commands)
+        return file
+
+    def test_parse_command(self):
+        self.assertEqual(parse_command('cumulus list granules "fields=granuleId,status"', 3), {
+            'id': '3', 'args': ['cumulus', 'list', 'granules', 'fields=granuleId,status'], 'after': []
+        })
+        self.assertEqual(parse_command({'id': 'b', 'command': ['rds', '-l'], 'after': 'a'}, 1), {
+            'id': 'b', 'args': ['rds', '-l'], 'after': ['a']
+        })
+        with self.assertRaises(ValueError):
+            parse_command({'id': 'b'}, 1)
+
+    def test_read_commands_duplicate_ids(self):
+        with self.assertRaises(ValueError):
+            read_commands(self.write_commands([{'id': 'a', 'command': 'rds -l'}, {'id': 'a', 'command': 'rds -l'}]))
+
+    def test_batch(self):
+        output = os.path.join(self.tmp_dir.name, 'granules.ndjson')
+        commands = self.write_commands([
+            {'id': 'list', 'command': ['cumulus', '-f', 'ndjson', '-o', output, 'list', 'granules', 'limit=20']},
+            {'id': 'count', 'command': 'cumulus --count list granules limit=20'},
+            {'id': 'bad', 'command': 'rds --refresh'},
+            {'id': 'after_bad', 'command': 'rds -l', 'after': ['bad']},
+            {'id': 'after_list', 'command': 'rds -l granule', 'after': 'list'},
+        ])
+        with FakeStack(20) as stack, stack.patch(), redirect_stdout(io.StringIO()):
+            self.assertEqual(main(commands, workers=4, results_dir=self.results_dir), 1)
+
+        with open(os.path.join(self.results_dir, 'summary.ndjson'), 'r', encoding='utf-8') as file:
+            summary = {record.get('id'): record for record in map(json.loads, file)}
+        self.assertEqual({command_id: record.get('status') for command_id, record in summary.items()}, {
+            'list': 'succeeded', 'count': 'succeeded', 'bad': 'failed', 'after_bad': 'skipped', 'after_list': 'succeeded'
+        })
+        self.assertIn('ValueError', summary.get('bad').get('error') + open(summary.get('bad').get('log')).read())
+        with open(output, 'r', encoding='utf-8') as file:
+            self.assertEqual(len(file.readlines()), 20)
+        with open(os.path.join(self.results_dir, 'count.log'), 'r', encoding='utf-8') as file:
+            self.assertIn('"count": 20', file.read())
+
+    def test_batch_command_outputs(self):
+        input_file = os.path.join(self.tmp_dir.name, 'records.ndjson')
+        with open(input_file, 'w', encoding='utf-8') as file:
+            file.writelines(f'{{"granule_id": "granule_{x:08d}"}}\n' for x in range(4))
+        commands = self.write_commands([
+            {'id': 'three', 'command': ['rds', '--no-cache', '-q', '{"records": "granules", "limit": 3}']},
+            {'id': 'five', 'command': ['rds', '--no-cache', '-q', '{"records": "granules", "limit": 5}']},
+            {'id': 'apply', 'command': ['rds', '-i', input_file, '-a', 'get_granule', '-b', '2']},
+        ])
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        try:
+            with FakeStack(10) as stack, stack.patch(), redirect_stdout(io.StringIO()) as stdout:
+                self.assertEqual(main(commands, workers=3, results_dir=self.results_dir), 0)
+        finally:
+            os.chdir(cwd)
+
+        # Each command writes its default outputs to its own directory
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, 'query_results.json')))
+        for command_id, count in [('three', 3), ('five', 5)]:
+            with open(os.path.join(self.results_dir, command_id, 'query_results.json'), 'r', encoding='utf-8') as file:
+                self.assertEqual(len(json.load(file)), count)
+        # The output of the calls made in the scheduler's threads goes to the command's log
+        with open(os.path.join(self.results_dir, 'apply.log'), 'r', encoding='utf-8') as file:
+            self.assertEqual(file.read().count('Executing: get_granule'), 4)
+        self.assertNotIn('Executing', stdout.getvalue())
+
+    def test_batch_rejects_process_wide_options(self):
+        for command in ['cumulus --metrics metrics.json list granules', 'rds --api-timeout 5 -l', 'rds -r 5 -l granule']:
+            commands = read_commands(self.write_commands([command, 'rds -l granule']))
+            with redirect_stdout(io.StringIO()), self.assertRaisesRegex(ValueError, 'Command 1'):
+                Session().run_batch(commands, results_dir=self.results_dir)
+            self.assertFalse(os.path.exists(self.results_dir))
+
+    def test_batch_sequential(self):
+        commands = self.write_commands(['rds --refresh', 'rds -l granule'])
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(main(commands, results_dir=self.results_dir, sequential=True), 1)
+        with open(os.path.join(self.results_dir, 'summary.ndjson'), 'r', encoding='utf-8') as file:
+            self.assertEqual([json.loads(line).get('status') for line in file], ['failed', 'skipped'])
+
+    def test_batch_cycle(self):
+        commands = read_commands(self.write_commands([
+            {'id': 'a', 'command': 'rds -l', 'after': 'b'}, {'id': 'b', 'command': 'rds -l', 'after': 'a'}
+        ]))
+        with redirect_stdout(io.StringIO()), self.assertRaises(ValueError):
+            Session().run_batch(commands, results_dir=self.results_dir)
+
+    def test_session_rejects_nested_sessions(self):
+        with redirect_stdout(io.StringIO()), self.assertRaises(ValueError):
+            Session().run(['batch', 'commands.ndjson'])
+
+
+if __name__ == '__main__':
+    unittest.main()
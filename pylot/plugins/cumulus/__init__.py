@@ -1 +1 @@
-# import main
+PLUGIN_HELP = 'This plugin provides a commandline interface to the cumulus api endpoints.'
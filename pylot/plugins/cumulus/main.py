@@ -1,13 +1,21 @@
 import argparse
+import concurrent.futures
 import inspect
 import json
+import math
 import os
 from argparse import RawTextHelpFormatter, SUPPRESS
+from importlib import metadata
 from inspect import getmembers, isfunction, ismethod
+from tempfile import gettempdir
 
-import boto3
 from cumulus_api import CumulusApi
+from .. import cumulus
+from ..helpers.aggregator import add_aggregation_arguments, get_aggregator
+from ..helpers.command_context import bind_command
 from ..helpers.pylot_helpers import PyLOTHelpers
+from ..helpers.rate_limiter import configure_rate_limits, rate_limited
+from ..helpers.record_writers import RECORD_WRITERS, get_record_writer, records_to_stdout
 
 
 def is_action_function(value):
@@ -48,10 +56,53 @@ def extract_action_target_args(target_class=CumulusApi):
     return action_target_dict
 
 
+def get_cumulus_api_version():
+    try:
+        version = metadata.version('cumulus-api')
+    except metadata.PackageNotFoundError:
+        version = None
+    return version
+
+
+def load_action_target_args(target_class=CumulusApi, version=None, cache_dir=None):
+    """
+    Returns the extract_action_target_args dictionary from an on-disk manifest keyed by the cumulus_api version so
+    the CumulusApi class only needs to be introspected once per installed version. If the version cannot be
+    determined the manifest is not used.
+    :param target_class: class to extract the action target dictionary from
+    :param version: cumulus_api version. The installed version is used if not provided.
+    :param cache_dir: directory to store the manifest in
+    :return: {"action": {"target": [arguments]}}
+    """
+    version = version or get_cumulus_api_version()
+    if not version:
+        return extract_action_target_args(target_class)
+
+    cache_dir = cache_dir or f'{gettempdir()}/pylot_cache/'
+    manifest_file = os.path.join(cache_dir, f'{target_class.__name__}_{version}.json')
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as _file:
+            return json.load(_file)
+    except (OSError, ValueError):
+        pass
+
+    action_target_dict = extract_action_target_args(target_class)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f'{manifest_file}.{os.getpid()}'
+        with open(tmp_file, 'w+', encoding='utf-8') as _file:
+            json.dump(action_target_dict, _file)
+        os.replace(tmp_file, manifest_file)
+    except OSError as err:
+        print(f'Unable to write CLI manifest {manifest_file}: {err}')
+
+    return action_target_dict
+
+
 def generate_parser(subparsers, action_target_dict):
     cumulus_api_parser = subparsers.add_parser(
         'cumulus',
-        help='This plugin provides a commandline interface to the cumulus api endpoints.',
+        help=cumulus.PLUGIN_HELP,
         description='Provides commandline access to the cumulus api. To see available arguments '
                     'check the cumulus documentation here: https://nasa.github.io/cumulus-api/#cumulus-api\n'
                     'If more than 10 records are needed to be returned use the limit keyword argument: limit=XX\n'
@@ -67,6 +118,21 @@ def generate_parser(subparsers, action_target_dict):
     cumulus_api_parser.add_argument(
         '-o', '--output', metavar='file.json', help='specify a json file to write api response to.', nargs='?'
     )
+    cumulus_api_parser.add_argument(
+        '-p', '--parallel-pages', metavar='N', type=int, default=1,
+        help='number of pages to request concurrently once the total record count is known.'
+    )
+    cumulus_api_parser.add_argument(
+        '-f', '--format', dest='output_format', choices=RECORD_WRITERS, default='json',
+        help='json buffers and indents the full response. ndjson and json-stream write each page as it arrives. '
+             'csv and parquet write the fields= fields, or every field of the first page, as columns with nested '
+             'fields flattened into dotted names. parquet requires -o and pyarrow.'
+    )
+    cumulus_api_parser.add_argument(
+        '-r', '--max-rate', metavar='N', type=float,
+        help='maximum number of Cumulus API requests per second across all endpoints.'
+    )
+    add_aggregation_arguments(cumulus_api_parser)
 
     action_subparsers = cumulus_api_parser.add_subparsers(title='actions', dest='action', required=True)
     for action_k, target_v in action_target_dict.items():
@@ -97,51 +163,99 @@ def generate_parser(subparsers, action_target_dict):
 
 
 def return_parser(subparsers):
-    new_command_dict = extract_action_target_args()
+    new_command_dict = load_action_target_args()
     return generate_parser(subparsers, new_command_dict)
 
 
-def main(action, target, output=None, **kwargs):
-    print(f'kwargs here: {kwargs}')
-    capi = PyLOTHelpers().get_cumulus_api_instance()
-    data_val = kwargs.get('data', None)
-    if data_val:
-        if os.path.isfile(data_val):
-            print(f'Reading datafile: {data_val}')
-            with open(data_val, 'r', encoding='utf-8') as file:
-                kwargs.update({'data': json.load(file)})
-        else:
-            kwargs.update({'data': json.loads(data_val)})
-
-    cumulus_api_lambda_return_limit = 100
-    limit = kwargs.pop('limit', cumulus_api_lambda_return_limit)
-    function_name = f'{action}_{target}'
-    print(f'Calling Cumulus API: {function_name}')
-    api_function = getattr(capi, function_name)
-    results = []
-    while True:
-        api_response = api_function(**kwargs)
-        if isinstance(api_response, dict) and 'results' in api_response:
-            api_response = error_handling(api_response, api_function, **kwargs)
-            kwargs.update({'page': api_response.get('meta', {}).get('page', 1) + 1})
-            record_count = api_response.get('meta', {}).get('count', 0)
-            api_results = api_response.get('results', [])            
-            results.extend(api_results[:limit - (len(results))])
-            if len(results) >= limit or len(results) >= record_count:
+def fetch_pages(api_function, first_response, limit, parallel_pages=1, **kwargs):
+    """
+    Generator yielding the records of a paged Cumulus API response one page at a time, in page order.
+    The first response provides meta.count and the page size, after which the remaining pages are requested with up to
+    parallel_pages requests in flight.
+    :param api_function: CumulusApi member function that produced first_response
+    :param first_response: the response dictionary for the first page
+    :param limit: maximum number of records to yield
+    :param parallel_pages: number of pages to request concurrently
+    :param kwargs: keyword arguments passed to api_function for every page
+    :return: generator of record lists
+    """
+    first_response = error_handling(first_response, api_function, **kwargs)
+    meta = first_response.get('meta', {})
+    first_results = first_response.get('results', [])[:limit]
+    yield first_results
+
+    remaining = min(limit, meta.get('count', 0)) - len(first_results)
+    page_size = len(first_response.get('results', []))
+    if remaining <= 0 or page_size == 0:
+        return
+
+    first_page = meta.get('page', 1) + 1
+    last_page = first_page + math.ceil(remaining / page_size)
+    pages = iter(range(first_page, last_page))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(parallel_pages, 1)) as executor:
+        futures = []
+        for page in pages:
+            futures.append(executor.submit(bind_command(api_function), **{**kwargs, 'page': page}))
+            if len(futures) >= parallel_pages:
                 break
-        else:
-            results = api_response
-            break
-
-    json_results = json.dumps(results, indent=2, sort_keys=True)
-    if output:
-        with open(output, 'w+', encoding='utf-8') as outfile:
-            outfile.write(json_results)
-        print(f'Results written to: {output}')
-    else:
-        print(json_results)
 
-    return 0
+        while futures and remaining > 0:
+            api_response = error_handling(futures.pop(0).result(), api_function, **kwargs)
+            api_results = api_response.get('results', [])[:remaining]
+            if not api_results:
+                break
+            remaining -= len(api_results)
+            yield api_results
+
+            page = next(pages, None)
+            if page is not None:
+                futures.append(executor.submit(bind_command(api_function), **{**kwargs, 'page': page}))
+
+        for future in futures:
+            future.cancel()
+
+
+def main(action, target, output=None, parallel_pages=1, output_format='json', max_rate=None, group_by=None,
+         count=False, min_fields=None, max_fields=None, filters=None, **kwargs):
+    # Diagnostics go to stderr when the response is written to stdout
+    with records_to_stdout(not output):
+        print(f'kwargs here: {kwargs}')
+        aggregator = get_aggregator(group_by, count, min_fields, max_fields, filters)
+        capi = PyLOTHelpers().get_cumulus_api_instance()
+        data_val = kwargs.get('data', None)
+        if data_val:
+            if os.path.isfile(data_val):
+                print(f'Reading datafile: {data_val}')
+                with open(data_val, 'r', encoding='utf-8') as file:
+                    kwargs.update({'data': json.load(file)})
+            else:
+                kwargs.update({'data': json.loads(data_val)})
+
+        cumulus_api_lambda_return_limit = 100
+        limit = kwargs.pop('limit', cumulus_api_lambda_return_limit)
+        function_name = f'{action}_{target}'
+        print(f'Calling Cumulus API: {function_name}')
+        if max_rate:
+            configure_rate_limits('cumulus', service_rate=max_rate)
+        api_function = rate_limited(getattr(capi, function_name), f'cumulus.{function_name}')
+        api_response = api_function(**kwargs)
+        with get_record_writer(output_format, output, None if aggregator else kwargs.get('fields')) as writer:
+            if isinstance(api_response, dict) and 'results' in api_response:
+                for page_results in fetch_pages(api_function, api_response, limit, parallel_pages, **kwargs):
+                    if aggregator:
+                        aggregator.add_all(page_results)
+                    else:
+                        writer.write(page_results)
+            elif aggregator:
+                aggregator.add_all(api_response if isinstance(api_response, list) else [api_response])
+            else:
+                writer.write_value(api_response)
+            if aggregator:
+                print(aggregator.summary())
+                writer.write(aggregator.results())
+
+        return 0
+
 
 def error_handling(results, api_function, **kwargs):
     ret = ''
@@ -149,7 +263,7 @@ def error_handling(results, api_function, **kwargs):
         error_message = results.get('message', '')
         if 'Member must have length less than or equal to 8192' in error_message:
             print(f'Handling error: {error_message}')
-            cli = boto3.client('s3')
+            cli = PyLOTHelpers.get_boto3_client('s3')
             stack_prefix = os.getenv('STACK_PREFIX')
             if not stack_prefix:
                 raise ValueError('The STACK_PREFIX environment variable has not been set')
@@ -188,7 +302,7 @@ def error_handling(results, api_function, **kwargs):
                     Key=dgw
                 )
 
-                ec = boto3.client('events')
+                ec = PyLOTHelpers.get_boto3_client('events')
                 rule_name = f'{stack_prefix}-custom-{kwargs.get("data").get("name")}'
                 res = ec.list_targets_by_rule(Rule=rule_name)
                 print('Updating rule targets HelloWorldWorkflow -> DiscoverGranules')
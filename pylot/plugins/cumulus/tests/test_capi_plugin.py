@@ -1,8 +1,15 @@
 import argparse
 import inspect
+import io
+import json
+import os
+import tempfile
 import unittest
+from contextlib import redirect_stderr, redirect_stdout
 
-from pylot.plugins.cumulus.main import is_action_function, extract_action_target_args, generate_parser
+from pylot.plugins.cumulus.main import is_action_function, extract_action_target_args, generate_parser, fetch_pages, \
+    load_action_target_args, main
+from pylot.tests.fake_stack import FakeStack
 
 
 class FakeClass:
@@ -22,6 +29,16 @@ class FakeClass:
         pass
 
 
+def fake_list_function(count, page_size=10):
+    def list_records(page=1, **kwargs):
+        start = (page - 1) * page_size
+        return {
+            'meta': {'count': count, 'page': page},
+            'results': [{'id': x} for x in range(start, min(start + page_size, count))]
+        }
+    return list_records
+
+
 class TestCumulusApi(unittest.TestCase):
     def test_fake_class(self):
         fc = FakeClass()
@@ -42,6 +59,19 @@ class TestCumulusApi(unittest.TestCase):
         res = extract_action_target_args(FakeClass)
         self.assertEqual(res, {'public': {'function': ['data', 'not_data']}, 'static': {'function': ['not_data']}})
 
+    def test_load_action_target_args(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            res = load_action_target_args(FakeClass, version='1.0', cache_dir=cache_dir)
+            manifest_file = os.path.join(cache_dir, 'FakeClass_1.0.json')
+            with open(manifest_file, 'r', encoding='utf-8') as manifest:
+                self.assertEqual(json.load(manifest), res)
+
+            with open(manifest_file, 'w', encoding='utf-8') as manifest:
+                json.dump({'cached': {'target': []}}, manifest)
+            self.assertEqual(load_action_target_args(FakeClass, version='1.0', cache_dir=cache_dir),
+                             {'cached': {'target': []}})
+            self.assertEqual(load_action_target_args(FakeClass, version='2.0', cache_dir=cache_dir), res)
+
     def test_generate_parser(self):
         parser = argparse.ArgumentParser(
             usage='<plugin> -h to access help for each plugin. \n',
@@ -53,6 +83,39 @@ class TestCumulusApi(unittest.TestCase):
         res = generate_parser(subparsers, extract_action_target_args(FakeClass))
         print(res)
 
+    def test_fetch_pages_parallel_order(self):
+        api_function = fake_list_function(count=95)
+        pages = list(fetch_pages(api_function, api_function(), limit=1000, parallel_pages=4))
+        records = [record.get('id') for page in pages for record in page]
+        self.assertEqual(len(pages), 10)
+        self.assertEqual(records, list(range(95)))
+
+    def test_fetch_pages_limit(self):
+        api_function = fake_list_function(count=95)
+        pages = list(fetch_pages(api_function, api_function(), limit=25, parallel_pages=8))
+        records = [record.get('id') for page in pages for record in page]
+        self.assertEqual(records, list(range(25)))
+
+    def test_main_aggregation(self):
+        with FakeStack(30) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'counts.json')
+            with redirect_stdout(io.StringIO()):
+                main('list', 'granules', output=output, group_by='status', filters=['collectionId=collection___1'],
+                     limit=30)
+            with open(output, 'r', encoding='utf-8') as file:
+                self.assertEqual(json.load(file), [
+                    {'count': 1, 'status': 'completed'}, {'count': 1, 'status': 'failed'}, {'count': 1, 'status': 'running'}
+                ])
+
+    def test_main_ndjson_stdout(self):
+        with FakeStack(30) as stack, stack.patch():
+            with redirect_stdout(io.StringIO()) as stdout, redirect_stderr(io.StringIO()) as stderr:
+                main('list', 'granules', output_format='ndjson', limit=20)
+        # Only the records are written to stdout so it can be parsed line by line
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(len(records), 20)
+        self.assertIn('Calling Cumulus API: list_granules', stderr.getvalue())
+
 
 if __name__ == '__main__':
     pass
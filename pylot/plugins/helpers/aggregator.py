@@ -0,0 +1,185 @@
+import operator
+import re
+from datetime import datetime, timezone
+
+from .record_writers import get_field
+
+FILTER = re.compile(r'^\s*([\w.]+)\s*(!=|>=|<=|=|>|<|~)\s*(.*?)\s*$')
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '~': lambda value, substring: substring in str(value)
+}
+TRUNCATE = {
+    'hour': '%Y-%m-%dT%H:00',
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m',
+    'year': '%Y',
+}
+
+
+def to_datetime(value):
+    """
+    Parses epoch milliseconds, as returned by the Cumulus API, or an ISO 8601 string, as returned by the RDS lambda.
+    :return: timezone aware datetime or None if the value is not a timestamp
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    try:
+        timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def comparable(value, reference):
+    """
+    Converts a filter value to the type of the record value it is compared with so numbers compare numerically and
+    ISO dates can be compared with epoch millisecond timestamps.
+    """
+    if isinstance(reference, (int, float)) and not isinstance(reference, bool):
+        try:
+            return float(value)
+        except ValueError:
+            timestamp = to_datetime(value)
+            return timestamp.timestamp() * 1000 if timestamp else value
+    if isinstance(reference, bool):
+        return str(value).lower() == 'true'
+    return value
+
+
+def parse_filter(expression):
+    """
+    "status=failed", "updatedAt>=2024-01-01", "granuleId~_2023" -> (field, operator function, value)
+    """
+    match = FILTER.match(expression)
+    if not match:
+        raise ValueError(
+            f'Invalid filter {expression}. Use <field><operator><value> with one of {", ".join(OPERATORS)}'
+        )
+    field, op, value = match.groups()
+    return field, OPERATORS[op], value
+
+
+def group_value(record, group_by):
+    """
+    Returns the value of a group by field. "<field>:<hour|day|month|year>" groups timestamps by the truncated date.
+    """
+    field, _, truncate = group_by.partition(':')
+    value = get_field(record, field)
+    if truncate:
+        if truncate not in TRUNCATE:
+            raise ValueError(f'Unsupported date truncation {truncate}. Choose from: {", ".join(TRUNCATE)}')
+        timestamp = to_datetime(value)
+        value = timestamp.strftime(TRUNCATE[truncate]) if timestamp else None
+    return value
+
+
+class Aggregator:
+    """
+    Streaming group by over records. Only one entry per group is kept in memory: the count and the smallest and
+    largest value of each min and max field, so records can be aggregated as they are read.
+    """
+    def __init__(self, group_by=None, min_fields=None, max_fields=None, filters=None):
+        self.group_by = group_by or []
+        self.min_fields = min_fields or []
+        self.max_fields = max_fields or []
+        self.filters = [parse_filter(expression) for expression in filters or []]
+        self.groups = {}
+        self.records = 0
+        self.matched = 0
+
+    def matches(self, record):
+        for field, op, value in self.filters:
+            record_value = get_field(record, field)
+            if record_value is None or not op(record_value, comparable(value, record_value)):
+                return False
+        return True
+
+    def add(self, record):
+        self.records += 1
+        if not self.matches(record):
+            return
+        self.matched += 1
+        key = tuple(group_value(record, group_by) for group_by in self.group_by)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = {'count': 0, 'min': {}, 'max': {}}
+        group['count'] += 1
+        for fields, name, better in [(self.min_fields, 'min', operator.lt), (self.max_fields, 'max', operator.gt)]:
+            for field in fields:
+                value = get_field(record, field)
+                if value is None:
+                    continue
+                current = group[name].get(field)
+                try:
+                    if current is None or better(value, current):
+                        group[name][field] = value
+                except TypeError:
+                    # Mixed types, e.g. a number and a string, are compared as strings
+                    if better(str(value), str(current)):
+                        group[name][field] = value
+
+    def add_all(self, records):
+        for record in records:
+            self.add(record)
+        return self
+
+    def results(self):
+        """
+        :return: one record per group, sorted by the group values, with the count and the min and max values
+        """
+        results = []
+        for key, group in sorted(self.groups.items(), key=lambda item: [str(value) for value in item[0]]):
+            result = dict(zip(self.group_by, key))
+            result.update({'count': group.get('count')})
+            for name in ['min', 'max']:
+                for field in getattr(self, f'{name}_fields'):
+                    result.update({f'{name}_{field}': group.get(name).get(field)})
+            results.append(result)
+        if not results and not self.group_by:
+            results.append({'count': 0})
+
+        return results
+
+    def summary(self):
+        return f'Aggregated {self.matched} of {self.records} records into {len(self.groups)} groups'
+
+
+def add_aggregation_arguments(parser):
+    parser.add_argument(
+        '--group-by', metavar='FIELDS',
+        help='aggregate the records instead of writing them, grouped by these comma separated fields. '
+             'Timestamps can be grouped by date with <field>:<hour|day|month|year>, e.g. updatedAt:day.'
+    )
+    parser.add_argument('--count', action='store_true', help='count the records, or the records in each group.')
+    parser.add_argument(
+        '--min', dest='min_fields', metavar='FIELDS', help='smallest value of these comma separated fields per group.'
+    )
+    parser.add_argument(
+        '--max', dest='max_fields', metavar='FIELDS', help='largest value of these comma separated fields per group.'
+    )
+    parser.add_argument(
+        '--filter', dest='filters', metavar='EXPRESSION', action='append',
+        help='only aggregate records matching <field><operator><value> where the operator is one of '
+             '=, !=, >, >=, <, <= or ~ (contains), e.g. "status=failed" or "updatedAt>=2024-01-01". Can be repeated.'
+    )
+
+
+def get_aggregator(group_by=None, count=False, min_fields=None, max_fields=None, filters=None, **kwargs):
+    """
+    Returns an Aggregator for the aggregation arguments or None if no aggregation was requested.
+    """
+    if not any([group_by, count, min_fields, max_fields, filters]):
+        return None
+
+    def split(fields):
+        return [field.strip() for field in fields.split(',') if field.strip()] if fields else []
+
+    return Aggregator(split(group_by), split(min_fields), split(max_fields), filters)
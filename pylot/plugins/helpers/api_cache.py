@@ -0,0 +1,204 @@
+import concurrent.futures
+import inspect
+import json
+import threading
+import types
+from collections import OrderedDict
+from time import monotonic
+
+CACHED_PREFIXES = ('get_', 'list_')
+# Reads of a status that is polled until it changes
+UNCACHED_METHODS = {'get_async_operation'}
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 10000
+
+_api_cache = None
+_api_cache_lock = threading.Lock()
+
+
+def record_tags(value):
+    """
+    Collects the scalar values of call arguments, including the granule ids and collection names nested at any depth
+    in data dictionaries and lists, e.g. {"granules": [{"granuleId": ...}]}, to identify the records a call reads or
+    changes.
+    """
+    if isinstance(value, dict):
+        return set().union(*(record_tags(item) for item in value.values()))
+    if isinstance(value, (list, tuple)):
+        return set().union(*(record_tags(item) for item in value))
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return {str(value)}
+    return set()
+
+
+def record_type(method_name):
+    """
+    get_granule, list_granules, apply_workflow_to_granule -> granule
+    """
+    return method_name.rsplit('_', maxsplit=1)[-1].rstrip('s')
+
+
+def is_cacheable(rsp):
+    return not (isinstance(rsp, dict) and ('error' in rsp or rsp.get('statusCode', 200) >= 400))
+
+
+class ApiCache:
+    """
+    Thread safe LRU cache of Cumulus API read responses. Entries expire ttl seconds after they were fetched and the
+    least recently used entry is evicted once there are max_entries. Concurrent identical calls are coalesced into one
+    call whose response every caller receives. Each entry is tagged with its call's argument values and a mutating call
+    removes the entries sharing one of its values, the list entries of the record type it changes, or every entry if
+    it has no arguments to match.
+    """
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        # Incremented by every invalidation so a read that started before it is not cached
+        self.generation = 0
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'invalidations': 0}
+
+    @staticmethod
+    def key(method_name, args, kwargs):
+        return method_name, json.dumps([args, kwargs], sort_keys=True, default=str)
+
+    def call(self, method_name, function, *args, **kwargs):
+        key = self.key(method_name, args, kwargs)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and monotonic() < entry.get('expires'):
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry.get('value')
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                self.stats['misses'] += 1
+                future = self.in_flight[key] = concurrent.futures.Future()
+                generation = self.generation
+            else:
+                self.stats['coalesced'] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            value = function(*args, **kwargs)
+        except Exception as err:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            future.set_exception(err)
+            raise
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if is_cacheable(value) and generation == self.generation:
+                self.entries[key] = {
+                    'value': value,
+                    'expires': monotonic() + self.ttl,
+                    'type': record_type(method_name),
+                    'list': method_name.startswith('list_'),
+                    'tags': record_tags([args, kwargs])
+                }
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        future.set_result(value)
+
+        return value
+
+    def invalidate(self, method_name, args=(), kwargs=None):
+        tags = record_tags([args, kwargs or {}])
+        changed_type = record_type(method_name)
+        with self.lock:
+            self.generation += 1
+            stale = [
+                key for key, entry in self.entries.items()
+                if not tags or entry.get('tags') & tags or (entry.get('list') and entry.get('type') == changed_type)
+            ]
+            for key in stale:
+                self.entries.pop(key)
+            self.stats['invalidations'] += len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def summary(self):
+        return f'API cache: {self.stats.get("hits")} hits, {self.stats.get("misses")} misses, ' \
+               f'{self.stats.get("coalesced")} coalesced, {self.stats.get("invalidations")} invalidated'
+
+
+class CachingCumulusApi:
+    """
+    Wraps a CumulusApi instance so its get_* and list_* methods are served from an ApiCache and every other method
+    invalidates the entries it may change. Methods keep the signature of the wrapped method so the arguments of an
+    action can still be inspected, and attributes such as TOKEN are read from and written to the wrapped instance.
+    """
+    def __init__(self, api, cache):
+        object.__setattr__(self, 'api', api)
+        object.__setattr__(self, 'cache', cache)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.api, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+        return self.method(name, attribute)
+
+    def method(self, name, call):
+        """
+        :param name: CumulusApi method name
+        :param call: function making the API call, the wrapped instance's method or a wrapper around it
+        """
+        cache = self.cache
+        if name in UNCACHED_METHODS:
+            def method(_self, *args, **kwargs):
+                return call(*args, **kwargs)
+        elif name.startswith(CACHED_PREFIXES):
+            def method(_self, *args, **kwargs):
+                return cache.call(name, call, *args, **kwargs)
+        else:
+            def method(_self, *args, **kwargs):
+                try:
+                    return call(*args, **kwargs)
+                finally:
+                    cache.invalidate(name, args, kwargs)
+
+        method.__name__ = name
+        method.__doc__ = call.__doc__
+        unbound = getattr(type(self.api), name, None)
+        if unbound is not None:
+            try:
+                method.__signature__ = inspect.signature(unbound)
+            except (TypeError, ValueError):
+                pass
+        # Lets rate_limited wrap only the calls that miss the cache
+        method.around = lambda wrap: self.method(name, wrap(call))
+        return types.MethodType(method, self)
+
+    def __setattr__(self, name, value):
+        setattr(self.api, name, value)
+
+
+def configure_api_cache(ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Enables caching of the Cumulus API reads made through PyLOTHelpers.get_cumulus_api_instance.
+    """
+    global _api_cache
+    with _api_cache_lock:
+        _api_cache = ApiCache(ttl, max_entries)
+        return _api_cache
+
+
+def get_api_cache():
+    """
+    :return: the ApiCache or None if caching has not been enabled
+    """
+    return _api_cache
+
+
+def reset_api_cache():
+    global _api_cache
+    with _api_cache_lock:
+        _api_cache = None
@@ -0,0 +1,119 @@
+from collections import Counter
+from time import sleep
+
+from .rate_limiter import rate_limited
+
+# Per-granule actions with a Cumulus bulk granule operation. "arguments" maps the per-granule action's arguments to the
+# fields of the bulk request body and "executions" is whether the operation starts workflow executions.
+BULK_ACTIONS = {
+    'apply_workflow_to_granule': {
+        'function': 'bulk_granules',
+        'arguments': {'workflow_name': 'workflowName', 'queue_url': 'queueUrl'},
+        'required': ['workflow_name'],
+        'executions': True
+    },
+    'reingest_granule': {
+        'function': 'bulk_reingest',
+        'arguments': {'workflow_name': 'workflowName', 'execution_arn': 'executionArn'},
+        'required': [],
+        'executions': True
+    },
+    'delete_granule': {
+        'function': 'bulk_delete',
+        'arguments': {'force_remove_from_cmr': 'forceRemoveFromCmr'},
+        'required': [],
+        'executions': False
+    },
+}
+ASYNC_OPERATION_DONE = {'SUCCEEDED', 'RUNNER_FAILED', 'TASK_FAILED'}
+# Status given to an async operation that could not be read max_errors times in a row, see wait_for_async_operations
+POLL_FAILED = 'POLL_FAILED'
+
+
+def check_bulk_arguments(action, api_arg_dict):
+    """
+    Raises a ValueError if the -args lack an argument the bulk operation of action requires, e.g. the workflow_name of
+    apply_workflow_to_granule. Called once before any request is built, see bulk_request.
+    """
+    missing = [arg for arg in BULK_ACTIONS.get(action).get('required') if arg not in api_arg_dict]
+    if missing:
+        raise ValueError(f'{action} needs {", ".join(missing)} in -args to run as a bulk operation.')
+
+
+def bulk_request(call_args_list, action, api_arg_dict):
+    """
+    Builds the body of a bulk granule request from the call arguments of the per-granule action. Granules are listed
+    with their collection when every record has a collection_id and by granule id otherwise.
+    :param call_args_list: list of {"granule_id": ..., "collection_id": ...}
+    :param action: per-granule action, e.g. apply_workflow_to_granule
+    :param api_arg_dict: arguments provided with -args, applied to every granule in the request. They must have
+        passed check_bulk_arguments.
+    """
+    bulk_action = BULK_ACTIONS.get(action)
+    data = {
+        field: api_arg_dict.get(arg) for arg, field in bulk_action.get('arguments').items() if arg in api_arg_dict
+    }
+    if 'forceRemoveFromCmr' in data:
+        data['forceRemoveFromCmr'] = str(data.get('forceRemoveFromCmr')).lower() == 'true'
+    if all(call_args.get('collection_id') for call_args in call_args_list):
+        data['granules'] = [
+            {'granuleId': call_args.get('granule_id'), 'collectionId': call_args.get('collection_id')}
+            for call_args in call_args_list
+        ]
+    else:
+        data['ids'] = [call_args.get('granule_id') for call_args in call_args_list]
+
+    return data
+
+
+def read_async_operation(get_async_operation, operation_id):
+    """
+    :return: (async operation record, None), or (None, error message) if the operation could not be read
+    """
+    try:
+        operation = get_async_operation(async_operation_id=operation_id)
+    except Exception as err:
+        return None, f'{type(err).__name__}: {err}'
+    # The Cumulus API returns errors as a response body, e.g. {"error": "Not Found", "statusCode": 404}
+    if not isinstance(operation, dict) or 'error' in operation or operation.get('statusCode', 200) >= 400:
+        return None, str(operation)
+
+    return operation, None
+
+
+def wait_for_async_operations(capi, operations, min_delay=5, max_delay=60, max_errors=5):
+    """
+    Polls async operations until they finish. The delay between rounds doubles while nothing finishes. An operation
+    that can not be read max_errors times in a row is given up on and returned with the POLL_FAILED status.
+    :param capi: CumulusApi instance
+    :param operations: {async operation id: label printed with its progress}
+    :return: {async operation id: final async operation record}
+    """
+    get_async_operation = rate_limited(capi.get_async_operation, 'cumulus.get_async_operation')
+    pending = dict(operations)
+    errors = Counter()
+    finished = {}
+    delay = min_delay
+    while pending:
+        done = 0
+        for operation_id, label in list(pending.items()):
+            operation, error = read_async_operation(get_async_operation, operation_id)
+            if error:
+                errors[operation_id] += 1
+                print(f'{label}: unable to get async operation {operation_id}: {error}')
+                if errors[operation_id] < max_errors:
+                    continue
+                operation = {'id': operation_id, 'status': POLL_FAILED, 'output': error}
+            errors.pop(operation_id, None)
+            status = operation.get('status', '')
+            if status in ASYNC_OPERATION_DONE or status == POLL_FAILED:
+                print(f'{label}: async operation {operation_id} {status}')
+                finished[operation_id] = operation
+                pending.pop(operation_id)
+                done += 1
+        if pending:
+            print(f'{len(finished)} async operations finished, {len(pending)} running')
+            delay = min_delay if done else min(delay * 2, max_delay)
+            sleep(delay)
+
+    return finished
@@ -0,0 +1,54 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# The output stream and directory of the batch command running in each thread
+_command = threading.local()
+
+
+def current_command():
+    """
+    :return: (stream, directory) of the batch command running in this thread, or (None, None)
+    """
+    return getattr(_command, 'stream', None), getattr(_command, 'directory', None)
+
+
+@contextmanager
+def command_context(stream=None, directory=None):
+    """
+    Sends the output printed by this thread to stream and the default output files of the command to directory.
+    """
+    previous = current_command()
+    _command.stream, _command.directory = stream, directory
+    try:
+        yield
+    finally:
+        _command.stream, _command.directory = previous
+
+
+def bind_command(function):
+    """
+    Wraps function to run in the command context of the calling thread. Used for the calls submitted to thread pools
+    so their output goes to the log of the batch command that submitted them.
+    """
+    context = current_command()
+    if context == (None, None):
+        return function
+
+    def run(*args, **kwargs):
+        with command_context(*context):
+            return function(*args, **kwargs)
+
+    return run
+
+
+def output_path(name):
+    """
+    Path of a default output file, e.g. query_results.json. It is written to the working directory, or to the batch
+    command's own directory so concurrent commands do not overwrite each other's files.
+    """
+    directory = current_command()[1]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    return os.path.join(directory or os.getcwd(), name)
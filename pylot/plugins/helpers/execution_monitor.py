@@ -0,0 +1,206 @@
+from collections import Counter
+from time import monotonic, sleep
+
+from tabulate import tabulate
+
+from .pylot_helpers import PyLOTHelpers
+from .rate_limiter import is_throttled_error, rate_limited
+from .scheduler import sliding_window
+
+
+def get_state_machine_arn(execution_arn):
+    """
+    arn:aws:states:<region>:<account>:execution:<state_machine>:<name> ->
+    arn:aws:states:<region>:<account>:stateMachine:<state_machine>
+    """
+    parts = execution_arn.split(':')
+    return ':'.join([*parts[:5], 'stateMachine', parts[6]])
+
+
+class ExecutionMonitor:
+    """
+    Waits for Step Function executions to finish while only polling the executions that are still pending. Each round
+    lists the RUNNING executions of the involved state machines, which costs one call per thousand running executions,
+    and only describes the executions that are no longer in that list. The delay between rounds doubles while nothing
+    finishes and resets once executions complete or the API stops throttling.
+    """
+    def __init__(self, sfn_client=None, workers=5, min_delay=2, max_delay=60):
+        if not sfn_client:
+            sfn_client = PyLOTHelpers.get_boto3_client('stepfunctions')
+        self.sfn_client = sfn_client
+        self.workers = workers
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.tally = Counter()
+        self.failures = []
+
+    def resolve_execution_arns(self, responses, capi, started_after=None, timeout=120):
+        """
+        Looks up the execution of each granule in the API responses concurrently. Granules processed by the same
+        execution, e.g. by a bulk operation, are listed under that execution. The granule record may still point to
+        the execution of an earlier request, so with started_after only executions that started after it are accepted
+        and the other granules are looked up again until timeout seconds have passed. Granules whose lookup fails or
+        that have no new execution by then are reported as failures.
+        :param responses: Cumulus API responses containing a granuleId
+        :param capi: CumulusApi instance
+        :param started_after: timezone aware datetime at which the requests were submitted
+        :param timeout: seconds to wait for the executions to start
+        :return: {execution_arn: [granule_id, ...]}
+        """
+        pending = [response.get('granuleId') for response in responses if isinstance(response, dict)]
+        pending = [granule_id for granule_id in pending if granule_id]
+        executions = {}
+        start_dates = {}
+        deadline = monotonic() + timeout
+        delay = self.min_delay
+        while True:
+            pending = self.lookup_executions(pending, capi, started_after, executions, start_dates)
+            if not pending or monotonic() >= deadline:
+                break
+            print(f'Waiting for the executions of {len(pending)} granules to start')
+            sleep(min(delay, max(deadline - monotonic(), 0)))
+            delay = min(delay * 2, self.max_delay)
+
+        for granule_id in pending:
+            self.add_failure(granule_id, 'NOT_STARTED', f'No execution started within {timeout} seconds')
+
+        return executions
+
+    def lookup_executions(self, granule_ids, capi, started_after, executions, start_dates):
+        """
+        Adds the granules whose execution started after started_after to executions.
+        :param start_dates: {execution_arn: startDate} of the executions described so far
+        :return: list of the granules that have no such execution yet
+        """
+        waiting = []
+        get_granule = rate_limited(capi.get_granule, 'cumulus.get_granule')
+        for call_args, future in sliding_window(
+                get_granule, ({'granule_id': granule_id} for granule_id in granule_ids), self.workers
+        ):
+            granule_id = call_args.get('granule_id')
+            try:
+                rsp = future.result()
+            except Exception as err:
+                self.add_failure(granule_id, 'LOOKUP_FAILED', f'Unable to get the granule: {type(err).__name__}: {err}')
+                continue
+            # The Cumulus API returns errors as a response body, e.g. {"error": "Not Found", "statusCode": 404}
+            if not isinstance(rsp, dict) or 'error' in rsp or rsp.get('statusCode', 200) >= 400:
+                self.add_failure(granule_id, 'LOOKUP_FAILED', f'Unable to get the granule: {rsp}')
+                continue
+            execution_arn = rsp.get('execution', '').rsplit('/')[-1]
+            if execution_arn and self.started_after(execution_arn, started_after, start_dates):
+                executions.setdefault(execution_arn, []).append(granule_id)
+                print(f'{granule_id}: {execution_arn}')
+            else:
+                waiting.append(granule_id)
+
+        return waiting
+
+    def started_after(self, execution_arn, started_after, start_dates):
+        """
+        :return: True if the execution started after started_after, or if its start date can not be checked
+        """
+        if not started_after:
+            return True
+        if execution_arn not in start_dates:
+            describe_execution = rate_limited(self.sfn_client.describe_execution, 'stepfunctions.describe_execution')
+            try:
+                start_dates[execution_arn] = describe_execution(executionArn=execution_arn).get('startDate')
+            except Exception as err:
+                # wait reports the executions that can not be described
+                print(f'Unable to check the start date of {execution_arn}: {err}')
+                start_dates[execution_arn] = None
+        start_date = start_dates.get(execution_arn)
+
+        return start_date is None or start_date >= started_after
+
+    def add_failure(self, granule_id, status, error, execution_arn=''):
+        print(f'{granule_id}: {error}')
+        self.tally[status] += 1
+        self.failures.append({'granule_id': granule_id, 'status': status, 'error': error, 'execution_arn': execution_arn})
+
+    def list_running(self, state_machine_arn):
+        list_executions = rate_limited(self.sfn_client.list_executions, 'stepfunctions.list_executions')
+        running = set()
+        kwargs = {'stateMachineArn': state_machine_arn, 'statusFilter': 'RUNNING', 'maxResults': 1000}
+        while True:
+            page = list_executions(**kwargs)
+            running.update(execution.get('executionArn') for execution in page.get('executions', []))
+            if not page.get('nextToken'):
+                break
+            kwargs.update({'nextToken': page.get('nextToken')})
+        return running
+
+    def poll(self, pending):
+        """
+        Describes the pending executions that are not listed as RUNNING. An execution that can not be described, e.g.
+        because it no longer exists, is returned as finished with the ERROR status so it is reported as a failure.
+        :param pending: {execution_arn: [granule_id, ...]}
+        :return: ({execution_arn: describe_execution response}, throttled)
+        """
+        running = set()
+        for state_machine_arn in {get_state_machine_arn(execution_arn) for execution_arn in pending}:
+            try:
+                running.update(self.list_running(state_machine_arn))
+            except Exception as err:
+                print(f'Unable to list running executions for {state_machine_arn}, describing each execution: {err}')
+
+        finished = {}
+        throttled = False
+        candidates = ({'executionArn': execution_arn} for execution_arn in pending if execution_arn not in running)
+        describe_execution = rate_limited(self.sfn_client.describe_execution, 'stepfunctions.describe_execution')
+        for call_args, future in sliding_window(describe_execution, candidates, self.workers):
+            try:
+                rsp = future.result()
+            except Exception as err:
+                if is_throttled_error(err):
+                    throttled = True
+                else:
+                    finished[call_args.get('executionArn')] = {'status': 'ERROR', 'error': f'{type(err).__name__}: {err}'}
+                continue
+            if rsp.get('status') != 'RUNNING':
+                finished[call_args.get('executionArn')] = rsp
+
+        return finished, throttled
+
+    def wait(self, executions):
+        """
+        Blocks until every execution has stopped running, printing a tally after each round.
+        :param executions: {execution_arn: [granule_id, ...]}
+        :return: list of the granules whose execution did not succeed
+        """
+        pending = dict(executions)
+        delay = self.min_delay
+        while pending:
+            finished, throttled = self.poll(pending)
+            for execution_arn, rsp in finished.items():
+                status = rsp.get('status')
+                granule_ids = pending.pop(execution_arn)
+                self.tally[status] += 1
+                if status != 'SUCCEEDED':
+                    self.failures.extend({
+                        'granule_id': granule_id,
+                        'status': status,
+                        'error': rsp.get('error', ''),
+                        'execution_arn': execution_arn
+                    } for granule_id in granule_ids)
+
+            print(self.tally_line(len(pending)))
+            if pending:
+                delay = self.min_delay if finished and not throttled else min(delay * 2, self.max_delay)
+                sleep(delay)
+
+        return self.failures
+
+    def tally_line(self, running=0):
+        counts = {'RUNNING': running, 'SUCCEEDED': 0, 'FAILED': 0, **self.tally}
+        return ' '.join(f'{status}: {count}' for status, count in counts.items())
+
+    def print_summary(self):
+        print(f'Execution summary: {self.tally_line()}')
+        if self.failures:
+            print(tabulate(
+                [[failure.get(key) for key in ['granule_id', 'status', 'error', 'execution_arn']]
+                 for failure in self.failures],
+                headers=['Granule ID', 'Status', 'Error', 'Execution ARN'], tablefmt='psql'
+            ))
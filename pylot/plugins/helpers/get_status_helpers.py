@@ -1,3 +1,4 @@
+import concurrent.futures
 from dataclasses import dataclass
 
 import boto3
@@ -6,22 +7,95 @@ import boto3
 @dataclass
 class GetStatusHelpers:
     @staticmethod
-    def get_s3_count(bucket_name, prefix, region_name="us-west-2", aws_profile=None):
+    def list_prefix(s3_client, bucket_name, prefix, delimiter=None):
         """
-        Get S3 counts from S3
+        Counts the objects under a prefix with list_objects_v2. When a delimiter is provided only the objects directly
+        under the prefix are counted and the sub-prefixes are returned.
+        :param s3_client: boto3 S3 client
+        :type s3_client:
         :param bucket_name:
-        :type bucket_name:
+        :type bucket_name: str
         :param prefix:
-        :type prefix:
+        :type prefix: str
+        :param delimiter:
+        :type delimiter: str
+        :return: (object count, total bytes, sub-prefixes)
+        :rtype: tuple
+        """
+        kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+        if delimiter:
+            kwargs.update({'Delimiter': delimiter})
+        count = 0
+        size = 0
+        sub_prefixes = []
+        for page in s3_client.get_paginator('list_objects_v2').paginate(**kwargs):
+            common_prefixes = page.get('CommonPrefixes', [])
+            # KeyCount includes the common prefixes returned in the page
+            count += page.get('KeyCount', 0) - len(common_prefixes)
+            size += sum(obj.get('Size', 0) for obj in page.get('Contents', []))
+            sub_prefixes.extend(common_prefix.get('Prefix') for common_prefix in common_prefixes)
+
+        return count, size, sub_prefixes
+
+    @staticmethod
+    def get_s3_count(bucket_name, prefix, region_name="us-west-2", aws_profile=None, workers=16, max_depth=3,
+                     details=False, s3_client=None):
+        """
+        Get S3 counts from S3. Sub-prefixes are discovered with a "/" delimiter, up to max_depth levels or until there
+        are enough of them to keep the workers busy, and are then counted concurrently.
+        :param bucket_name:
+        :type bucket_name: str
+        :param prefix:
+        :type prefix: str
         :param region_name:
-        :type region_name:
+        :type region_name: str
         :param aws_profile:
-        :type aws_profile:
-        :return:
-        :rtype:
+        :type aws_profile: str
+        :param workers: number of concurrent list requests
+        :type workers: int
+        :param max_depth: maximum number of prefix levels to fan out across
+        :type max_depth: int
+        :param details: return the count and bytes for each sub-prefix instead of the total count
+        :type details: bool
+        :param s3_client: S3 client to use instead of creating one from a new session
+        :type s3_client:
+        :return: total object count or {prefix: {"count": count, "bytes": bytes}}
+        :rtype: int or dict
         """
-        boto3.setup_default_session(profile_name=aws_profile,  region_name=region_name)
-        s3_resource = boto3.resource('s3')
-        bucket = s3_resource.Bucket(name=bucket_name)
+        if not s3_client:
+            session = boto3.session.Session(profile_name=aws_profile, region_name=region_name)
+            s3_client = session.client('s3')
         prefix = f"{prefix.rstrip('/')}/"
-        return sum(1 for _ in bucket.objects.filter(Prefix=prefix).all())
+
+        totals = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            frontier = [prefix]
+            for _ in range(max_depth):
+                if len(frontier) >= workers:
+                    break
+                next_frontier = []
+                futures = {
+                    executor.submit(GetStatusHelpers.list_prefix, s3_client, bucket_name, sub_prefix, '/'): sub_prefix
+                    for sub_prefix in frontier
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    count, size, sub_prefixes = future.result()
+                    if count:
+                        totals[futures[future]] = {'count': count, 'bytes': size}
+                    next_frontier.extend(sub_prefixes)
+                frontier = next_frontier
+                if not frontier:
+                    break
+
+            futures = {
+                executor.submit(GetStatusHelpers.list_prefix, s3_client, bucket_name, sub_prefix): sub_prefix
+                for sub_prefix in frontier
+            }
+            for future in concurrent.futures.as_completed(futures):
+                count, size, _ = future.result()
+                totals[futures[future]] = {'count': count, 'bytes': size}
+
+        if details:
+            return dict(sorted(totals.items()))
+
+        return sum(total.get('count') for total in totals.values())
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+from tempfile import gettempdir
+from time import time
+
+# Key the watermark of a sync of every collection is stored under
+ALL_COLLECTIONS = '*'
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS granules ('
+    'collection_id TEXT NOT NULL, granule_id TEXT NOT NULL, status TEXT, created_at INTEGER, updated_at INTEGER, '
+    'sync_id INTEGER, record TEXT NOT NULL, PRIMARY KEY (collection_id, granule_id))',
+    'CREATE INDEX IF NOT EXISTS granules_status ON granules (collection_id, status)',
+    'CREATE INDEX IF NOT EXISTS granules_updated_at ON granules (collection_id, updated_at)',
+    'CREATE INDEX IF NOT EXISTS granules_granule_id ON granules (granule_id)',
+    'CREATE TABLE IF NOT EXISTS sync_state ('
+    'collection_id TEXT PRIMARY KEY, watermark INTEGER, sync_id INTEGER, synced_at INTEGER, records INTEGER)',
+]
+
+
+class GranuleMirror:
+    """
+    Local SQLite copy of Cumulus granule records. The granule columns used for filtering are indexed and the full
+    record is kept as json so it can be filtered with json_extract and returned unchanged. The largest updatedAt
+    synced for a collection is stored as its watermark so the next sync only needs the records changed since.
+    """
+    def __init__(self, database=None):
+        self.database = database or f'{gettempdir()}/pylot_cache/granules.sqlite'
+        os.makedirs(os.path.dirname(os.path.abspath(self.database)), exist_ok=True)
+        self.connection = sqlite3.connect(self.database)
+        self.connection.row_factory = sqlite3.Row
+        # WAL lets queries read the mirror while a sync is writing to it
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_state(self, collection=None):
+        """
+        :return: {"collection_id", "watermark", "sync_id", "synced_at", "records"} or None if never synced
+        """
+        row = self.connection.execute(
+            'SELECT * FROM sync_state WHERE collection_id = ?', (collection or ALL_COLLECTIONS,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def upsert(self, records, collection, sync_id, watermark):
+        """
+        Writes a page of granule records and advances the watermark in one transaction so an interrupted sync resumes
+        after the last page written.
+        :return: the new watermark
+        """
+        rows = []
+        for record in records:
+            updated_at = record.get('updatedAt')
+            rows.append((
+                record.get('collectionId'), record.get('granuleId'), record.get('status'), record.get('createdAt'),
+                updated_at, sync_id, json.dumps(record)
+            ))
+            if isinstance(updated_at, (int, float)) and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)',
+                (collection or ALL_COLLECTIONS, watermark, sync_id, int(time() * 1000), self.count(collection))
+            )
+
+        return watermark
+
+    def delete_stale(self, collection, sync_id):
+        """
+        Removes granules a full sync did not return, i.e. granules deleted from Cumulus.
+        :return: number of granules removed
+        """
+        where, params = ('collection_id = ? AND ', [collection]) if collection else ('', [])
+        with self.connection:
+            cursor = self.connection.execute(
+                f'DELETE FROM granules WHERE {where}(sync_id IS NULL OR sync_id != ?)', [*params, sync_id]
+            )
+            self.connection.execute(
+                'UPDATE sync_state SET records = ? WHERE collection_id = ?',
+                (self.count(collection), collection or ALL_COLLECTIONS)
+            )
+        return cursor.rowcount
+
+    def count(self, collection=None):
+        if collection:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM granules WHERE collection_id = ?', (collection,)
+            ).fetchone()[0]
+        return self.connection.execute('SELECT COUNT(*) FROM granules').fetchone()[0]
+
+    def query(self, collection=None, where=None, params=(), limit=None, fields=None):
+        """
+        Generator of the mirrored granule records.
+        :param collection: only return granules of this collection
+        :param where: SQL condition over the columns collection_id, granule_id, status, created_at and updated_at or
+        over the record, e.g. "status = 'failed' AND json_extract(record, '$.provider') = 'ghrc'"
+        :param params: values for ? placeholders in where
+        :param limit: maximum number of records
+        :param fields: only return these record fields. They are extracted by SQLite so the rest of the record is not
+        parsed.
+        """
+        conditions = []
+        if collection:
+            conditions.append('collection_id = ?')
+            params = [collection, *params]
+        if where:
+            conditions.append(f'({where})')
+        select = 'record'
+        if fields:
+            select = f'json_object({", ".join(["?, json_extract(record, ?)"] * len(fields))})'
+            params = [*(value for field in fields for value in [field, f'$.{field}']), *params]
+        sql = f'SELECT {select} FROM granules'
+        if conditions:
+            sql = f'{sql} WHERE {" AND ".join(conditions)}'
+        sql = f'{sql} ORDER BY collection_id, granule_id'
+        if limit is not None:
+            sql = f'{sql} LIMIT {int(limit)}'
+
+        for row in self.connection.execute(sql, list(params)):
+            yield json.loads(row[0])
@@ -0,0 +1,75 @@
+import json
+import os
+
+SUBMITTED = 'S'
+COMPLETED = 'D'
+FAILED = 'F'
+
+
+class Journal:
+    """
+    Append-only record of bulk action progress. Each line is "<state>\t<key>[\t<message>]" where key is the compact
+    json of the call arguments, so appending costs one short write and indexing needs one split per line. The last
+    state written for a key wins. Lines torn by a crash are ignored.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.skipped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def key(call_args):
+        return json.dumps(call_args, sort_keys=True, separators=(',', ':'))
+
+    def load(self):
+        """
+        :return: {key: last state}
+        """
+        index = {}
+        if not os.path.isfile(self.path):
+            return index
+
+        with open(self.path, 'r', encoding='utf-8') as _file:
+            for line in _file:
+                fields = line.rstrip('\n').split('\t', maxsplit=2)
+                if len(fields) >= 2 and fields[0] in (SUBMITTED, COMPLETED, FAILED) and line.endswith('\n'):
+                    index[fields[1]] = fields[0]
+
+        return index
+
+    def record(self, state, call_args, message=''):
+        if not self.file:
+            # Line buffered so every entry reaches the file as soon as it is written
+            self.file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        line = f'{state}\t{self.key(call_args)}'
+        if message:
+            line = f'{line}\t{" ".join(str(message).split())}'
+        self.file.write(f'{line}\n')
+
+    def track(self, call_args_iter, resume=False):
+        """
+        Generator that journals the submission of each set of call arguments. When resuming, call arguments that
+        already completed are skipped and failed or unknown ones are yielded again.
+        """
+        completed = set()
+        if resume:
+            completed = {key for key, state in self.load().items() if state == COMPLETED}
+            print(f'Resuming from {self.path}: {len(completed)} records already completed')
+
+        for call_args in call_args_iter:
+            if completed and self.key(call_args) in completed:
+                self.skipped += 1
+                continue
+            self.record(SUBMITTED, call_args)
+            yield call_args
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
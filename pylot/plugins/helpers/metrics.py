@@ -0,0 +1,212 @@
+import bisect
+import json
+import threading
+from collections import defaultdict
+from time import perf_counter
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.hedges = 0
+        self.timeouts = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.wait_seconds = 0.0
+        self.max_seconds = 0.0
+        # One count per LATENCY_BUCKETS upper bound plus the overflow bucket
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def quantile(self, fraction):
+        """
+        Estimates a latency quantile as the upper bound of the histogram bucket it falls in.
+        """
+        rank = fraction * self.calls
+        total = 0
+        for upper_bound, count in zip([*LATENCY_BUCKETS, self.max_seconds], self.buckets):
+            total += count
+            if total >= rank and count:
+                return min(upper_bound, self.max_seconds)
+        return 0.0
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = {}
+        for upper_bound, count in zip([*LATENCY_BUCKETS, '+Inf'], self.buckets):
+            cumulative += count
+            buckets[str(upper_bound)] = cumulative
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'throttles': self.throttles,
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'timeouts': self.timeouts,
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 6),
+            'wait_seconds': round(self.wait_seconds, 6),
+            'mean_seconds': round(self.seconds / self.calls, 6) if self.calls else 0,
+            'p50_seconds': self.quantile(0.5),
+            'p99_seconds': self.quantile(0.99),
+            'max_seconds': round(self.max_seconds, 6),
+            'latency_buckets': buckets
+        }
+
+
+class Metrics:
+    """
+    Thread safe registry of per-endpoint call counts, latency histograms, retries and bytes transferred plus the time
+    spent encoding and decoding json. Endpoints are named like the rate limiters, e.g. "cumulus.list_granules".
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = perf_counter()
+        self.endpoints = defaultdict(EndpointMetrics)
+        self.json = defaultdict(lambda: {'records': 0, 'seconds': 0.0})
+
+    def record_call(self, endpoint, seconds, wait_seconds=0.0, error=False, throttled=False):
+        with self.lock:
+            metrics = self.endpoints[endpoint]
+            metrics.calls += 1
+            metrics.errors += int(error)
+            metrics.throttles += int(throttled)
+            metrics.seconds += seconds
+            metrics.wait_seconds += wait_seconds
+            metrics.max_seconds = max(metrics.max_seconds, seconds)
+            metrics.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def record_retry(self, endpoint):
+        with self.lock:
+            self.endpoints[endpoint].retries += 1
+
+    def record_hedge(self, endpoint):
+        with self.lock:
+            self.endpoints[endpoint].hedges += 1
+
+    def record_timeout(self, endpoint):
+        with self.lock:
+            self.endpoints[endpoint].timeouts += 1
+
+    def quantile(self, endpoint, fraction, min_calls=1):
+        """
+        :return: the estimated latency quantile of an endpoint or None if it has fewer than min_calls calls
+        """
+        with self.lock:
+            metrics = self.endpoints.get(endpoint)
+            if metrics is None or metrics.calls < min_calls:
+                return None
+            return metrics.quantile(fraction)
+
+    def add_bytes(self, endpoint, size):
+        with self.lock:
+            self.endpoints[endpoint].bytes += size
+
+    def record_json(self, operation, records, seconds):
+        """
+        :param operation: "encode" or "decode"
+        """
+        with self.lock:
+            self.json[operation]['records'] += records
+            self.json[operation]['seconds'] += seconds
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'wall_seconds': round(perf_counter() - self.start, 6),
+                'endpoints': {endpoint: metrics.to_dict() for endpoint, metrics in sorted(self.endpoints.items())},
+                'json': {
+                    operation: {'records': value.get('records'), 'seconds': round(value.get('seconds'), 6)}
+                    for operation, value in sorted(self.json.items())
+                }
+            }
+
+    def to_openmetrics(self):
+        """
+        Renders the metrics in the OpenMetrics text format, e.g. for the node exporter's textfile collector.
+        """
+        metrics = self.to_dict()
+        endpoints = metrics.get('endpoints')
+        lines = []
+        counters = [
+            ('pylot_api_calls', 'calls', 'API calls made.'),
+            ('pylot_api_errors', 'errors', 'API calls that raised or returned an error.'),
+            ('pylot_api_throttles', 'throttles', 'API calls that were throttled.'),
+            ('pylot_api_retries', 'retries', 'API calls that were retried.'),
+            ('pylot_api_hedges', 'hedges', 'Duplicate API calls sent for slow reads.'),
+            ('pylot_api_timeouts', 'timeouts', 'API calls that exceeded their deadline.'),
+            ('pylot_api_bytes', 'bytes', 'Bytes transferred.'),
+            ('pylot_api_wait_seconds', 'wait_seconds', 'Seconds spent waiting for the rate limiter.'),
+        ]
+        for name, key, description in counters:
+            lines.extend([f'# TYPE {name} counter', f'# HELP {name} {description}'])
+            lines.extend(
+                f'{name}_total{{endpoint="{endpoint}"}} {value.get(key)}' for endpoint, value in endpoints.items()
+            )
+
+        name = 'pylot_api_latency_seconds'
+        lines.extend([f'# TYPE {name} histogram', f'# HELP {name} API call latency.', f'# UNIT {name} seconds'])
+        for endpoint, value in endpoints.items():
+            for upper_bound, count in value.get('latency_buckets').items():
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{upper_bound}"}} {count}')
+            lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {value.get("seconds")}')
+            lines.append(f'{name}_count{{endpoint="{endpoint}"}} {value.get("calls")}')
+
+        for name, key, description in [
+            ('pylot_json_records', 'records', 'Records encoded or decoded.'),
+            ('pylot_json_seconds', 'seconds', 'Seconds spent encoding or decoding json.')
+        ]:
+            lines.extend([f'# TYPE {name} counter', f'# HELP {name} {description}'])
+            lines.extend(
+                f'{name}_total{{operation="{operation}"}} {value.get(key)}'
+                for operation, value in metrics.get('json').items()
+            )
+        lines.append('# EOF')
+
+        return '\n'.join(lines) + '\n'
+
+    def merge(self, metrics):
+        """
+        Adds the counts of another process's metrics, as returned by to_dict, e.g. those of a --workers shard.
+        """
+        with self.lock:
+            for endpoint, value in metrics.get('endpoints', {}).items():
+                target = self.endpoints[endpoint]
+                for key in ['calls', 'errors', 'throttles', 'retries', 'hedges', 'timeouts', 'bytes']:
+                    setattr(target, key, getattr(target, key) + value.get(key, 0))
+                target.seconds += value.get('seconds', 0)
+                target.wait_seconds += value.get('wait_seconds', 0)
+                target.max_seconds = max(target.max_seconds, value.get('max_seconds', 0))
+                previous = 0
+                for x, cumulative in enumerate(value.get('latency_buckets', {}).values()):
+                    target.buckets[x] += cumulative - previous
+                    previous = cumulative
+            for operation, value in metrics.get('json', {}).items():
+                self.json[operation]['records'] += value.get('records', 0)
+                self.json[operation]['seconds'] += value.get('seconds', 0)
+
+    def dump(self, output=None, openmetrics_output=None):
+        if output:
+            with open(output, 'w', encoding='utf-8') as _file:
+                json.dump(self.to_dict(), _file, indent=2)
+            print(f'Metrics written to: {output}')
+        if openmetrics_output:
+            with open(openmetrics_output, 'w', encoding='utf-8') as _file:
+                _file.write(self.to_openmetrics())
+            print(f'OpenMetrics written to: {openmetrics_output}')
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def reset_metrics():
+    global _metrics
+    _metrics = Metrics()
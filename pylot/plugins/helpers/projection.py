@@ -0,0 +1,42 @@
+import inspect
+import re
+
+
+def action_fields(function, api_arg_dict=None, extra=()):
+    """
+    Lists the record fields an API action reads: the arguments of its CumulusApi method that have no default and are
+    not provided with -args, followed by any extra fields, e.g. the --shard-key.
+    :param function: CumulusApi method, bound or unbound
+    :param api_arg_dict: arguments provided for every call
+    :param extra: other fields the records need
+    """
+    spec = inspect.getfullargspec(function)
+    args = spec.args[1:]
+    required = args[:len(args) - len(spec.defaults or ())]
+    fields = [arg for arg in required if arg not in (api_arg_dict or {})]
+    return list(dict.fromkeys([*fields, *extra]))
+
+
+def cumulus_field(field):
+    """
+    granule_id -> granuleId, the name of an action argument in Cumulus API records
+    """
+    return re.sub(r'_([a-z])', lambda match: match.group(1).upper(), field)
+
+
+def project_query(query, fields):
+    """
+    Sets the columns of an RDS query to fields so the lambda only returns what an action needs. Fields missing from the
+    query's own columns are added with a warning.
+    :return: the projected query dictionary
+    """
+    columns = query.get('columns')
+    if not columns:
+        print(f'Querying only the columns {", ".join(fields)} used by the action')
+        return {**query, 'columns': list(fields)}
+
+    missing = [field for field in fields if field not in columns]
+    if missing:
+        print(f'Warning: the query columns do not include {", ".join(missing)} required by the action. Adding them.')
+        return {**query, 'columns': [*columns, *missing]}
+    return query
@@ -1,12 +1,17 @@
 import json
 import os
 import pathlib
-from time import time
+import threading
 from dataclasses import dataclass
-from tempfile import gettempdir
 
 from cumulus_api import CumulusApi
 
+from .api_cache import CachingCumulusApi, get_api_cache
+from .token_manager import get_token_manager, reset_token_manager
+
+_clients = {}
+_clients_lock = threading.Lock()
+
 
 @dataclass
 class PyLOTHelpers:
@@ -20,20 +25,40 @@ class PyLOTHelpers:
 
     @classmethod
     def get_cumulus_api_instance(cls):
-        token_dir = f'{gettempdir()}/pylot_token/'
-        os.makedirs(token_dir, exist_ok=True)
-        token_file = f'{token_dir}token'
-        token = None
-        if os.path.isfile(token_file):
-            print(f'Using local token: {token_file}')
-            file_stat = os.stat(token_file)
-            if int(time()) - int(file_stat.st_mtime) < 3600:
-                with open(token_file, 'r', encoding='utf-8') as _file:
-                    token = _file.readline()
-
-        cml = CumulusApi(token=token)
-        if not token and cml.TOKEN:
-            with open(token_file, 'w+', encoding='utf-8') as _file:
-                _file.write(cml.TOKEN)
-
-        return cml
+        """
+        Returns the CumulusApi instance shared by every command in the process so batch and shell sessions reuse one
+        authenticated client. Its token comes from the shared TokenManager and is replaced in place shortly before it
+        expires. Once configure_api_cache has been called the instance is wrapped so its reads are cached.
+        """
+        token = get_token_manager().get_token()
+        with _clients_lock:
+            cml = _clients.get('cumulus_api')
+            if not cml:
+                cml = _clients['cumulus_api'] = CumulusApi(token=token)
+            elif cml.TOKEN != token:
+                cml.TOKEN = token
+
+        cache = get_api_cache()
+        return CachingCumulusApi(cml, cache) if cache else cml
+
+    @classmethod
+    def get_boto3_client(cls, service):
+        """
+        Returns a boto3 client shared by every command in the process. boto3 clients are thread safe and keep their
+        connection pool so creating one per call would repeat the endpoint setup and TLS handshakes.
+        """
+        with _clients_lock:
+            if service not in _clients:
+                import boto3
+                _clients[service] = boto3.client(service)
+
+        return _clients[service]
+
+    @classmethod
+    def reset_clients(cls):
+        """
+        Discards the shared clients and the in-memory token so they are created again on next use.
+        """
+        with _clients_lock:
+            _clients.clear()
+        reset_token_manager()
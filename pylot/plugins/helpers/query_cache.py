@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from tempfile import gettempdir
+from time import time
+
+
+class QueryCache:
+    """
+    On-disk cache of RDS lambda query results keyed by a hash of the normalized query and of the lambda and stack it
+    runs against. Each entry is a results file
+    and a metadata file holding the lambda response. The results file's mtime is the time it was cached and is used
+    for the TTL while its atime is set on every hit and is used for least recently used eviction once the cache
+    grows beyond max_bytes.
+    """
+    def __init__(self, cache_dir=None, ttl=None, max_bytes=None):
+        self.cache_dir = cache_dir or f'{gettempdir()}/pylot_cache/rds_queries/'
+        self.ttl = float(ttl if ttl is not None else os.getenv('PYLOT_QUERY_CACHE_TTL', 3600))
+        self.max_bytes = int(max_bytes if max_bytes is not None else os.getenv('PYLOT_QUERY_CACHE_MAX_BYTES', 2 ** 30))
+        self.stats_file = os.path.join(self.cache_dir, 'stats.json')
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(query, lambda_arn=None, stack_prefix=None):
+        """
+        Hash of the query with sorted keys and columns so equivalent queries share an entry. The RDS lambda and stack,
+        RDS_LAMBDA_ARN and STACK_PREFIX by default, are part of the key so results of another stack are never used.
+        """
+        if isinstance(query, dict) and isinstance(query.get('columns'), list):
+            query = {**query, 'columns': sorted(query.get('columns'))}
+        entry = {
+            'query': query,
+            'lambda_arn': lambda_arn or os.getenv('RDS_LAMBDA_ARN', ''),
+            'stack_prefix': stack_prefix or os.getenv('STACK_PREFIX', '')
+        }
+        return hashlib.sha256(json.dumps(entry, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    def results_file(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def metadata_file(self, key):
+        return os.path.join(self.cache_dir, f'{key}.meta.json')
+
+    @staticmethod
+    def tmp_file(file):
+        """
+        Name a file is written to before it is moved into place, unique to the process and thread writing it.
+        """
+        return f'{file}.{os.getpid()}.{threading.get_ident()}'
+
+    def get(self, key):
+        """
+        :return: (results file, lambda response) or None on a miss or expired entry
+        """
+        results_file = self.results_file(key)
+        try:
+            stat = os.stat(results_file)
+            if time() - stat.st_mtime > self.ttl:
+                self.remove(key)
+                raise FileNotFoundError(results_file)
+            with open(self.metadata_file(key), 'r', encoding='utf-8') as _file:
+                metadata = json.load(_file)
+            os.utime(results_file, (time(), stat.st_mtime))
+        except (OSError, ValueError):
+            self.record_stat('misses')
+            return None
+
+        self.record_stat('hits')
+        return results_file, metadata
+
+    def put(self, key, source_file, metadata):
+        """
+        Copies source_file into the cache and evicts least recently used entries if the cache is over max_bytes.
+        """
+        tmp_file = self.tmp_file(self.results_file(key))
+        shutil.copyfile(source_file, tmp_file)
+        self.commit(key, tmp_file, metadata)
+
+    def commit(self, key, tmp_file, metadata):
+        """
+        Moves a fully written results file into place.
+        """
+        with open(self.metadata_file(key), 'w', encoding='utf-8') as _file:
+            json.dump(metadata, _file)
+        os.replace(tmp_file, self.results_file(key))
+        self.evict()
+
+    def remove(self, key):
+        for file in [self.results_file(key), self.metadata_file(key)]:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith('.json') and not file.endswith('.meta.json') and file != 'stats.json':
+                stat = os.stat(os.path.join(self.cache_dir, file))
+                entries.append((stat.st_atime, stat.st_size, file[:-len('.json')]))
+
+        total = sum(entry[1] for entry in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+            self.record_stat('evictions')
+
+    def get_stats(self):
+        try:
+            with open(self.stats_file, 'r', encoding='utf-8') as _file:
+                return json.load(_file)
+        except (OSError, ValueError):
+            return {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def record_stat(self, name):
+        stats = self.get_stats()
+        stats[name] = stats.get(name, 0) + 1
+        tmp_file = self.tmp_file(self.stats_file)
+        with open(tmp_file, 'w', encoding='utf-8') as _file:
+            json.dump(stats, _file)
+        os.replace(tmp_file, self.stats_file)
+
+    def summary(self):
+        stats = self.get_stats()
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        hit_rate = stats.get('hits', 0) / lookups if lookups else 0
+        return f'Query cache: {stats.get("hits", 0)} hits, {stats.get("misses", 0)} misses ({hit_rate:.0%} hit rate), ' \
+               f'{stats.get("evictions", 0)} evictions'
@@ -0,0 +1,370 @@
+import concurrent.futures
+import functools
+import random
+import threading
+from time import monotonic, perf_counter, sleep
+
+from .api_cache import CachingCumulusApi
+from .command_context import bind_command
+from .metrics import get_metrics
+from .token_manager import refreshing_token
+
+THROTTLE_STATUS_CODES = {429, 503}
+THROTTLE_ERROR_CODES = {
+    'ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown',
+    'ProvisionedThroughputExceededException'
+}
+THROTTLE_MESSAGES = {'too many requests', 'rate exceeded', 'service unavailable', 'slow down'}
+RETRYABLE_STATUS_CODES = {500, 502, 504}
+RETRYABLE_ERROR_CODES = {
+    'InternalServerError', 'InternalFailure', 'ServiceUnavailable', 'ServiceException', 'RequestTimeout',
+    'RequestTimeoutException'
+}
+# Matched by class name so requests, urllib3 and botocore do not have to be imported
+RETRYABLE_EXCEPTIONS = {
+    'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'Timeout', 'ChunkedEncodingError', 'ProtocolError',
+    'EndpointConnectionError', 'ConnectTimeoutError', 'ReadTimeoutError'
+}
+IDEMPOTENT_PREFIXES = ('get_', 'list_', 'describe_', 'head_', 'search_')
+# Hedge delay used until an endpoint has HEDGE_MIN_CALLS calls to estimate its p95 latency from
+DEFAULT_HEDGE_DELAY = 1
+HEDGE_MIN_CALLS = 20
+
+# Endpoint settings, e.g. "stepfunctions.list_executions", override the service settings, e.g. "stepfunctions",
+# which override the default settings. rate is in requests per second. A rate of None disables the token bucket and
+# only the concurrency limit applies. service_rate, set on a service, is a rate shared by all the endpoints of the
+# service, e.g. --max-rate. timeout is the deadline of each attempt in seconds and hedge sends a duplicate of a slow
+# idempotent call, see RateLimiter.attempt.
+DEFAULT_LIMITS = {
+    'default': {'rate': None, 'burst': 10, 'initial_concurrency': 10, 'max_concurrency': 100},
+    'cumulus': {'burst': 50},
+    'stepfunctions.describe_execution': {'rate': 20, 'burst': 100, 'initial_concurrency': 5, 'max_concurrency': 20},
+    'stepfunctions.list_executions': {'rate': 2, 'burst': 50, 'initial_concurrency': 2, 'max_concurrency': 5},
+}
+
+# Threads of the shared pool for calls made with a deadline or a hedge, see get_call_executor
+CALL_WORKERS = 64
+# Seconds between the checks of whether a call waiting for a thread of the shared pool has started
+QUEUED_POLL_INTERVAL = 0.05
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+_call_executor = None
+
+
+def get_error_code(err):
+    """
+    Returns the AWS error code of a botocore ClientError or None for any other exception.
+    """
+    response = getattr(err, 'response', None)
+    return response.get('Error', {}).get('Code') if isinstance(response, dict) else None
+
+
+def is_throttled_error(err):
+    """
+    True for AWS throttling errors and HTTP errors with a 429 or 503 status code.
+    """
+    status_code = getattr(getattr(err, 'response', None), 'status_code', None)
+    return get_error_code(err) in THROTTLE_ERROR_CODES or status_code in THROTTLE_STATUS_CODES
+
+
+def is_throttled_response(rsp):
+    """
+    True if a Cumulus API response body reports throttling, e.g. {"message": "Too Many Requests"}
+    """
+    if not isinstance(rsp, dict):
+        return False
+    messages = {str(rsp.get(key, '')).lower() for key in ['error', 'message']}
+    return rsp.get('statusCode') in THROTTLE_STATUS_CODES or bool(messages & THROTTLE_MESSAGES)
+
+
+def is_retryable_error(err):
+    """
+    True for errors a later attempt may not hit: throttling, server errors, dropped connections and timeouts. Client
+    errors such as access denied or invalid arguments are not retryable.
+    """
+    status_code = getattr(getattr(err, 'response', None), 'status_code', None)
+    return is_throttled_error(err) or isinstance(err, (ConnectionError, TimeoutError)) or \
+        get_error_code(err) in RETRYABLE_ERROR_CODES or status_code in RETRYABLE_STATUS_CODES or \
+        any(cls.__name__ in RETRYABLE_EXCEPTIONS for cls in type(err).__mro__)
+
+
+def is_retryable_response(rsp):
+    """
+    True if a Cumulus API response body reports throttling or a server error, e.g. {"message": "Internal Server Error",
+    "statusCode": 502} from a Lambda that timed out.
+    """
+    return is_throttled_response(rsp) or (isinstance(rsp, dict) and rsp.get('statusCode') in RETRYABLE_STATUS_CODES)
+
+
+def is_idempotent(endpoint):
+    """
+    True for endpoints that only read, e.g. "cumulus.get_granule", which can be sent again without side effects.
+    """
+    return endpoint.rsplit('.', maxsplit=1)[-1].startswith(IDEMPOTENT_PREFIXES)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def get_call_executor():
+    """
+    Returns the thread pool shared by the calls that RateLimiter.attempt makes with a deadline or a hedge. A call
+    abandoned after its deadline keeps its thread until it returns.
+    """
+    global _call_executor
+    with _rate_limiters_lock:
+        if _call_executor is None:
+            _call_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=CALL_WORKERS, thread_name_prefix='pylot-call'
+            )
+        return _call_executor
+
+
+class RateLimiter:
+    """
+    Token bucket combined with an additive-increase/multiplicative-decrease concurrency limit. Every successful call
+    grows the concurrency limit by roughly one per window of calls and a throttled call halves it, at most once per
+    cooldown period. Throttled calls are retried with full jitter exponential backoff, as are server errors, dropped
+    connections and missed deadlines of idempotent endpoints. Other endpoints are not retried for those since the
+    request may have taken effect. The latency and outcome of every attempt are recorded in the metrics under the
+    limiter's endpoint. A call also takes a token from the shared limiter, if any, which limits the endpoints of a
+    service together.
+    """
+    def __init__(self, rate=None, burst=10, initial_concurrency=10, max_concurrency=100, max_retries=5,
+                 base_delay=0.5, max_delay=20, cooldown=1, timeout=None, hedge=False, hedge_delay=None,
+                 endpoint='default', shared=None):
+        self.endpoint = endpoint
+        self.shared = shared
+        self.idempotent = is_idempotent(endpoint)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.max_concurrency = max_concurrency
+        self.concurrency = min(initial_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.in_flight = 0
+        self.retries = 0
+        self.throttles = 0
+        self.last_refill = monotonic()
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.concurrency):
+                self.condition.wait()
+            self.in_flight += 1
+        self._take_token()
+        if self.shared:
+            self.shared._take_token()
+
+    def _take_token(self):
+        while self.rate:
+            with self.condition:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                now = monotonic()
+                if now - self.last_decrease >= self.cooldown:
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self.last_decrease = now
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self.condition.notify_all()
+
+    def backoff(self, attempt):
+        self.retries += 1
+        get_metrics().record_retry(self.endpoint)
+        sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def hedge_after(self):
+        """
+        :return: seconds after which a duplicate of a slow call is sent, hedge_delay or the endpoint's p95 latency
+        """
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        p95 = get_metrics().quantile(self.endpoint, 0.95, HEDGE_MIN_CALLS)
+        return DEFAULT_HEDGE_DELAY if p95 is None else p95
+
+    @property
+    def timed(self):
+        """
+        True if attempts are made in the shared thread pool, see attempt
+        """
+        return bool(self.timeout) or (self.hedge and self.idempotent)
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Submits a call, whose concurrency slot and token have been acquired, to the shared thread pool. The slot is
+        released when the call returns, not when the caller stops waiting for it, so abandoned calls still count
+        towards the concurrency limit.
+        :return: Future of the call's result. Its started list holds the time the call started running once a thread
+            of the pool picked it up.
+        """
+        def release(future):
+            error = future.exception()
+            self.release(is_throttled_error(error) if error else is_throttled_response(future.result()))
+
+        function = bind_command(function)
+        started = []
+
+        def run(*call_args, **call_kwargs):
+            started.append(monotonic())
+            return function(*call_args, **call_kwargs)
+
+        future = get_call_executor().submit(run, *args, **kwargs)
+        future.started = started
+        future.add_done_callback(release)
+        return future
+
+    def attempt(self, function, *args, **kwargs):
+        """
+        Makes one attempt of a call once the caller has acquired a concurrency slot and a token. Without a timeout or
+        hedging the call is made in the calling thread. Otherwise it is submitted to the shared thread pool so
+        DeadlineExceeded can be raised once the call has run for timeout seconds, and an idempotent call that has not
+        returned after hedge_after seconds is sent a second time, with its own slot and token, and the first response of
+        either used. Time spent waiting for a thread of the pool does not count towards the deadline.
+        """
+        if not self.timed:
+            return function(*args, **kwargs)
+
+        hedge_at = monotonic() + self.hedge_after() if self.hedge and self.idempotent else None
+        call = self.submit(function, *args, **kwargs)
+        pending = {call}
+        error = None
+        while pending:
+            deadline = call.started[0] + self.timeout if self.timeout and call.started else None
+            # A call waiting for a thread is checked again shortly to start its deadline once it runs
+            queued = monotonic() + QUEUED_POLL_INTERVAL if self.timeout and not call.started else None
+            wake = min([x for x in [deadline, hedge_at, queued] if x is not None], default=None)
+            done, pending = concurrent.futures.wait(
+                pending, None if wake is None else max(0.0, wake - monotonic()), concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                break
+            if deadline is not None and monotonic() >= deadline:
+                get_metrics().record_timeout(self.endpoint)
+                raise DeadlineExceeded(f'{self.endpoint} did not return within {self.timeout} seconds')
+            if hedge_at is not None and monotonic() >= hedge_at:
+                hedge_at = None
+                get_metrics().record_hedge(self.endpoint)
+                self.acquire()
+                pending.add(self.submit(function, *args, **kwargs))
+
+        raise error
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls function once a concurrency slot and a token are available, retrying throttled and retryable calls. The
+        last response is returned, or the last error raised, once the retries are exhausted.
+        """
+        attempt = 0
+        while True:
+            start = perf_counter()
+            self.acquire()
+            called = perf_counter()
+            throttled = False
+            retry = False
+            error = True
+            try:
+                rsp = self.attempt(function, *args, **kwargs)
+                throttled = is_throttled_response(rsp)
+                retry = throttled or (self.idempotent and is_retryable_response(rsp))
+                # The Cumulus API returns errors as a response body, e.g. {"error": "Not Found", "statusCode": 404}
+                error = not throttled and isinstance(rsp, dict) and rsp.get('statusCode', 200) >= 400
+            except Exception as err:
+                throttled = is_throttled_error(err)
+                retry = throttled or (self.idempotent and is_retryable_error(err))
+                error = not throttled
+                if not retry or attempt >= self.max_retries:
+                    raise
+            finally:
+                # Calls made in the shared thread pool release their slot when they return
+                if not self.timed:
+                    self.release(throttled)
+                get_metrics().record_call(self.endpoint, perf_counter() - called, called - start, error, throttled)
+
+            if not retry or attempt >= self.max_retries:
+                return rsp
+            self.backoff(attempt)
+            attempt += 1
+
+
+def configure_rate_limits(endpoint, **settings):
+    """
+    Overrides the limiter settings for an endpoint or service, e.g. configure_rate_limits('cumulus', rate=20).
+    Limiters that were already created for the endpoint are replaced.
+    """
+    with _rate_limiters_lock:
+        DEFAULT_LIMITS[endpoint] = {**DEFAULT_LIMITS.get(endpoint, {}), **settings}
+        for key in [key for key in _rate_limiters if key == endpoint or key.startswith(f'{endpoint}.')]:
+            _rate_limiters.pop(key)
+
+
+def reset_rate_limiters():
+    """
+    Discards all limiters so they are recreated from DEFAULT_LIMITS, dropping any learned concurrency.
+    """
+    with _rate_limiters_lock:
+        _rate_limiters.clear()
+
+
+def get_rate_limiter(endpoint):
+    """
+    Returns the shared RateLimiter for an endpoint such as "cumulus.list_granules" or "stepfunctions.describe_execution"
+    With a service_rate the endpoints of the service also draw from the token bucket kept under "<service>.*".
+    """
+    with _rate_limiters_lock:
+        if endpoint not in _rate_limiters:
+            service = endpoint.split('.', maxsplit=1)[0]
+            settings = {
+                **DEFAULT_LIMITS.get('default'), **DEFAULT_LIMITS.get(service, {}), **DEFAULT_LIMITS.get(endpoint, {})
+            }
+            service_rate = settings.pop('service_rate', None)
+            shared = None
+            if service_rate:
+                shared = _rate_limiters.setdefault(f'{service}.*', RateLimiter(
+                    rate=service_rate, burst=settings.get('burst'), endpoint=f'{service}.*'
+                ))
+            _rate_limiters[endpoint] = RateLimiter(**settings, endpoint=endpoint, shared=shared)
+        return _rate_limiters[endpoint]
+
+
+def rate_limited(function, endpoint):
+    """
+    Wraps function so every call goes through the endpoint's shared RateLimiter. Cumulus API calls also keep their
+    access token fresh, see refreshing_token. Methods of a CachingCumulusApi only rate limit the calls that reach the
+    API.
+    """
+    if isinstance(getattr(function, '__self__', None), CachingCumulusApi):
+        return function.around(lambda call: rate_limited(call, endpoint))
+    if endpoint.startswith('cumulus.'):
+        function = refreshing_token(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return get_rate_limiter(endpoint).call(function, *args, **kwargs)
+    return wrapper
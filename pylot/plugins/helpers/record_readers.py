@@ -0,0 +1,98 @@
+import codecs
+import json
+import re
+from time import perf_counter
+
+from .metrics import get_metrics
+
+WHITESPACE = re.compile(r'[\s,]*')
+DELIMITERS = ' \t\r\n,]'
+CHUNK_SIZE = 64 * 1024
+
+
+def read_chunks(file, chunk_size=CHUNK_SIZE):
+    """
+    Generator of text chunks from a text or binary file object such as an open file or an S3 StreamingBody.
+    """
+    decoder = None
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            decoder = decoder or codecs.getincrementaldecoder('utf-8')()
+            chunk = decoder.decode(chunk)
+        yield chunk
+
+
+def find_first_value(chunks):
+    """
+    Reads chunks until the first value of the file.
+    :return: (buffer, position of the first value in it, True if the values are the elements of a json array)
+    """
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        pos = WHITESPACE.match(buffer).end()
+        if pos < len(buffer):
+            in_array = buffer[pos] == '['
+            return buffer, pos + int(in_array), in_array
+
+    return buffer, len(buffer), False
+
+
+def decode_values(chunks, buffer, pos, in_array, totals):
+    """
+    Generator decoding the values from pos in buffer, reading more chunks as they are needed, until the end of the
+    array or of the file.
+    :param totals: dictionary the number of records and the seconds spent decoding are added to
+    """
+    decoder = json.JSONDecoder()
+    eof = False
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+        if in_array and buffer.startswith(']', pos):
+            return
+
+        try:
+            start = perf_counter()
+            record, end = decoder.raw_decode(buffer, pos)
+            totals['seconds'] += perf_counter() - start
+            # A number at the end of the buffer may continue in the next chunk
+            if eof or (end < len(buffer) and buffer[end] in DELIMITERS):
+                totals['records'] += 1
+                yield record
+                pos = end
+                continue
+        except json.JSONDecodeError:
+            if eof:
+                if pos < len(buffer):
+                    raise
+                return
+
+        chunk = next(chunks, None)
+        eof = chunk is None
+        buffer = buffer[pos:] + (chunk or '')
+        pos = 0
+
+
+def iter_json_records(file, chunk_size=CHUNK_SIZE):
+    """
+    Generator yielding the elements of a json array, or the values of a newline delimited json file, while the file is
+    being read. Only the current chunk and the record being decoded are held in memory. The time spent decoding is
+    added to the json decode metrics once the generator finishes.
+    :param file: file name or a text or binary file object
+    :param chunk_size: number of characters or bytes to read at a time
+    :return: generator of records
+    """
+    if isinstance(file, str):
+        with open(file, 'r', encoding='utf-8') as _file:
+            yield from iter_json_records(_file, chunk_size)
+        return
+
+    chunks = read_chunks(file, chunk_size)
+    totals = {'records': 0, 'seconds': 0.0}
+    try:
+        yield from decode_values(chunks, *find_first_value(chunks), totals)
+    finally:
+        get_metrics().record_json('decode', totals['records'], totals['seconds'])
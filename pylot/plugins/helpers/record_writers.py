@@ -0,0 +1,367 @@
+import csv
+import json
+import os
+import sys
+from contextlib import contextmanager, redirect_stdout
+from time import perf_counter
+
+from .command_context import current_command
+from .metrics import get_metrics
+
+# stdout of the command while everything else it prints goes to stderr, see records_to_stdout
+_records_stdout = None
+
+
+class RecordWriter:
+    """
+    Base class for writing records to a file or stdout as they become available. Subclasses implement the format
+    specific _write_records and _close methods.
+    """
+    def __init__(self, output=None, fields=None):
+        self.output = output
+        self.fields = fields
+        self.record_count = 0
+        self.encoded = 0
+        self.encode_seconds = 0.0
+        self.file = self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, records):
+        """
+        Writes a list of records and flushes them so downstream readers can consume them immediately.
+        :param records: list of json serializable records
+        """
+        self._write_records(records)
+        self.record_count += len(records)
+        self.flush()
+
+    def write_value(self, value):
+        """
+        Writes a single api response that is not a list of records, e.g. the result of get_granule.
+        :param value: json serializable value
+        """
+        self.write(value if isinstance(value, list) else [value])
+
+    def encode(self, value, **kwargs):
+        """
+        json.dumps that keeps track of the time spent encoding for the metrics.
+        """
+        start = perf_counter()
+        encoded = json.dumps(value, sort_keys=True, **kwargs)
+        self.encode_seconds += perf_counter() - start
+        self.encoded += len(value) if isinstance(value, list) else 1
+        return encoded
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self._close()
+        self.flush()
+        get_metrics().record_json('encode', self.encoded, self.encode_seconds)
+        if self.output:
+            self.file.close()
+            print(f'Results written to: {self.output}')
+
+    def _open(self):
+        return open(self.output, 'w+', encoding='utf-8') if self.output else _records_stdout or sys.stdout
+
+    def _write_records(self, records):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class JsonWriter(RecordWriter):
+    """
+    Buffers all records and writes them as a single indented json document on close.
+    """
+    def __init__(self, output=None, fields=None):
+        super().__init__(output, fields)
+        self.records = []
+        self.value = None
+
+    def _write_records(self, records):
+        self.records.extend(records)
+
+    def write_value(self, value):
+        self.value = value
+
+    def _close(self):
+        value = self.records if self.value is None else self.value
+        self.file.write(self.encode(value, indent=2))
+        if not self.output:
+            self.file.write('\n')
+
+
+class NdjsonWriter(RecordWriter):
+    """
+    Writes one compact json record per line.
+    """
+    def _write_records(self, records):
+        for record in records:
+            self.file.write(f'{self.encode(record)}\n')
+
+
+class JsonArrayWriter(RecordWriter):
+    """
+    Streams records into a single json array without holding them in memory.
+    """
+    def __init__(self, output=None, fields=None):
+        super().__init__(output, fields)
+        self.file.write('[')
+
+    def _write_records(self, records):
+        separator = ',\n' if self.record_count else '\n'
+        for record in records:
+            self.file.write(f'{separator}{self.encode(record)}')
+            separator = ',\n'
+
+    def _close(self):
+        self.file.write('\n]\n')
+
+
+def parse_fields(fields):
+    """
+    Accepts the Cumulus API fields kwarg, e.g. "granuleId,status", or a list of RDS columns.
+    """
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return [field.strip() for field in fields if field.strip()] if fields else None
+
+
+def flatten_keys(record, prefix=''):
+    """
+    Lists the dotted paths of the scalar and list values of a record, e.g. {"a": {"b": 1}, "c": []} -> ["a.b", "c"]
+    """
+    keys = []
+    for key, value in record.items():
+        if isinstance(value, dict) and value:
+            keys.extend(flatten_keys(value, f'{prefix}{key}.'))
+        else:
+            keys.append(f'{prefix}{key}')
+    return keys
+
+
+def get_field(record, field):
+    """
+    Returns the value at a dotted path. Lists and objects are returned as json strings so every column is a scalar.
+    """
+    value = record
+    for key in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+
+
+class ColumnarWriter(RecordWriter):
+    """
+    Base class for formats with a fixed set of columns. The columns are the requested fields or, if no fields were
+    requested, the flattened keys of the first batch of records. Nested objects are flattened into dotted columns,
+    e.g. "meta.count", and lists are stored as json strings.
+    """
+    def __init__(self, output=None, fields=None):
+        super().__init__(output, fields)
+        self.columns = parse_fields(fields)
+
+    def write(self, records):
+        if self.columns is None and records:
+            self.columns = list(dict.fromkeys(key for record in records for key in flatten_keys(record)))
+            self._write_header()
+        super().write(records)
+
+    def write_value(self, value):
+        self.write(value if isinstance(value, list) else [value])
+
+    def _write_header(self):
+        pass
+
+
+class CsvWriter(ColumnarWriter):
+    """
+    Writes one csv row per record with a header row of the column names.
+    """
+    def __init__(self, output=None, fields=None):
+        super().__init__(output, fields)
+        self.writer = csv.writer(self.file)
+        if self.columns:
+            self._write_header()
+
+    def _write_header(self):
+        self.writer.writerow(self.columns)
+
+    def _write_records(self, records):
+        start = perf_counter()
+        self.writer.writerows([get_field(record, column) for column in self.columns] for record in records)
+        self.encode_seconds += perf_counter() - start
+        self.encoded += len(records)
+
+
+class ParquetWriter(ColumnarWriter):
+    """
+    Writes records to a parquet file in row groups of row_group_size records so memory is bounded by one row group.
+    Columns are dictionary encoded, which stores repeated strings such as collectionId and status once per row group,
+    and compressed with zstd. The column types are inferred from the first row group, see _column_array. Requires
+    pyarrow.
+    """
+    row_group_size = 100000
+
+    def __init__(self, output=None, fields=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError('The parquet format requires pyarrow: pip install pyarrow')
+        if not output:
+            raise ValueError('The parquet format requires an output file.')
+        self.pa = pyarrow
+        self.rows = []
+        self.parquet_writer = None
+        self.failed = False
+        super().__init__(output, fields)
+
+    def _open(self):
+        return open(self.output, 'wb')
+
+    def flush(self):
+        # Records are buffered until a row group is full
+        pass
+
+    def _write_records(self, records):
+        self.rows.extend(records)
+        while len(self.rows) >= self.row_group_size:
+            self._write_row_group(self.rows[:self.row_group_size])
+            self.rows = self.rows[self.row_group_size:]
+
+    def _column_array(self, column, values, column_type=None):
+        """
+        Converts the values of a column to an arrow array of the column's type. The type of a new column is inferred
+        and a column with no values, or with values of different types, is stored as strings. Values that do not fit
+        the column's type are stored as json strings in string columns and as nulls in other columns.
+        """
+        pa = self.pa
+        try:
+            array = pa.array(values, type=column_type)
+            return array.cast(pa.string()) if pa.types.is_null(array.type) else array
+        except (pa.lib.ArrowException, OverflowError):
+            pass
+        if column_type is None or pa.types.is_string(column_type):
+            return pa.array([value if value is None or isinstance(value, str) else json.dumps(value) for value in values],
+                            type=pa.string())
+
+        converted = []
+        for value in values:
+            try:
+                pa.scalar(value, type=column_type)
+                converted.append(value)
+            except (pa.lib.ArrowException, OverflowError):
+                converted.append(None)
+        print(f'Warning: {converted.count(None) - values.count(None)} values of column {column} are not {column_type} '
+              f'and were written as nulls')
+        return pa.array(converted, type=column_type)
+
+    def _write_row_group(self, rows):
+        start = perf_counter()
+        columns = {column: [get_field(row, column) for row in rows] for column in self.columns or []}
+        if self.parquet_writer is None:
+            table = self.pa.table({column: self._column_array(column, values) for column, values in columns.items()})
+            self.parquet_writer = self.pa.parquet.ParquetWriter(
+                self.file, table.schema, use_dictionary=True, compression='zstd'
+            )
+        else:
+            schema = self.parquet_writer.schema
+            table = self.pa.table(
+                [self._column_array(field.name, columns.get(field.name), field.type) for field in schema], schema=schema
+            )
+        self.parquet_writer.write_table(table)
+        self.encode_seconds += perf_counter() - start
+        self.encoded += len(rows)
+
+    def write(self, records):
+        try:
+            super().write(records)
+        except Exception:
+            self.discard()
+            raise
+
+    def discard(self):
+        """
+        Closes and removes a partially written file so a failed write does not leave a corrupt parquet file behind.
+        """
+        self.failed = True
+        if self.parquet_writer is not None:
+            try:
+                self.parquet_writer.close()
+            except Exception:
+                pass
+        self.file.close()
+        if os.path.isfile(self.output):
+            os.remove(self.output)
+
+    def close(self):
+        if self.failed:
+            return
+        try:
+            super().close()
+        except Exception:
+            self.discard()
+            raise
+
+    def _close(self):
+        if self.rows or self.parquet_writer is None:
+            self._write_row_group(self.rows)
+            self.rows = []
+        self.parquet_writer.close()
+
+
+RECORD_WRITERS = {
+    'json': JsonWriter,
+    'ndjson': NdjsonWriter,
+    'json-stream': JsonArrayWriter,
+    'csv': CsvWriter,
+    'parquet': ParquetWriter
+}
+COLUMNAR_FORMATS = ['csv', 'parquet']
+
+
+@contextmanager
+def records_to_stdout(enabled=True):
+    """
+    Sends everything printed to stderr while the records are written to stdout, so the output can be parsed, e.g. line
+    by line as ndjson. The output of batch commands and --workers processes goes to their log and is left alone.
+    :param enabled: False when the records are written to a file
+    """
+    global _records_stdout
+    if not enabled or _records_stdout is not None or current_command()[0] is not None:
+        yield
+        return
+    _records_stdout = sys.stdout
+    try:
+        with redirect_stdout(sys.stderr):
+            yield
+    finally:
+        _records_stdout = None
+
+
+def get_record_writer(output_format='json', output=None, fields=None):
+    """
+    Returns a RecordWriter for the requested output format.
+    :param output_format: one of RECORD_WRITERS
+    :param output: file to write to. stdout is used if not provided.
+    :param fields: columns written by the csv and parquet formats as a list or comma separated string. Dotted names
+    select nested values, e.g. "meta.count". Defaults to every field of the first records written.
+    :return: RecordWriter
+    """
+    try:
+        writer_class = RECORD_WRITERS[output_format]
+    except KeyError:
+        raise ValueError(f'Unsupported output format {output_format}. Choose from: {", ".join(RECORD_WRITERS)}')
+
+    return writer_class(output, fields)
@@ -0,0 +1,99 @@
+import concurrent.futures
+from collections import deque
+
+from .metrics import get_metrics
+from .pylot_helpers import PyLOTHelpers
+from .rate_limiter import rate_limited
+
+PART_SIZE = 8 * 1024 * 1024
+
+
+class S3RangeReader:
+    """
+    Read-only binary file object over an S3 object that is downloaded with concurrent byte range GETs. Up to workers
+    parts are fetched ahead of the reader and parts are returned in order, so memory is bounded by
+    workers * part_size regardless of the object size.
+    """
+    def __init__(self, s3_client, bucket, key, size, part_size=PART_SIZE, workers=8):
+        self.get_object = rate_limited(s3_client.get_object, 's3.get_object')
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.part_size = part_size
+        self.starts = iter(range(0, size, part_size))
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.futures = deque()
+        self.part = b''
+        self.offset = 0
+        for _ in range(workers):
+            self._schedule()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _fetch(self, start):
+        end = min(start + self.part_size, self.size) - 1
+        rsp = self.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={start}-{end}')
+        return rsp.get('Body').read()
+
+    def _schedule(self):
+        start = next(self.starts, None)
+        if start is not None:
+            self.futures.append(self.executor.submit(self._fetch, start))
+
+    def read(self, size=-1):
+        chunks = []
+        remaining = size
+        while remaining != 0:
+            if self.offset >= len(self.part):
+                if not self.futures:
+                    break
+                self.part = self.futures.popleft().result()
+                self.offset = 0
+                self._schedule()
+            end = len(self.part) if remaining < 0 else self.offset + remaining
+            chunk = self.part[self.offset:end]
+            self.offset += len(chunk)
+            remaining = remaining - len(chunk) if remaining > 0 else remaining
+            chunks.append(chunk)
+
+        return b''.join(chunks)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TeeReader:
+    """
+    Wraps a file object and writes everything read from it to a second file.
+    """
+    def __init__(self, reader, file):
+        self.reader = reader
+        self.file = file
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        self.file.write(data)
+        return data
+
+    def close(self):
+        self.reader.close()
+        self.file.close()
+
+
+def open_s3_stream(bucket, key, s3_client=None, part_size=PART_SIZE, workers=8):
+    """
+    Opens an S3 object for streaming. Objects larger than part_size are downloaded with concurrent ranged GETs.
+    :return: binary file object with read(size) and close()
+    """
+    if not s3_client:
+        s3_client = PyLOTHelpers.get_boto3_client('s3')
+    size = rate_limited(s3_client.head_object, 's3.head_object')(Bucket=bucket, Key=key).get('ContentLength', 0)
+    get_metrics().add_bytes('s3.get_object', size)
+    if size <= part_size:
+        return rate_limited(s3_client.get_object, 's3.get_object')(Bucket=bucket, Key=key).get('Body')
+
+    return S3RangeReader(s3_client, bucket, key, size, part_size, workers)
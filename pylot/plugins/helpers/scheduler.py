@@ -0,0 +1,59 @@
+import concurrent.futures
+from time import time
+
+from .command_context import bind_command
+
+
+def sliding_window(function, call_args_iter, window):
+    """
+    Generator that keeps up to window calls of function in flight. A new call is submitted as soon as any running call
+    finishes so a single slow call does not hold up the others.
+    :param function: callable to apply to each set of keyword arguments
+    :param call_args_iter: iterable of keyword argument dictionaries. It is consumed lazily.
+    :param window: maximum number of concurrent calls
+    :return: generator of (call_args, future) tuples in completion order
+    """
+    window = max(window, 1)
+    call_args_iter = iter(call_args_iter)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=window) as executor:
+        in_flight = {}
+
+        def refill():
+            while len(in_flight) < window:
+                call_args = next(call_args_iter, None)
+                if call_args is None:
+                    break
+                in_flight[executor.submit(bind_command(function), **call_args)] = call_args
+
+        refill()
+        while in_flight:
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future
+            refill()
+
+
+class Throughput:
+    """
+    Tracks completed and failed records and reports the processing rate.
+    """
+    def __init__(self, report_every=100):
+        self.start = time()
+        self.report_every = report_every
+        self.completed = 0
+        self.failed = 0
+
+    def add(self, failed=False):
+        self.completed += 1
+        self.failed += int(failed)
+        if self.report_every and self.completed % self.report_every == 0:
+            print(self.summary())
+
+    @property
+    def rate(self):
+        elapsed = time() - self.start
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return f'{self.completed} records processed ({self.failed} failed) in {time() - self.start:.1f}s: ' \
+               f'{self.rate:.1f} records/s'
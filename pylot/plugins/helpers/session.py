@@ -0,0 +1,248 @@
+import concurrent.futures
+import io
+import os
+import re
+import shlex
+import sys
+from collections import Counter
+from contextlib import redirect_stderr
+from time import perf_counter
+
+from tabulate import tabulate
+
+from .command_context import command_context, current_command
+from .record_readers import iter_json_records
+from .record_writers import get_record_writer
+
+# Commands that would start a session from inside a session
+SESSION_PLUGINS = {'batch', 'shell'}
+
+
+class ThreadLocalStdout:
+    """
+    Stands in for sys.stdout and sends each thread's output to the stream of the batch command running in that thread,
+    see command_context, or to the original stdout.
+    """
+    def __init__(self, default):
+        self.default = default
+
+    def target(self):
+        return current_command()[0] or self.default
+
+    def write(self, data):
+        return self.target().write(data)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+
+class Session:
+    """
+    Runs pylot commands in one process so they share the imported plugins, the parser, the CumulusApi instance and the
+    boto3 clients with their connection pools.
+    """
+    def __init__(self):
+        from pylot.pylot_cli import create_arg_parser, discover_plugins, import_plugins
+        plugin_names = [name for name in discover_plugins() if name not in SESSION_PLUGINS]
+        self.plugins = import_plugins(plugin_names)
+        self.parser = create_arg_parser(self.plugins)
+
+    def run(self, argv):
+        """
+        Runs one command line, e.g. ["cumulus", "list", "granules", "limit=10"].
+        :return: the command's return code. Argument errors return 2 instead of exiting the session.
+        """
+        from pylot.pylot_cli import run_command
+        self.check(argv)
+        try:
+            return run_command(self.plugins, self.parser, argv) or 0
+        except SystemExit as err:
+            return err.code if isinstance(err.code, int) else 2
+
+    def check(self, argv, batch=False):
+        """
+        Rejects the command lines a session can not run as given: nested sessions and the global options, e.g.
+        --metrics, which configure the whole process. In a batch --max-rate is rejected as well because it would change
+        the Cumulus API rate limit of the other commands running at the same time.
+        """
+        if argv and argv[0] in SESSION_PLUGINS:
+            raise ValueError(f'{argv[0]} can not be run inside a session.')
+        options = global_options(argv)
+        if options:
+            raise ValueError(
+                f'{", ".join(options)} apply to the whole session and can not be given to one of its commands. '
+                f'Give them before the session plugin, e.g. pylot --metrics metrics.json batch commands.ndjson'
+            )
+        if batch:
+            # Argument errors are reported when the command runs
+            try:
+                with redirect_stderr(io.StringIO()):
+                    args, _ = self.parser.parse_known_args(argv)
+            except SystemExit:
+                return
+            if getattr(args, 'max_rate', None) is not None:
+                raise ValueError(
+                    '--max-rate would change the Cumulus API rate limit of every command in the batch. '
+                    'Use pylot batch --max-rate to limit the commands together.'
+                )
+
+    def run_logged(self, command, log_file, directory=None):
+        """
+        Runs a command with the output of its thread, and of the thread pools it starts, written to log_file.
+        :param directory: directory the command's default output files are written to, see output_path
+        :return: summary record for the command
+        """
+        start = perf_counter()
+        summary = {'id': command.get('id'), 'command': shlex.join(command.get('args')), 'status': 'failed'}
+        with open(log_file, 'w', encoding='utf-8') as log, command_context(log, directory):
+            try:
+                return_code = self.run(command.get('args'))
+                summary.update({'return_code': return_code, 'status': 'succeeded' if return_code == 0 else 'failed'})
+            except Exception as err:
+                print(f'{type(err).__name__}: {err}')
+                summary.update({'return_code': 1, 'error': str(err)})
+        summary.update({'seconds': round(perf_counter() - start, 3), 'log': log_file})
+
+        return summary
+
+    def check_batch(self, commands):
+        """
+        Raises a ValueError naming the command if a command runs after unknown commands or can not be run in a batch,
+        see check.
+        """
+        ids = {command.get('id') for command in commands}
+        for command in commands:
+            unknown = set(command.get('after')) - ids
+            if unknown:
+                raise ValueError(f'Command {command.get("id")} runs after unknown commands: {", ".join(unknown)}')
+            try:
+                self.check(command.get('args'), batch=True)
+            except ValueError as err:
+                raise ValueError(f'Command {command.get("id")}: {err}')
+
+    def start_ready(self, pending, running, summaries, executor, results_dir):
+        """
+        Submits the pending commands whose "after" commands have all succeeded and skips those with an "after" command
+        that did not, removing both from pending.
+        :param running: {future: command} the submitted commands are added to
+        :param summaries: {id: summary} of the finished commands, the skipped commands are added to
+        """
+        for command in list(pending):
+            after = [summaries.get(command_id) for command_id in command.get('after')]
+            if any(summary and summary.get('status') != 'succeeded' for summary in after):
+                summaries[command.get('id')] = {
+                    'id': command.get('id'), 'command': shlex.join(command.get('args')), 'status': 'skipped'
+                }
+                pending.remove(command)
+            elif all(after):
+                name = os.path.join(results_dir, safe_file_name(command.get('id')))
+                running[executor.submit(self.run_logged, command, f'{name}.log', name)] = command
+                pending.remove(command)
+
+    def run_batch(self, commands, workers=8, results_dir='pylot_batch_results', max_rate=None):
+        """
+        Runs the commands with up to workers running at the same time. A command only starts once the commands listed
+        in its "after" have succeeded and is skipped if any of them did not. The output of each command is written to
+        <results_dir>/<id>.log, its default output files, e.g. query_results.json, to <results_dir>/<id>/ and a
+        summary of every command to <results_dir>/summary.ndjson.
+        :param commands: list of {"id": str, "args": list, "after": list}
+        :param max_rate: maximum Cumulus API requests per second of all the commands together
+        :return: list of command summaries in the order of the commands
+        """
+        self.check_batch(commands)
+        os.makedirs(results_dir, exist_ok=True)
+        if max_rate:
+            from .rate_limiter import configure_rate_limits
+            configure_rate_limits('cumulus', service_rate=max_rate)
+
+        summaries = {}
+        pending = list(commands)
+        stdout = sys.stdout
+        sys.stdout = ThreadLocalStdout(stdout)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                running = {}
+                while pending or running:
+                    self.start_ready(pending, running, summaries, executor, results_dir)
+                    if not running:
+                        if pending:
+                            ids = ', '.join(command.get('id') for command in pending)
+                            raise ValueError(f'The commands {ids} depend on each other and can not be run.')
+                        break
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        summary = future.result()
+                        running.pop(future)
+                        summaries[summary.get('id')] = summary
+                        print(f'{summary.get("status")}: {summary.get("id")} ({summary.get("seconds")}s)')
+        finally:
+            sys.stdout = stdout
+
+        results = [summaries.get(command.get('id')) for command in commands]
+        write_summary(results, results_dir)
+
+        return results
+
+
+def write_summary(results, results_dir):
+    """
+    Writes the command summaries to <results_dir>/summary.ndjson and prints them as a table.
+    """
+    with get_record_writer('ndjson', os.path.join(results_dir, 'summary.ndjson')) as writer:
+        writer.write(results)
+    print(tabulate(
+        [[result.get(key, '') for key in ['id', 'status', 'return_code', 'seconds', 'command']] for result in results],
+        headers=['ID', 'Status', 'Return Code', 'Seconds', 'Command'], tablefmt='psql'
+    ))
+
+
+def global_options(argv):
+    """
+    Lists the metrics, cache and retry options given in a command line, e.g. ["--metrics"].
+    """
+    from pylot.pylot_cli import create_global_parser
+    parser = create_global_parser()
+    args, _ = parser.parse_known_args(argv)
+    defaults = parser.parse_args([])
+
+    return [f'--{key.replace("_", "-")}' for key, value in vars(args).items() if value != getattr(defaults, key)]
+
+
+def safe_file_name(name):
+    return re.sub(r'[^\w.-]', '_', str(name))
+
+
+def parse_command(record, line):
+    """
+    Accepts a command line string, a list of arguments or {"id": ..., "command": str or list, "after": str or list}
+    :return: {"id": str, "args": list, "after": list}
+    """
+    if not isinstance(record, dict):
+        record = {'command': record}
+    command = record.get('command', record.get('args'))
+    if not command:
+        raise ValueError(f'Line {line} does not contain a command: {record}')
+    after = record.get('after', [])
+
+    return {
+        'id': str(record.get('id', line)),
+        'args': shlex.split(command) if isinstance(command, str) else [str(arg) for arg in command],
+        'after': [str(command_id) for command_id in ([after] if isinstance(after, (str, int)) else after)]
+    }
+
+
+def read_commands(file):
+    """
+    Reads batch commands from a newline delimited json file. Lines are numbered from 1 and the line number is the
+    default command id.
+    """
+    commands = [parse_command(record, line) for line, record in enumerate(iter_json_records(file), start=1)]
+    counts = Counter(command.get('id') for command in commands)
+    duplicates = [command_id for command_id, count in counts.items() if count > 1]
+    if duplicates:
+        raise ValueError(f'Duplicate command ids: {", ".join(sorted(duplicates))}')
+
+    return commands
@@ -0,0 +1,75 @@
+import glob
+import os
+import re
+import zlib
+
+SHARD = re.compile(r'^\s*(\d+)\s*/\s*(\d+)\s*$')
+
+
+def parse_shard(shard):
+    """
+    "2/8" -> (2, 8). Shard indexes start at 0, like AWS Batch array job and ECS task indexes.
+    """
+    match = SHARD.match(str(shard))
+    if not match or not int(match.group(1)) < int(match.group(2)):
+        raise ValueError(f'Invalid shard {shard}. Use <index>/<count> with 0 <= index < count, e.g. 0/4.')
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_of(value, count):
+    """
+    Deterministic shard of a key value. crc32 is used instead of hash() because string hashes are randomized per
+    process and every process and host must agree on the assignment.
+    """
+    return zlib.crc32(str(value).encode('utf-8')) % count
+
+
+def shard_records(records, index, count, key='granule_id'):
+    """
+    Generator of the records whose key field falls in the shard.
+    """
+    for record in records:
+        if shard_of(record.get(key), count) == index:
+            yield record
+
+
+def shard_path(path, index, count):
+    """
+    run.journal -> run.shard-2-of-8.journal
+    """
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.shard-{index}-of-{count}{ext}'
+
+
+def shard_files(path):
+    """
+    :return: the shard files of path, in shard order
+    """
+    stem, ext = os.path.splitext(path)
+    pattern = re.compile(rf'^{re.escape(stem)}\.shard-(\d+)-of-(\d+){re.escape(ext)}$')
+    files = [file for file in glob.glob(f'{glob.escape(stem)}.shard-*-of-*{glob.escape(ext)}') if pattern.match(file)]
+    return sorted(files, key=lambda file: [int(x) for x in pattern.match(file).groups()[::-1]])
+
+
+def merge_shard_files(path):
+    """
+    Appends the shard files of path to path and removes them. Journals can be merged this way since the last entry of
+    a record wins.
+    :return: list of merged shard files
+    """
+    files = shard_files(path)
+    if not files:
+        return files
+
+    tmp_file = f'{path}.{os.getpid()}'
+    with open(tmp_file, 'wb') as merged:
+        for file in [path, *files] if os.path.isfile(path) else files:
+            with open(file, 'rb') as _file:
+                data = _file.read()
+            # A last line without a newline was torn by a crash and is dropped
+            merged.write(data[:data.rfind(b'\n') + 1])
+    os.replace(tmp_file, path)
+    for file in files:
+        os.remove(file)
+
+    return files
@@ -0,0 +1,56 @@
+import unittest
+
+from pylot.plugins.helpers.aggregator import Aggregator, get_aggregator, group_value, parse_filter
+
+DAY = 24 * 3600 * 1000
+GRANULES = [
+    {'granuleId': 'g1', 'collectionId': 'a___1', 'status': 'completed', 'updatedAt': 1704067200000, 'meta': {'size': 5}},
+    {'granuleId': 'g2', 'collectionId': 'a___1', 'status': 'failed', 'updatedAt': 1704067200000 + DAY},
+    {'granuleId': 'g3', 'collectionId': 'a___1', 'status': 'failed', 'updatedAt': 1704067200000 + 2 * DAY},
+    {'granuleId': 'g4', 'collectionId': 'b___1', 'status': 'failed', 'updatedAt': '2024-01-02T12:00:00Z'},
+]
+
+
+class TestAggregator(unittest.TestCase):
+    def test_count(self):
+        self.assertEqual(Aggregator().add_all(GRANULES).results(), [{'count': 4}])
+        self.assertEqual(Aggregator().results(), [{'count': 0}])
+
+    def test_group_by(self):
+        aggregator = Aggregator(['collectionId', 'status'], max_fields=['updatedAt'])
+        self.assertEqual(aggregator.add_all(GRANULES).results(), [
+            {'collectionId': 'a___1', 'status': 'completed', 'count': 1, 'max_updatedAt': 1704067200000},
+            {'collectionId': 'a___1', 'status': 'failed', 'count': 2, 'max_updatedAt': 1704067200000 + 2 * DAY},
+            {'collectionId': 'b___1', 'status': 'failed', 'count': 1, 'max_updatedAt': '2024-01-02T12:00:00Z'},
+        ])
+        self.assertEqual(aggregator.summary(), 'Aggregated 4 of 4 records into 3 groups')
+
+    def test_group_by_day(self):
+        aggregator = Aggregator(['updatedAt:day'], min_fields=['granuleId'], filters=['status=failed'])
+        self.assertEqual(aggregator.add_all(GRANULES).results(), [
+            {'updatedAt:day': '2024-01-02', 'count': 2, 'min_granuleId': 'g2'},
+            {'updatedAt:day': '2024-01-03', 'count': 1, 'min_granuleId': 'g3'},
+        ])
+        with self.assertRaises(ValueError):
+            group_value(GRANULES[0], 'updatedAt:week')
+
+    def test_filters(self):
+        def count(*filters):
+            return Aggregator(filters=filters).add_all(GRANULES).results()[0].get('count')
+        self.assertEqual(count('status!=failed'), 1)
+        self.assertEqual(count('updatedAt>=2024-01-02'), 3)
+        self.assertEqual(count('updatedAt>2024-01-02T06:00:00'), 2)
+        self.assertEqual(count('meta.size>4'), 1)
+        self.assertEqual(count('granuleId~g', 'collectionId=a___1', 'status=failed'), 2)
+        with self.assertRaises(ValueError):
+            parse_filter('status')
+
+    def test_get_aggregator(self):
+        self.assertIsNone(get_aggregator(output='out.json'))
+        aggregator = get_aggregator(group_by='collectionId, status', max_fields='updatedAt')
+        self.assertEqual(aggregator.group_by, ['collectionId', 'status'])
+        self.assertEqual(aggregator.max_fields, ['updatedAt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import concurrent.futures
+import inspect
+import threading
+import unittest
+from time import monotonic, sleep
+from unittest.mock import patch
+
+from pylot.plugins.helpers.api_cache import ApiCache, CachingCumulusApi, record_tags
+from pylot.plugins.helpers.metrics import get_metrics, reset_metrics
+from pylot.plugins.helpers.rate_limiter import rate_limited, reset_rate_limiters
+from pylot.tests.fake_stack import FakeCumulusApi, FakeStepFunctionsClient
+
+
+class TestApiCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.api = FakeCumulusApi(10)
+        self.cache = ApiCache(ttl=60, max_entries=3)
+        self.capi = CachingCumulusApi(self.api, self.cache)
+
+    def calls(self, endpoint):
+        return len(self.api.recorder.latencies.get(endpoint, []))
+
+    def test_cached_reads(self):
+        self.assertEqual(self.capi.get_granule('granule_00000001'), self.capi.get_granule(granule_id='granule_00000001'))
+        self.capi.get_granule('granule_00000001')
+        self.capi.list_granules(page=1)
+        self.capi.list_granules(page=1)
+        self.assertEqual(self.calls('cumulus.get_granule'), 2)
+        self.assertEqual(self.calls('cumulus.list_granules'), 1)
+        self.assertEqual(self.cache.stats.get('hits'), 2)
+
+    def test_ttl_and_lru(self):
+        self.capi.get_granule('granule_00000001')
+        with patch('pylot.plugins.helpers.api_cache.monotonic', return_value=monotonic() + 61):
+            self.capi.get_granule('granule_00000001')
+        self.assertEqual(self.calls('cumulus.get_granule'), 2)
+
+        for index in [2, 3, 4, 1]:
+            self.capi.get_granule(f'granule_0000000{index}')
+        self.assertEqual(len(self.cache.entries), 3)
+        self.capi.get_granule('granule_00000003')
+        self.assertEqual(self.calls('cumulus.get_granule'), 6)
+        # Evicted as the least recently used entry when granule 1 was read again
+        self.capi.get_granule('granule_00000002')
+        self.assertEqual(self.calls('cumulus.get_granule'), 7)
+
+    def test_mutation_invalidates(self):
+        self.api.sfn_client = FakeStepFunctionsClient()
+        self.assertEqual(self.capi.get_granule('granule_00000001').get('execution'), '')
+        self.capi.get_granule('granule_00000002')
+        self.capi.list_granules()
+        self.capi.apply_workflow_to_granule('granule_00000001', 'Reingest')
+        self.assertTrue(self.capi.get_granule('granule_00000001').get('execution'))
+        self.capi.get_granule('granule_00000002')
+        self.capi.list_granules()
+        self.assertEqual(self.calls('cumulus.get_granule'), 3)
+        self.assertEqual(self.calls('cumulus.list_granules'), 2)
+
+    def test_bulk_invalidates(self):
+        self.api.sfn_client = FakeStepFunctionsClient()
+        data = {'granules': [{'granuleId': 'granule_00000001', 'collectionId': 'collection___1'}],
+                'workflowName': 'Reingest'}
+        self.assertEqual(record_tags({'data': data}), {'granule_00000001', 'collection___1', 'Reingest'})
+        self.assertEqual(self.capi.get_granule('granule_00000001').get('execution'), '')
+        operation_id = self.capi.bulk_granules(data=data).get('id')
+        # Status polls are not cached, the operation runs on the first poll and succeeds on the second
+        self.assertEqual(self.capi.get_async_operation(operation_id).get('status'), 'RUNNING')
+        self.assertEqual(self.capi.get_async_operation(operation_id).get('status'), 'SUCCEEDED')
+        self.assertTrue(self.capi.get_granule('granule_00000001').get('execution'))
+        self.assertEqual(self.calls('cumulus.get_granule'), 2)
+
+    def test_errors_are_not_cached(self):
+        self.api.recorder.error_rate = 1
+        self.capi.get_granule('granule_00000001')
+        self.capi.get_granule('granule_00000001')
+        self.assertEqual(self.calls('cumulus.get_granule'), 2)
+
+    def test_coalesce_concurrent_calls(self):
+        calls = []
+        started = threading.Event()
+
+        def slow_read(granule_id):
+            calls.append(granule_id)
+            started.set()
+            sleep(0.2)
+            return {'granuleId': granule_id}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(self.cache.call, 'get_granule', slow_read, 'g1')
+            started.wait()
+            others = [executor.submit(self.cache.call, 'get_granule', slow_read, 'g1') for _ in range(3)]
+            results = [future.result() for future in [first, *others]]
+        self.assertEqual(calls, ['g1'])
+        self.assertEqual(results, [{'granuleId': 'g1'}] * 4)
+        self.assertEqual(self.cache.stats.get('coalesced'), 3)
+
+    def test_signature_and_rate_limiting(self):
+        self.assertEqual(
+            inspect.getfullargspec(self.capi.apply_workflow_to_granule).args, ['self', 'granule_id', 'workflow_name']
+        )
+        reset_metrics()
+        reset_rate_limiters()
+        get_granule = rate_limited(self.capi.get_granule, 'cumulus.get_granule')
+        get_granule(granule_id='granule_00000001')
+        get_granule(granule_id='granule_00000001')
+        self.assertEqual(get_metrics().to_dict().get('endpoints').get('cumulus.get_granule').get('calls'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
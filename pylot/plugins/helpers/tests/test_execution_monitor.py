@@ -0,0 +1,133 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from pylot.plugins.helpers.execution_monitor import ExecutionMonitor, get_state_machine_arn
+from pylot.plugins.helpers.rate_limiter import DEFAULT_LIMITS, configure_rate_limits, reset_rate_limiters
+
+EXECUTION_ARN = 'arn:aws:states:us-west-2:123456789012:execution:IngestGranule:{}'
+
+
+class ThrottlingError(Exception):
+    response = {'Error': {'Code': 'ThrottlingException'}}
+
+
+def setUpModule():
+    configure_rate_limits('stepfunctions', max_retries=0)
+
+
+def tearDownModule():
+    DEFAULT_LIMITS.pop('stepfunctions')
+    reset_rate_limiters()
+
+
+class TestExecutionMonitor(unittest.TestCase):
+    def test_get_state_machine_arn(self):
+        self.assertEqual(
+            get_state_machine_arn(EXECUTION_ARN.format('abc')),
+            'arn:aws:states:us-west-2:123456789012:stateMachine:IngestGranule'
+        )
+
+    def test_resolve_execution_arns(self):
+        capi = MagicMock()
+        capi.get_granule.side_effect = lambda granule_id: {
+            'execution': f'https://console.aws.amazon.com/states/home#/executions/details/{EXECUTION_ARN.format(granule_id)}'
+        }
+        monitor = ExecutionMonitor(sfn_client=MagicMock())
+        res = monitor.resolve_execution_arns([{'granuleId': 'g1'}, {'granuleId': 'g2'}, {'message': 'no granule'}], capi)
+        self.assertEqual(res, {EXECUTION_ARN.format('g1'): ['g1'], EXECUTION_ARN.format('g2'): ['g2']})
+
+    def test_resolve_shared_execution(self):
+        capi = MagicMock()
+        capi.get_granule.return_value = {'execution': f'https://console/executions/details/{EXECUTION_ARN.format("bulk")}'}
+        monitor = ExecutionMonitor(sfn_client=MagicMock())
+        res = monitor.resolve_execution_arns([{'granuleId': f'g{x}'} for x in range(3)], capi)
+        self.assertEqual(list(res), [EXECUTION_ARN.format('bulk')])
+        self.assertEqual(sorted(res.get(EXECUTION_ARN.format('bulk'))), ['g0', 'g1', 'g2'])
+
+    def test_resolve_waits_for_new_execution(self):
+        submitted = datetime.now(timezone.utc)
+        # The granule points to the execution of the previous request until the new one starts
+        lookups = [EXECUTION_ARN.format('old'), EXECUTION_ARN.format('old'), EXECUTION_ARN.format('new')]
+        capi = MagicMock()
+        capi.get_granule.side_effect = lambda granule_id: {'execution': f'https://console/executions/details/{lookups.pop(0)}'}
+        sfn_client = MagicMock()
+        sfn_client.describe_execution.side_effect = lambda executionArn: {
+            'status': 'SUCCEEDED',
+            'startDate': submitted + timedelta(seconds=1 if executionArn.endswith('new') else -60)
+        }
+        monitor = ExecutionMonitor(sfn_client=sfn_client, min_delay=0)
+        res = monitor.resolve_execution_arns([{'granuleId': 'g1'}], capi, started_after=submitted)
+        self.assertEqual(res, {EXECUTION_ARN.format('new'): ['g1']})
+        self.assertEqual(capi.get_granule.call_count, 3)
+        # The start date of each execution is only described once
+        self.assertEqual(sfn_client.describe_execution.call_count, 2)
+        self.assertEqual(monitor.failures, [])
+
+    def test_resolve_failures(self):
+        def get_granule(granule_id):
+            if granule_id == 'raises':
+                raise ValueError('Connection reset')
+            if granule_id == 'missing':
+                return {'error': 'Not Found', 'message': 'Granule not found', 'statusCode': 404}
+            return {'execution': ''}
+
+        capi = MagicMock()
+        capi.get_granule.side_effect = get_granule
+        monitor = ExecutionMonitor(sfn_client=MagicMock(), min_delay=0)
+        res = monitor.resolve_execution_arns(
+            [{'granuleId': x} for x in ['raises', 'missing', 'no_execution']], capi, timeout=0
+        )
+        self.assertEqual(res, {})
+        self.assertEqual(sorted((failure.get('granule_id'), failure.get('status')) for failure in monitor.failures), [
+            ('missing', 'LOOKUP_FAILED'), ('no_execution', 'NOT_STARTED'), ('raises', 'LOOKUP_FAILED')
+        ])
+        self.assertEqual(dict(monitor.tally), {'LOOKUP_FAILED': 2, 'NOT_STARTED': 1})
+
+    def test_wait_only_describes_pending(self):
+        running_rounds = [
+            {EXECUTION_ARN.format('g2'), EXECUTION_ARN.format('g3')},
+            {EXECUTION_ARN.format('g3')},
+            set()
+        ]
+        sfn_client = MagicMock()
+        sfn_client.list_executions.side_effect = lambda **kwargs: {
+            'executions': [{'executionArn': arn} for arn in running_rounds.pop(0)]
+        }
+        statuses = {'g1': 'SUCCEEDED', 'g2': 'FAILED', 'g3': 'SUCCEEDED'}
+        sfn_client.describe_execution.side_effect = lambda executionArn: {
+            'status': statuses.get(executionArn.rsplit(':')[-1]), 'error': 'States.TaskFailed'
+        }
+
+        monitor = ExecutionMonitor(sfn_client=sfn_client, min_delay=0, max_delay=0)
+        failures = monitor.wait({EXECUTION_ARN.format(x): [x] for x in ['g1', 'g2', 'g3']})
+        self.assertEqual(sfn_client.describe_execution.call_count, 3)
+        self.assertEqual(dict(monitor.tally), {'SUCCEEDED': 2, 'FAILED': 1})
+        self.assertEqual([failure.get('granule_id') for failure in failures], ['g2'])
+
+    def test_wait_throttled(self):
+        sfn_client = MagicMock()
+        sfn_client.list_executions.side_effect = Exception('AccessDenied')
+        sfn_client.describe_execution.side_effect = [ThrottlingError(), {'status': 'SUCCEEDED'}]
+        monitor = ExecutionMonitor(sfn_client=sfn_client, min_delay=0, max_delay=0)
+        self.assertEqual(monitor.wait({EXECUTION_ARN.format('g1'): ['g1']}), [])
+        self.assertEqual(sfn_client.describe_execution.call_count, 2)
+
+    def test_wait_describe_error(self):
+        class ExecutionDoesNotExist(Exception):
+            response = {'Error': {'Code': 'ExecutionDoesNotExist'}}
+
+        def describe_execution(executionArn):
+            if executionArn.endswith('gone'):
+                raise ExecutionDoesNotExist(executionArn)
+            return {'status': 'SUCCEEDED'}
+
+        sfn_client = MagicMock()
+        sfn_client.list_executions.return_value = {'executions': []}
+        sfn_client.describe_execution.side_effect = describe_execution
+        monitor = ExecutionMonitor(sfn_client=sfn_client, min_delay=0, max_delay=0)
+        failures = monitor.wait({EXECUTION_ARN.format('ok'): ['g1'], EXECUTION_ARN.format('gone'): ['g2', 'g3']})
+        self.assertEqual(dict(monitor.tally), {'SUCCEEDED': 1, 'ERROR': 1})
+        self.assertEqual([(failure.get('granule_id'), failure.get('status')) for failure in failures],
+                         [('g2', 'ERROR'), ('g3', 'ERROR')])
+        self.assertIn('ExecutionDoesNotExist', failures[0].get('error'))
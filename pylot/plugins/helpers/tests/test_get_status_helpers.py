@@ -0,0 +1,67 @@
+import unittest
+
+from pylot.plugins.helpers.get_status_helpers import GetStatusHelpers
+
+
+class FakePaginator:
+    def __init__(self, keys, page_size):
+        self.keys = keys
+        self.page_size = page_size
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        entries = []
+        for key in sorted(k for k in self.keys if k.startswith(Prefix)):
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common_prefix = f'{Prefix}{rest.split(Delimiter)[0]}{Delimiter}'
+                if ('prefix', common_prefix) not in entries:
+                    entries.append(('prefix', common_prefix))
+            else:
+                entries.append(('key', key))
+
+        for x in range(0, max(len(entries), 1), self.page_size):
+            page = entries[x:x + self.page_size]
+            yield {
+                'KeyCount': len(page),
+                'Contents': [{'Key': key, 'Size': 10} for kind, key in page if kind == 'key'],
+                'CommonPrefixes': [{'Prefix': key} for kind, key in page if kind == 'prefix']
+            }
+
+
+class FakeS3Client:
+    def __init__(self, keys, page_size=3):
+        self.keys = keys
+        self.page_size = page_size
+
+    def get_paginator(self, name):
+        return FakePaginator(self.keys, self.page_size)
+
+
+KEYS = [
+    'granules/readme.txt',
+    *[f'granules/nalma/2024/{x}.dat' for x in range(7)],
+    *[f'granules/nalma/2023/{x}.dat' for x in range(5)],
+    *[f'granules/msut/{x}.dat' for x in range(4)],
+    'granules/msut/sub/a.dat',
+    'other/ignored.dat'
+]
+
+
+class TestGetStatusHelpers(unittest.TestCase):
+    def test_get_s3_count(self):
+        for workers in [1, 2, 16]:
+            for max_depth in [0, 1, 3]:
+                count = GetStatusHelpers.get_s3_count(
+                    'bucket', 'granules', workers=workers, max_depth=max_depth, s3_client=FakeS3Client(KEYS)
+                )
+                self.assertEqual(count, 18)
+
+    def test_get_s3_count_details(self):
+        res = GetStatusHelpers.get_s3_count('bucket', 'granules/', details=True, s3_client=FakeS3Client(KEYS))
+        self.assertEqual(res, {
+            'granules/': {'count': 1, 'bytes': 10},
+            'granules/msut/': {'count': 4, 'bytes': 40},
+            'granules/msut/sub/': {'count': 1, 'bytes': 10},
+            'granules/nalma/2023/': {'count': 5, 'bytes': 50},
+            'granules/nalma/2024/': {'count': 7, 'bytes': 70}
+        })
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from pylot.plugins.helpers.journal import COMPLETED, FAILED, SUBMITTED, Journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'run.log')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_record_and_load(self):
+        with Journal(self.path) as journal:
+            journal.record(SUBMITTED, {'granule_id': 'g1'})
+            journal.record(SUBMITTED, {'granule_id': 'g2'})
+            journal.record(COMPLETED, {'granule_id': 'g1'})
+            journal.record(FAILED, {'granule_id': 'g2'}, 'Not Found\n\tsecond line')
+
+        with open(self.path, 'a', encoding='utf-8') as _file:
+            _file.write('D\t{"granule_id":"g2"')
+        self.assertEqual(Journal(self.path).load(), {'{"granule_id":"g1"}': COMPLETED, '{"granule_id":"g2"}': FAILED})
+
+    def test_track_resume(self):
+        with Journal(self.path) as journal:
+            list(journal.track([{'granule_id': x} for x in ['g1', 'g2', 'g3']]))
+            journal.record(COMPLETED, {'granule_id': 'g1'})
+            journal.record(FAILED, {'granule_id': 'g2'}, 'error')
+
+        with Journal(self.path) as journal:
+            remaining = list(journal.track([{'granule_id': x} for x in ['g1', 'g2', 'g3']], resume=True))
+        self.assertEqual(remaining, [{'granule_id': 'g2'}, {'granule_id': 'g3'}])
+        self.assertEqual(journal.skipped, 1)
@@ -0,0 +1,99 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from pylot.plugins.helpers.metrics import LATENCY_BUCKETS, Metrics, get_metrics, reset_metrics
+from pylot.plugins.helpers.rate_limiter import RateLimiter
+from pylot.plugins.helpers.record_readers import iter_json_records
+from pylot.plugins.helpers.record_writers import get_record_writer
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        reset_metrics()
+
+    def test_record_call(self):
+        metrics = Metrics()
+        for seconds in [0.001] * 98 + [0.2, 3]:
+            metrics.record_call('cumulus.list_granules', seconds, wait_seconds=0.5)
+        metrics.record_call('cumulus.list_granules', 0.02, error=True, throttled=True)
+        metrics.record_retry('cumulus.list_granules')
+        metrics.add_bytes('s3.get_object', 1024)
+
+        endpoints = metrics.to_dict().get('endpoints')
+        rsp = endpoints.get('cumulus.list_granules')
+        self.assertEqual(rsp.get('calls'), 101)
+        self.assertEqual(rsp.get('errors'), 1)
+        self.assertEqual(rsp.get('throttles'), 1)
+        self.assertEqual(rsp.get('retries'), 1)
+        self.assertEqual(rsp.get('wait_seconds'), 50)
+        self.assertEqual(rsp.get('p50_seconds'), LATENCY_BUCKETS[0])
+        self.assertEqual(rsp.get('p99_seconds'), 0.25)
+        self.assertEqual(rsp.get('max_seconds'), 3)
+        self.assertEqual(rsp.get('latency_buckets').get('0.005'), 98)
+        self.assertEqual(rsp.get('latency_buckets').get('+Inf'), 101)
+        self.assertEqual(endpoints.get('s3.get_object').get('bytes'), 1024)
+
+    def test_merge(self):
+        shard = Metrics()
+        for seconds in [0.001, 0.2, 3]:
+            shard.record_call('cumulus.get_granule', seconds)
+        shard.record_retry('cumulus.get_granule')
+        metrics = Metrics()
+        metrics.record_call('cumulus.get_granule', 0.001)
+        metrics.merge(json.loads(json.dumps(shard.to_dict())))
+        rsp = metrics.to_dict().get('endpoints').get('cumulus.get_granule')
+        self.assertEqual((rsp.get('calls'), rsp.get('retries'), rsp.get('max_seconds')), (4, 1, 3))
+        self.assertEqual(rsp.get('latency_buckets').get('0.005'), 2)
+        self.assertEqual(rsp.get('latency_buckets').get('+Inf'), 4)
+
+    def test_openmetrics(self):
+        metrics = Metrics()
+        metrics.record_call('lambda.invoke', 0.3)
+        metrics.record_json('decode', 10, 0.01)
+        text = metrics.to_openmetrics()
+        self.assertIn('pylot_api_calls_total{endpoint="lambda.invoke"} 1', text)
+        self.assertIn('pylot_api_latency_seconds_bucket{endpoint="lambda.invoke",le="0.25"} 0', text)
+        self.assertIn('pylot_api_latency_seconds_bucket{endpoint="lambda.invoke",le="0.5"} 1', text)
+        self.assertIn('pylot_json_records_total{operation="decode"} 10', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+    def test_dump(self):
+        metrics = Metrics()
+        metrics.record_call('lambda.invoke', 0.3)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'metrics.json')
+            openmetrics_output = os.path.join(tmp_dir, 'metrics.prom')
+            metrics.dump(output, openmetrics_output)
+            with open(output, 'r', encoding='utf-8') as _file:
+                self.assertEqual(json.load(_file).get('endpoints').get('lambda.invoke').get('calls'), 1)
+            self.assertTrue(os.path.isfile(openmetrics_output))
+
+    def test_rate_limiter_metrics(self):
+        limiter = RateLimiter(base_delay=0, endpoint='cumulus.get_granule')
+        responses = iter([{'message': 'Too Many Requests', 'statusCode': 429}, {'error': 'Not Found', 'statusCode': 404}])
+        limiter.call(lambda: next(responses))
+        with self.assertRaises(ValueError):
+            limiter.call(lambda: int('x'))
+
+        rsp = get_metrics().to_dict().get('endpoints').get('cumulus.get_granule')
+        self.assertEqual(rsp.get('calls'), 3)
+        self.assertEqual(rsp.get('throttles'), 1)
+        self.assertEqual(rsp.get('retries'), 1)
+        self.assertEqual(rsp.get('errors'), 2)
+
+    def test_json_metrics(self):
+        self.assertEqual(len(list(iter_json_records(io.StringIO('[{"a": 1}, {"a": 2}]')))), 2)
+        writer = get_record_writer('ndjson', os.devnull)
+        writer.write([{'a': 1}, {'a': 2}, {'a': 3}])
+        writer.close()
+
+        rsp = get_metrics().to_dict().get('json')
+        self.assertEqual(rsp.get('decode').get('records'), 2)
+        self.assertEqual(rsp.get('encode').get('records'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
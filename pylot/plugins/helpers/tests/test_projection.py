@@ -0,0 +1,35 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+
+from pylot.plugins.helpers.projection import action_fields, cumulus_field, project_query
+from pylot.tests.fake_stack import FakeCumulusApi
+
+
+class TestProjection(unittest.TestCase):
+    def test_action_fields(self):
+        self.assertEqual(action_fields(FakeCumulusApi.apply_workflow_to_granule), ['granule_id', 'workflow_name'])
+        self.assertEqual(
+            action_fields(FakeCumulusApi().apply_workflow_to_granule, {'workflow_name': 'Publish'}, ['collection_id']),
+            ['granule_id', 'collection_id']
+        )
+
+    def test_cumulus_field(self):
+        self.assertEqual(cumulus_field('granule_id'), 'granuleId')
+        self.assertEqual(cumulus_field('execution_arn'), 'executionArn')
+        self.assertEqual(cumulus_field('status'), 'status')
+
+    def test_project_query(self):
+        with redirect_stdout(io.StringIO()) as stdout:
+            self.assertEqual(project_query({'records': 'granules'}, ['granule_id']),
+                             {'records': 'granules', 'columns': ['granule_id']})
+            query = {'records': 'granules', 'columns': ['granule_id', 'status']}
+            self.assertIs(project_query(query, ['granule_id']), query)
+            self.assertNotIn('Warning', stdout.getvalue())
+            self.assertEqual(project_query({'columns': ['status']}, ['granule_id']).get('columns'),
+                             ['status', 'granule_id'])
+        self.assertIn('Warning: the query columns do not include granule_id', stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
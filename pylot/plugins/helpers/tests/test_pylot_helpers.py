@@ -0,0 +1,46 @@
+import tempfile
+import unittest
+from time import time
+from unittest.mock import MagicMock, patch
+
+from pylot.plugins.helpers.pylot_helpers import PyLOTHelpers
+from pylot.plugins.helpers.token_manager import TOKEN_LIFETIME
+
+
+class TestPyLOTHelpers(unittest.TestCase):
+    def setUp(self) -> None:
+        PyLOTHelpers.reset_clients()
+
+    def tearDown(self) -> None:
+        PyLOTHelpers.reset_clients()
+
+    @patch('pylot.plugins.helpers.token_manager.gettempdir')
+    @patch('pylot.plugins.helpers.token_manager.cumulus_login')
+    @patch('pylot.plugins.helpers.pylot_helpers.CumulusApi')
+    def test_shared_cumulus_api_instance(self, mock_cumulus_api, mock_login, mock_gettempdir):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_gettempdir.return_value = tmp_dir
+            mock_login.return_value = 'token'
+            mock_cumulus_api.side_effect = lambda token: MagicMock(TOKEN=token)
+            cml = PyLOTHelpers.get_cumulus_api_instance()
+            self.assertIs(PyLOTHelpers.get_cumulus_api_instance(), cml)
+            mock_cumulus_api.assert_called_once_with(token='token')
+
+            # The token is replaced in place once it is about to expire
+            mock_login.return_value = 'new_token'
+            with patch('pylot.plugins.helpers.token_manager.time', return_value=time() + TOKEN_LIFETIME - 30):
+                self.assertIs(PyLOTHelpers.get_cumulus_api_instance(), cml)
+            self.assertEqual(cml.TOKEN, 'new_token')
+            self.assertEqual(mock_login.call_count, 2)
+            self.assertEqual(mock_cumulus_api.call_count, 1)
+
+    @patch('boto3.client')
+    def test_shared_boto3_client(self, mock_client):
+        mock_client.side_effect = lambda service: MagicMock(service=service)
+        self.assertIs(PyLOTHelpers.get_boto3_client('s3'), PyLOTHelpers.get_boto3_client('s3'))
+        self.assertEqual(PyLOTHelpers.get_boto3_client('lambda').service, 'lambda')
+        self.assertEqual(mock_client.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
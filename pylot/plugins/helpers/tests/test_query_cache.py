@@ -0,0 +1,84 @@
+import os
+import tempfile
+import threading
+import unittest
+from time import time
+from unittest.mock import patch
+
+from pylot.plugins.helpers.query_cache import QueryCache
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = QueryCache(cache_dir=os.path.join(self.tmp_dir.name, 'cache'), ttl=60, max_bytes=100)
+        self.source = os.path.join(self.tmp_dir.name, 'results.json')
+        with open(self.source, 'w', encoding='utf-8') as _file:
+            _file.write('[{"granule_id": "g1"}]')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_key_normalization(self):
+        self.assertEqual(
+            QueryCache.key({'records': 'granules', 'columns': ['status', 'granule_id'], 'limit': 10}),
+            QueryCache.key({'limit': 10, 'columns': ['granule_id', 'status'], 'records': 'granules'})
+        )
+        self.assertNotEqual(QueryCache.key({'limit': 10}), QueryCache.key({'limit': 11}))
+
+    def test_key_includes_stack(self):
+        query = {'records': 'granules'}
+        self.assertNotEqual(QueryCache.key(query, 'arn:lambda:a', 'a'), QueryCache.key(query, 'arn:lambda:b', 'a'))
+        self.assertNotEqual(QueryCache.key(query, 'arn:lambda:a', 'a'), QueryCache.key(query, 'arn:lambda:a', 'b'))
+        with patch.dict(os.environ, {'RDS_LAMBDA_ARN': 'arn:lambda:a', 'STACK_PREFIX': 'a'}):
+            self.assertEqual(QueryCache.key(query), QueryCache.key(query, 'arn:lambda:a', 'a'))
+
+    def test_concurrent_put(self):
+        key = QueryCache.key({'records': 'granules'})
+        tmp_files = set()
+        barrier = threading.Barrier(8)
+
+        def put():
+            # Every thread is alive while the others write so their ids are distinct
+            barrier.wait()
+            tmp_files.add(self.cache.tmp_file(self.cache.results_file(key)))
+            self.cache.put(key, self.source, {'count': 1})
+            barrier.wait()
+
+        threads = [threading.Thread(target=put) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(tmp_files), 8)
+        self.assertIsNotNone(self.cache.get(key))
+
+    def test_hit_and_miss(self):
+        key = QueryCache.key({'records': 'granules'})
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, self.source, {'count': 1})
+        results_file, metadata = self.cache.get(key)
+        with open(results_file, 'r', encoding='utf-8') as _file:
+            self.assertEqual(_file.read(), '[{"granule_id": "g1"}]')
+        self.assertEqual(metadata, {'count': 1})
+        self.assertEqual(self.cache.get_stats(), {'hits': 1, 'misses': 1, 'evictions': 0})
+        self.assertIn('1 hits, 1 misses (50% hit rate)', self.cache.summary())
+
+    def test_ttl(self):
+        key = QueryCache.key({'records': 'granules'})
+        self.cache.put(key, self.source, {})
+        os.utime(self.cache.results_file(key), (time(), time() - 120))
+        self.assertIsNone(self.cache.get(key))
+        self.assertFalse(os.path.exists(self.cache.results_file(key)))
+
+    def test_lru_eviction(self):
+        keys = [QueryCache.key({'limit': x}) for x in range(4)]
+        for x, key in enumerate(keys):
+            self.cache.put(key, self.source, {})
+            os.utime(self.cache.results_file(key), (time() - 100 + x, time()))
+        # Each entry is 22 bytes so only the 4 most recently used fit in 100 bytes
+        self.cache.get(keys[0])
+        self.cache.put(QueryCache.key({'limit': 5}), self.source, {})
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertGreater(self.cache.get_stats().get('evictions'), 0)
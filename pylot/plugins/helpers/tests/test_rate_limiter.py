@@ -0,0 +1,218 @@
+import concurrent.futures
+import threading
+import unittest
+from time import monotonic, sleep
+from unittest.mock import patch
+
+from pylot.plugins.helpers.metrics import get_metrics, reset_metrics
+from pylot.plugins.helpers.rate_limiter import DEFAULT_LIMITS, DeadlineExceeded, RateLimiter, \
+    configure_rate_limits, get_rate_limiter, is_retryable_error, is_retryable_response, is_throttled_error, \
+    is_throttled_response, rate_limited, reset_rate_limiters
+
+
+class ThrottlingError(Exception):
+    response = {'Error': {'Code': 'ThrottlingException'}}
+
+
+class AccessDeniedError(Exception):
+    response = {'Error': {'Code': 'AccessDeniedException'}}
+
+
+class ReadTimeout(OSError):
+    pass
+
+
+class TestRateLimiter(unittest.TestCase):
+    def tearDown(self) -> None:
+        DEFAULT_LIMITS.pop('test', None)
+        reset_rate_limiters()
+
+    def test_is_throttled(self):
+        self.assertTrue(is_throttled_error(ThrottlingError()))
+        self.assertFalse(is_throttled_error(AccessDeniedError()))
+        self.assertTrue(is_throttled_response({'message': 'Too Many Requests'}))
+        self.assertTrue(is_throttled_response({'statusCode': 503, 'error': 'Service Unavailable'}))
+        self.assertFalse(is_throttled_response({'granuleId': 'g1'}))
+        self.assertFalse(is_throttled_response([]))
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = RateLimiter(initial_concurrency=8, max_concurrency=10, cooldown=0)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.concurrency, 4)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release()
+        self.assertAlmostEqual(limiter.concurrency, 5, delta=0.1)
+
+    def test_decrease_cooldown(self):
+        limiter = RateLimiter(initial_concurrency=8, cooldown=60)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(throttled=True)
+        self.assertEqual(limiter.concurrency, 4)
+        self.assertEqual(limiter.throttles, 3)
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=50, burst=1)
+        start = monotonic()
+        for _ in range(6):
+            limiter.call(lambda: None)
+        self.assertGreaterEqual(monotonic() - start, 0.09)
+
+    def test_retries_throttled_calls(self):
+        responses = [{'message': 'Too Many Requests'}, ThrottlingError(), {'granuleId': 'g1'}]
+
+        def call():
+            rsp = responses.pop(0)
+            if isinstance(rsp, Exception):
+                raise rsp
+            return rsp
+
+        limiter = RateLimiter(base_delay=0.001)
+        self.assertEqual(limiter.call(call), {'granuleId': 'g1'})
+        self.assertEqual(limiter.retries, 2)
+
+    def test_does_not_retry_other_errors(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            raise AccessDeniedError()
+
+        with self.assertRaises(AccessDeniedError):
+            RateLimiter(base_delay=0.001).call(call)
+        self.assertEqual(len(calls), 1)
+
+    def test_is_retryable(self):
+        self.assertTrue(is_retryable_error(ThrottlingError()))
+        self.assertTrue(is_retryable_error(ReadTimeout()))
+        self.assertTrue(is_retryable_error(DeadlineExceeded()))
+        self.assertFalse(is_retryable_error(AccessDeniedError()))
+        self.assertFalse(is_retryable_error(ValueError()))
+        self.assertTrue(is_retryable_response({'message': 'Internal Server Error', 'statusCode': 502}))
+        self.assertFalse(is_retryable_response({'error': 'Not Found', 'statusCode': 404}))
+
+    def test_retries_server_errors_of_reads_only(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ReadTimeout()
+            return {'statusCode': 502} if len(calls) == 2 else {'granuleId': 'g1'}
+
+        self.assertEqual(RateLimiter(base_delay=0.001, endpoint='test.get_granule').call(call), {'granuleId': 'g1'})
+        calls.clear()
+        with self.assertRaises(ReadTimeout):
+            RateLimiter(base_delay=0.001, endpoint='test.apply_workflow_to_granule').call(call)
+        self.assertEqual(len(calls), 1)
+
+    def test_deadline(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            if len(calls) == 1:
+                sleep(1)
+            return len(calls)
+
+        reset_metrics()
+        start = monotonic()
+        limiter = RateLimiter(base_delay=0.001, timeout=0.1, endpoint='test.list_granules')
+        self.assertEqual(limiter.call(call), 2)
+        self.assertLess(monotonic() - start, 0.5)
+        self.assertEqual(get_metrics().to_dict().get('endpoints').get('test.list_granules').get('timeouts'), 1)
+        calls.clear()
+        with self.assertRaises(DeadlineExceeded):
+            RateLimiter(timeout=0.1, endpoint='test.delete_granule').call(call)
+        self.assertEqual(len(calls), 1)
+
+    def test_deadline_starts_when_the_call_runs(self):
+        def call():
+            sleep(0.2)
+            return 'done'
+
+        limiter = RateLimiter(timeout=0.3, max_retries=0, endpoint='test.delete_granule')
+        # With a single thread in the pool the second call waits 0.2 seconds for it, then runs within its deadline
+        with patch('pylot.plugins.helpers.rate_limiter._call_executor', concurrent.futures.ThreadPoolExecutor(1)):
+            with concurrent.futures.ThreadPoolExecutor(2) as executor:
+                futures = [executor.submit(limiter.call, call) for _ in range(2)]
+                self.assertEqual([future.result() for future in futures], ['done', 'done'])
+
+    def test_hedge(self):
+        calls = []
+        released = threading.Event()
+
+        def call(granule_id):
+            calls.append(granule_id)
+            if len(calls) == 1:
+                released.wait(1)
+                return 'slow'
+            return 'fast'
+
+        reset_metrics()
+        limiter = RateLimiter(hedge=True, hedge_delay=0.05, endpoint='test.get_granule')
+        self.assertEqual(limiter.call(call, 'g1'), 'fast')
+        released.set()
+        self.assertEqual(calls, ['g1', 'g1'])
+        self.assertEqual(get_metrics().to_dict().get('endpoints').get('test.get_granule').get('hedges'), 1)
+        # Calls that change records are never duplicated
+        calls.clear()
+        limiter = RateLimiter(hedge=True, hedge_delay=0.05, endpoint='test.update_granule')
+        self.assertEqual(limiter.call(call, 'g1'), 'slow')
+        self.assertEqual(calls, ['g1'])
+
+    def test_abandoned_calls_keep_their_slot(self):
+        released = threading.Event()
+
+        def call():
+            released.wait(1)
+
+        limiter = RateLimiter(timeout=0.05, initial_concurrency=2, endpoint='test.delete_granule')
+        with self.assertRaises(DeadlineExceeded):
+            limiter.call(call)
+        self.assertEqual(limiter.in_flight, 1)
+        released.set()
+        for _ in range(100):
+            if not limiter.in_flight:
+                break
+            sleep(0.01)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_hedge_takes_a_slot_and_token(self):
+        released = threading.Event()
+        in_flight = []
+
+        def call():
+            in_flight.append(limiter.in_flight)
+            if len(in_flight) == 1:
+                released.wait(1)
+            return len(in_flight)
+
+        limiter = RateLimiter(rate=1, burst=5, hedge=True, hedge_delay=0.05, endpoint='test.get_granule')
+        self.assertEqual(limiter.call(call), 2)
+        self.assertEqual(in_flight, [1, 2])
+        self.assertLess(limiter.tokens, 3.5)
+        released.set()
+
+    def test_endpoint_settings(self):
+        configure_rate_limits('test', rate=5, max_retries=0)
+        configure_rate_limits('test.endpoint', rate=1)
+        limiter = get_rate_limiter('test.endpoint')
+        self.assertEqual((limiter.rate, limiter.max_retries), (1, 0))
+        self.assertIs(get_rate_limiter('test.endpoint'), limiter)
+        self.assertEqual(get_rate_limiter('test.other').rate, 5)
+        self.assertEqual(rate_limited(lambda x: x * 2, 'test.other')(2), 4)
+        DEFAULT_LIMITS.pop('test.endpoint')
+
+    def test_service_rate(self):
+        configure_rate_limits('test', service_rate=50, burst=1)
+        limiters = [get_rate_limiter(f'test.endpoint_{x}') for x in range(2)]
+        self.assertIsNone(limiters[0].rate)
+        self.assertIs(limiters[0].shared, limiters[1].shared)
+        start = monotonic()
+        for x in range(6):
+            rate_limited(lambda: None, f'test.endpoint_{x % 2}')()
+        # The endpoints take their tokens from one bucket, so the calls after the first wait for 50 per second
+        self.assertGreaterEqual(monotonic() - start, 0.09)
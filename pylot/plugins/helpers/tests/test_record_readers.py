@@ -0,0 +1,44 @@
+import io
+import json
+import unittest
+
+from pylot.plugins.helpers.record_readers import iter_json_records
+
+RECORDS = [{'granule_id': f'g{x}', 'size': x * 1.5} for x in range(100)] + [12345, 'string', [1, 2], None]
+
+
+class CountingFile(io.BytesIO):
+    reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+class TestRecordReaders(unittest.TestCase):
+    def test_json_array(self):
+        for chunk_size in [1, 3, 64, 65536]:
+            self.assertEqual(list(iter_json_records(io.StringIO(json.dumps(RECORDS, indent=2)), chunk_size)), RECORDS)
+
+    def test_ndjson(self):
+        ndjson = '\n'.join(json.dumps(record) for record in RECORDS)
+        for chunk_size in [1, 3, 64, 65536]:
+            self.assertEqual(list(iter_json_records(io.StringIO(ndjson), chunk_size)), RECORDS)
+
+    def test_binary_utf8(self):
+        data = json.dumps([{'name': 'é' * 10}], ensure_ascii=False).encode('utf-8')
+        self.assertEqual(list(iter_json_records(io.BytesIO(data), 1)), [{'name': 'é' * 10}])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_json_records(io.StringIO(''))), [])
+        self.assertEqual(list(iter_json_records(io.StringIO(' [ ] '))), [])
+
+    def test_invalid(self):
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_records(io.StringIO('[{"a": 1}, {invalid}]')))
+
+    def test_incremental(self):
+        file = CountingFile(json.dumps(RECORDS).encode('utf-8'))
+        records = iter_json_records(file, chunk_size=256)
+        self.assertEqual(next(records), RECORDS[0])
+        self.assertEqual(file.reads, 1)
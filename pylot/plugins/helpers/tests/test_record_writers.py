@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from pylot.plugins.helpers.record_writers import ParquetWriter, flatten_keys, get_field, get_record_writer
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+GRANULES = [
+    {'granuleId': f'g{x}', 'status': 'completed', 'collectionId': 'nalma___1', 'meta': {'size': x}, 'files': [{'k': x}]}
+    for x in range(5)
+]
+
+
+class TestRecordWriters(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp_dir.name, 'out.json')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def read_output(self):
+        with open(self.output, 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def test_json_writer(self):
+        with get_record_writer('json', self.output) as writer:
+            writer.write([{'a': 1}])
+            writer.write([{'a': 2}])
+        self.assertEqual(json.loads(self.read_output()), [{'a': 1}, {'a': 2}])
+
+    def test_json_writer_value(self):
+        with get_record_writer('json', self.output) as writer:
+            writer.write_value({'granuleId': 'g1'})
+        self.assertEqual(json.loads(self.read_output()), {'granuleId': 'g1'})
+
+    def test_ndjson_writer(self):
+        with get_record_writer('ndjson', self.output) as writer:
+            writer.write([{'a': 1}, {'a': 2}])
+            self.assertEqual(self.read_output(), '{"a": 1}\n{"a": 2}\n')
+            writer.write([{'a': 3}])
+        self.assertEqual(writer.record_count, 3)
+
+    def test_json_array_writer(self):
+        with get_record_writer('json-stream', self.output) as writer:
+            writer.write([{'a': 1}, {'a': 2}])
+            writer.write([])
+            writer.write([{'a': 3}])
+        self.assertEqual(json.loads(self.read_output()), [{'a': 1}, {'a': 2}, {'a': 3}])
+
+    def test_json_array_writer_empty(self):
+        with get_record_writer('json-stream', self.output):
+            pass
+        self.assertEqual(json.loads(self.read_output()), [])
+
+    def test_flatten(self):
+        self.assertEqual(flatten_keys(GRANULES[0]), ['granuleId', 'status', 'collectionId', 'meta.size', 'files'])
+        self.assertEqual(get_field(GRANULES[1], 'meta.size'), 1)
+        self.assertEqual(get_field(GRANULES[1], 'files'), '[{"k": 1}]')
+        self.assertIsNone(get_field(GRANULES[1], 'granuleId.missing'))
+
+    def test_csv_writer(self):
+        with get_record_writer('csv', self.output) as writer:
+            writer.write(GRANULES[:2])
+            writer.write(GRANULES[2:])
+        with open(self.output, 'r', encoding='utf-8') as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[3], {
+            'granuleId': 'g3', 'status': 'completed', 'collectionId': 'nalma___1', 'meta.size': '3', 'files': '[{"k": 3}]'
+        })
+
+    def test_csv_writer_fields(self):
+        with get_record_writer('csv', self.output, 'granuleId,meta.size') as writer:
+            writer.write(GRANULES[:2])
+        self.assertEqual(self.read_output().splitlines(), ['granuleId,meta.size', 'g0,0', 'g1,1'])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_writer(self):
+        with patch.object(ParquetWriter, 'row_group_size', 2), \
+                get_record_writer('parquet', self.output, ['granuleId', 'status', 'missing']) as writer:
+            writer.write(GRANULES[:3])
+            writer.write(GRANULES[3:])
+        parquet_file = pyarrow.parquet.ParquetFile(self.output)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+        self.assertIn('RLE_DICTIONARY', parquet_file.metadata.row_group(0).column(1).encodings)
+        self.assertEqual(parquet_file.read().to_pylist()[4], {'granuleId': 'g4', 'status': 'completed', 'missing': None})
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_writer_column_types(self):
+        records = [
+            {'granuleId': 'g0', 'size': None, 'mixed': 1, 'count': 1}, {'granuleId': 'g1', 'size': None, 'mixed': 'a'},
+            {'granuleId': 'g2', 'size': 5, 'mixed': {'a': 1}, 'count': 'many'}, {'granuleId': 'g3', 'count': 2.0}
+        ]
+        with patch.object(ParquetWriter, 'row_group_size', 2), redirect_stdout(io.StringIO()), \
+                get_record_writer('parquet', self.output, ['granuleId', 'size', 'mixed', 'count']) as writer:
+            writer.write(records)
+        rows = pyarrow.parquet.ParquetFile(self.output).read().to_pylist()
+        # size is null in the first row group so it is a string column
+        self.assertEqual([row.get('size') for row in rows], [None, None, '5', None])
+        self.assertEqual([row.get('mixed') for row in rows], ['1', 'a', '{"a": 1}', None])
+        self.assertEqual([row.get('count') for row in rows], [1, None, None, 2])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_writer_removes_failed_file(self):
+        with patch.object(ParquetWriter, '_write_row_group', side_effect=RuntimeError('failed')), \
+                self.assertRaises(RuntimeError):
+            with get_record_writer('parquet', self.output, ['granuleId']) as writer:
+                writer.write(GRANULES)
+        self.assertFalse(os.path.exists(self.output))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_writer_requires_output(self):
+        with self.assertRaises(ValueError):
+            get_record_writer('parquet')
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            get_record_writer('xml')
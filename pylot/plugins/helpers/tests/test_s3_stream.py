@@ -0,0 +1,55 @@
+import io
+import json
+import unittest
+
+from pylot.plugins.helpers.record_readers import iter_json_records
+from pylot.plugins.helpers.s3_stream import TeeReader, open_s3_stream, S3RangeReader
+
+
+class FakeS3Client:
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.data)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        body = self.data
+        if Range:
+            self.ranges.append(Range)
+            start, end = Range.replace('bytes=', '').split('-')
+            body = self.data[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(body)}
+
+
+class TestS3Stream(unittest.TestCase):
+    def setUp(self) -> None:
+        self.records = [{'granule_id': f'granule_{x}'} for x in range(1000)]
+        self.data = json.dumps(self.records).encode('utf-8')
+
+    def test_small_object_single_get(self):
+        s3_client = FakeS3Client(self.data)
+        stream = open_s3_stream('bucket', 'key', s3_client=s3_client)
+        self.assertEqual(list(iter_json_records(stream)), self.records)
+        self.assertEqual(s3_client.ranges, [])
+
+    def test_ranged_reads(self):
+        s3_client = FakeS3Client(self.data)
+        with open_s3_stream('bucket', 'key', s3_client=s3_client, part_size=1000, workers=4) as stream:
+            self.assertIsInstance(stream, S3RangeReader)
+            self.assertEqual(list(iter_json_records(stream, chunk_size=333)), self.records)
+        self.assertEqual(len(s3_client.ranges), len(self.data) // 1000 + 1)
+        self.assertEqual(s3_client.ranges[0], 'bytes=0-999')
+
+    def test_read_all(self):
+        with S3RangeReader(FakeS3Client(self.data), 'bucket', 'key', len(self.data), part_size=100) as stream:
+            self.assertEqual(stream.read(10), self.data[:10])
+            self.assertEqual(stream.read(), self.data[10:])
+            self.assertEqual(stream.read(), b'')
+
+    def test_tee_reader(self):
+        copy = io.BytesIO()
+        tee = TeeReader(io.BytesIO(self.data), copy)
+        self.assertEqual(list(iter_json_records(tee, chunk_size=100)), self.records)
+        self.assertEqual(copy.getvalue(), self.data)
@@ -0,0 +1,40 @@
+import threading
+import time
+import unittest
+
+from pylot.plugins.helpers.scheduler import Throughput, sliding_window
+
+
+class TestScheduler(unittest.TestCase):
+    def test_sliding_window_bounds_in_flight(self):
+        lock = threading.Lock()
+        in_flight = []
+        max_in_flight = []
+
+        def call(value):
+            with lock:
+                in_flight.append(value)
+                max_in_flight.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.remove(value)
+            return value
+
+        results = [future.result() for _, future in sliding_window(call, ({'value': x} for x in range(20)), 4)]
+        self.assertEqual(sorted(results), list(range(20)))
+        self.assertLessEqual(max(max_in_flight), 4)
+
+    def test_sliding_window_refills_around_slow_call(self):
+        def call(value):
+            time.sleep(0.3 if value == 0 else 0.01)
+            return value
+
+        order = [call_args.get('value') for call_args, _ in sliding_window(call, ({'value': x} for x in range(10)), 2)]
+        self.assertEqual(order[-1], 0)
+
+    def test_throughput(self):
+        throughput = Throughput(report_every=0)
+        throughput.add()
+        throughput.add(failed=True)
+        self.assertEqual((throughput.completed, throughput.failed), (2, 1))
+        self.assertIn('2 records processed (1 failed)', throughput.summary())
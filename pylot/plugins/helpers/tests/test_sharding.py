@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+from pylot.plugins.helpers.sharding import merge_shard_files, parse_shard, shard_files, shard_path, shard_records
+
+
+class TestSharding(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('2/8'), (2, 8))
+        self.assertEqual(parse_shard(' 0 / 1 '), (0, 1))
+        for shard in ['8/8', '-1/4', '1', 'a/b']:
+            with self.assertRaises(ValueError):
+                parse_shard(shard)
+
+    def test_shard_records(self):
+        records = [{'granule_id': f'granule_{x:08d}'} for x in range(100)]
+        shards = [list(shard_records(records, x, 4)) for x in range(4)]
+        merged = sorted((record for shard in shards for record in shard), key=lambda x: x.get('granule_id'))
+        self.assertEqual(merged, records)
+        self.assertTrue(all(shards))
+        # The assignment only depends on the key so every process agrees on it
+        self.assertEqual(list(shard_records(records, 1, 4)), shards[1])
+
+    def test_merge_shard_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'run.journal')
+            self.assertEqual(shard_path(path, 2, 8), os.path.join(tmp_dir, 'run.shard-2-of-8.journal'))
+            with open(path, 'w', encoding='utf-8') as _file:
+                _file.write('F\tg0\n')
+            for x, content in [(10, 'D\tg10\n'), (2, 'D\tg2\nD\tg0\nS\ttorn')]:
+                with open(shard_path(path, x, 12), 'w', encoding='utf-8') as _file:
+                    _file.write(content)
+            self.assertEqual(shard_files(path), [shard_path(path, 2, 12), shard_path(path, 10, 12)])
+            self.assertEqual(len(merge_shard_files(path)), 2)
+            with open(path, 'r', encoding='utf-8') as _file:
+                self.assertEqual(_file.read(), 'F\tg0\nD\tg2\nD\tg0\nD\tg10\n')
+            self.assertEqual(shard_files(path), [])
+            self.assertEqual(merge_shard_files(path), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
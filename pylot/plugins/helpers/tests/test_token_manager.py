@@ -0,0 +1,111 @@
+import base64
+import concurrent.futures
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from functools import partial
+from time import sleep, time
+from unittest.mock import patch
+
+from pylot.plugins.helpers.rate_limiter import rate_limited, reset_rate_limiters
+from pylot.plugins.helpers.token_manager import TokenManager, is_expired_token_response, token_expiry
+
+
+def slow_login(log_file, token='token'):
+    with open(log_file, 'a', encoding='utf-8') as _file:
+        _file.write('login\n')
+    sleep(0.2)
+    return token
+
+
+def get_token(token_dir, log_file):
+    with redirect_stdout(io.StringIO()):
+        return TokenManager(token_dir, login=partial(slow_login, log_file)).get_token()
+
+
+class FakeApi:
+    def __init__(self, token):
+        self.TOKEN = token
+        self.tokens = []
+
+    def list_granules(self):
+        self.tokens.append(self.TOKEN)
+        if self.TOKEN == 'expired':
+            return {'message': 'Access token has expired', 'statusCode': 401}
+        return {'results': []}
+
+
+class TestTokenManager(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.tmp_dir.name, 'logins.log')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def logins(self):
+        with open(self.log_file, 'r', encoding='utf-8') as _file:
+            return len(_file.readlines())
+
+    def test_single_login_across_threads(self):
+        manager = TokenManager(self.tmp_dir.name, login=partial(slow_login, self.log_file))
+        with redirect_stdout(io.StringIO()), concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            tokens = list(executor.map(lambda _: manager.get_token(), range(8)))
+        self.assertEqual(tokens, ['token'] * 8)
+        self.assertEqual(self.logins(), 1)
+
+    def test_single_login_across_processes(self):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+            tokens = list(executor.map(get_token, [self.tmp_dir.name] * 4, [self.log_file] * 4))
+        self.assertEqual(tokens, ['token'] * 4)
+        self.assertEqual(self.logins(), 1)
+        self.assertEqual(os.stat(os.path.join(self.tmp_dir.name, 'token')).st_mode & 0o777, 0o600)
+
+    def test_proactive_refresh(self):
+        manager = TokenManager(
+            self.tmp_dir.name, lifetime=100, refresh_margin=60, login=partial(slow_login, self.log_file)
+        )
+        with redirect_stdout(io.StringIO()):
+            manager.get_token()
+            manager.get_token()
+            self.assertEqual(self.logins(), 1)
+            with patch('pylot.plugins.helpers.token_manager.time', return_value=time() + 50):
+                manager.get_token()
+        self.assertEqual(self.logins(), 2)
+
+    def test_rejected_token(self):
+        first = TokenManager(self.tmp_dir.name, login=partial(slow_login, self.log_file, 'old'))
+        second = TokenManager(self.tmp_dir.name, login=partial(slow_login, self.log_file, 'new'))
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(first.get_token(), 'old')
+            self.assertEqual(second.get_token(), 'old')
+            self.assertEqual(second.get_token(rejected='old'), 'new')
+            # The other process finds the replacement in the token file instead of logging in again
+            first.login = partial(slow_login, self.log_file, 'newer')
+            self.assertEqual(first.get_token(rejected='old'), 'new')
+        self.assertEqual(self.logins(), 2)
+
+    def test_token_expiry(self):
+        payload = base64.urlsafe_b64encode(json.dumps({'exp': 1700000000}).encode()).decode().rstrip('=')
+        self.assertEqual(token_expiry(f'header.{payload}.signature', 0), 1700000000)
+        self.assertEqual(token_expiry('opaque', 5), 5)
+        self.assertTrue(is_expired_token_response({'message': 'Access token has expired'}))
+        self.assertFalse(is_expired_token_response({'message': 'Not Found', 'statusCode': 404}))
+
+    def test_retry_expired_token(self):
+        manager = TokenManager(self.tmp_dir.name, login=partial(slow_login, self.log_file, 'fresh'))
+        manager.token, manager.expires = 'expired', time() + 3600
+        api = FakeApi('expired')
+        reset_rate_limiters()
+        with patch('pylot.plugins.helpers.token_manager.get_token_manager', return_value=manager), \
+                redirect_stdout(io.StringIO()):
+            self.assertEqual(rate_limited(api.list_granules, 'cumulus.list_granules')(), {'results': []})
+        self.assertEqual(api.tokens, ['expired', 'fresh'])
+        self.assertEqual(api.TOKEN, 'fresh')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+import base64
+import functools
+import json
+import os
+import threading
+from contextlib import contextmanager
+from tempfile import gettempdir
+from time import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: tokens are still shared between threads but not locked between processes
+    fcntl = None
+
+TOKEN_LIFETIME = 3600
+# Tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 60
+EXPIRED_TOKEN_MESSAGES = ['token has expired', 'expired token', 'invalid access token', 'token is expired']
+
+_token_manager = None
+_token_manager_lock = threading.Lock()
+
+
+def token_expiry(token, default):
+    """
+    Returns the exp claim of a JWT access token or default if the token is not a JWT.
+    """
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return default
+
+
+def is_expired_token_response(rsp):
+    """
+    True if a Cumulus API response rejects the access token, e.g. {"message": "Access token has expired",
+    "statusCode": 401}
+    """
+    if not isinstance(rsp, dict):
+        return False
+    message = f'{rsp.get("error", "")} {rsp.get("message", "")}'.lower()
+    return rsp.get('statusCode') == 401 or any(expired in message for expired in EXPIRED_TOKEN_MESSAGES)
+
+
+def is_expired_token_error(err):
+    return getattr(getattr(err, 'response', None), 'status_code', None) == 401
+
+
+def cumulus_login():
+    """
+    Logs in to the Cumulus API with the configured credentials and returns the new access token.
+    """
+    from cumulus_api import CumulusApi
+    return CumulusApi(token=None).TOKEN
+
+
+class TokenManager:
+    """
+    Shares one Cumulus API access token between the threads of a process, in memory, and between processes, in
+    token_dir/token. The file is only read and written while holding an exclusive lock on token_dir/token.lock so
+    concurrent processes that find the token expired log in once: the first logs in and the others read its token.
+    Tokens are refreshed refresh_margin seconds before they expire. A token the API rejected is replaced even if it
+    has not reached its expiry.
+    """
+    def __init__(self, token_dir=None, lifetime=TOKEN_LIFETIME, refresh_margin=TOKEN_REFRESH_MARGIN, login=None):
+        self.token_dir = token_dir or f'{gettempdir()}/pylot_token/'
+        self.token_file = os.path.join(self.token_dir, 'token')
+        self.lock_file = os.path.join(self.token_dir, 'token.lock')
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.login = login or cumulus_login
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires = 0
+        self.logins = 0
+        os.makedirs(self.token_dir, exist_ok=True)
+
+    def is_fresh(self, token, expires, rejected=None):
+        return bool(token) and token != rejected and time() < expires - self.refresh_margin
+
+    @contextmanager
+    def file_lock(self):
+        with open(self.lock_file, 'a', encoding='utf-8') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_token_file(self):
+        """
+        :return: (token, time it expires) or (None, 0) if there is no token file
+        """
+        try:
+            with open(self.token_file, 'r', encoding='utf-8') as _file:
+                token = _file.readline().strip()
+            mtime = os.stat(self.token_file).st_mtime
+        except OSError:
+            return None, 0
+        return token, token_expiry(token, mtime + self.lifetime)
+
+    def write_token_file(self, token):
+        # Written to a temporary file and moved into place so readers never see a partial token
+        tmp_file = f'{self.token_file}.{os.getpid()}'
+        with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as _file:
+            _file.write(token)
+        os.replace(tmp_file, self.token_file)
+
+    def get_token(self, rejected=None):
+        """
+        Returns a token that is not about to expire, logging in only if neither this process nor the token file has
+        one.
+        :param rejected: a token the Cumulus API rejected
+        """
+        if self.is_fresh(self.token, self.expires, rejected):
+            return self.token
+
+        with self.lock:
+            if self.is_fresh(self.token, self.expires, rejected):
+                return self.token
+            with self.file_lock():
+                token, expires = self.read_token_file()
+                if self.is_fresh(token, expires, rejected):
+                    print(f'Using local token: {self.token_file}')
+                else:
+                    print('Requesting a new Cumulus API token')
+                    token = self.login()
+                    expires = token_expiry(token, time() + self.lifetime)
+                    self.logins += 1
+                    if token:
+                        self.write_token_file(token)
+            self.token, self.expires = token, expires
+
+        return self.token
+
+
+def get_token_manager():
+    global _token_manager
+    with _token_manager_lock:
+        if _token_manager is None:
+            _token_manager = TokenManager()
+        return _token_manager
+
+
+def reset_token_manager():
+    global _token_manager
+    with _token_manager_lock:
+        _token_manager = None
+
+
+def refreshing_token(function):
+    """
+    Wraps a CumulusApi method so the instance's token is refreshed before it expires and a call rejected for an
+    expired token is retried once with a new token. CumulusApi sends its TOKEN attribute with every request so the
+    token is replaced in place and other threads using the instance pick it up. Functions that are not methods of an
+    instance holding a token, e.g. test doubles, are returned unchanged.
+    """
+    instance = getattr(function, '__self__', None)
+    if not isinstance(getattr(instance, 'TOKEN', None), str):
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        manager = get_token_manager()
+        token = manager.get_token()
+        if instance.TOKEN != token:
+            instance.TOKEN = token
+        try:
+            rsp = function(*args, **kwargs)
+            expired = is_expired_token_response(rsp)
+        except Exception as err:
+            if not is_expired_token_error(err):
+                raise
+            expired = True
+        if expired:
+            print('The Cumulus API token was rejected, retrying with a new token')
+            instance.TOKEN = manager.get_token(rejected=token)
+            rsp = function(*args, **kwargs)
+        return rsp
+    return wrapper
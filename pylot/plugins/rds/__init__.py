@@ -0,0 +1 @@
+PLUGIN_HELP = 'Submit queries to the Cumulus RDS instance.'
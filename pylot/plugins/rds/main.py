@@ -1,20 +1,46 @@
 import argparse
+import concurrent.futures
+import heapq
 import inspect
 import json
-import math
+import multiprocessing
 import os
-import pathlib
-from time import sleep
-
-import boto3
-import concurrent.futures
+import shutil
+from collections import Counter, deque
+from contextlib import ExitStack, closing, nullcontext, redirect_stdout
+from datetime import datetime, timezone
+from itertools import chain, islice, product
+from string import Template
+from time import perf_counter
 
 from tabulate import tabulate
 
 from pylot.plugins.cumulus.main import is_action_function
+from pylot.plugins.helpers.aggregator import add_aggregation_arguments, get_aggregator
+from pylot.plugins.helpers.api_cache import CachingCumulusApi, configure_api_cache, get_api_cache
+from pylot.plugins.helpers.bulk_operations import BULK_ACTIONS, bulk_request, check_bulk_arguments, \
+    wait_for_async_operations
+from pylot.plugins.helpers.command_context import bind_command, command_context, output_path
+from pylot.plugins.helpers.execution_monitor import ExecutionMonitor
+from pylot.plugins.helpers.journal import COMPLETED, FAILED, Journal
+from pylot.plugins.helpers.metrics import get_metrics, reset_metrics
+from pylot.plugins.helpers.projection import action_fields, project_query
 from pylot.plugins.helpers.pylot_helpers import PyLOTHelpers
+from pylot.plugins.helpers.query_cache import QueryCache
+from pylot.plugins.helpers.rate_limiter import DEFAULT_LIMITS, configure_rate_limits, rate_limited
+from pylot.plugins.helpers.record_readers import iter_json_records
+from pylot.plugins.helpers.record_writers import COLUMNAR_FORMATS, RECORD_WRITERS, get_record_writer, \
+    records_to_stdout
+from pylot.plugins.helpers.s3_stream import TeeReader, open_s3_stream
+from pylot.plugins.helpers.scheduler import Throughput, sliding_window
+from pylot.plugins.helpers.sharding import merge_shard_files, parse_shard, shard_files, shard_path, shard_records
 from cumulus_api import CumulusApi
 
+# The metrics of each --workers process are written to a shard file of this name and merged by the parent
+WORKER_METRICS = 'rds.metrics.json'
+# Per-granule actions that start a workflow execution for each granule, whose executions are monitored
+EXECUTION_ACTIONS = {action for action, bulk in BULK_ACTIONS.items() if bulk.get('executions')}
+
 
 class QueryRDS:
     @staticmethod
@@ -26,16 +52,18 @@ class QueryRDS:
 
     def invoke_rds_lambda(self, query_data, lambda_client=None, **kwargs):
         if not lambda_client:
-            lambda_client = boto3.client('lambda')
+            lambda_client = PyLOTHelpers.get_boto3_client('lambda')
         lambda_arn = os.getenv('RDS_LAMBDA_ARN')
         if not lambda_arn:
             raise ValueError('The ARN for the RDS lambda is not defined. Provide it as an environment variable.')
 
         # Invoke RDS lambda
         print('Invoking RDS lambda...')
-        rsp = lambda_client.invoke(
+        payload = json.dumps(query_data).encode('utf-8')
+        get_metrics().add_bytes('lambda.invoke', len(payload))
+        rsp = rate_limited(lambda_client.invoke, 'lambda.invoke')(
             FunctionName=lambda_arn,
-            Payload=json.dumps(query_data).encode('utf-8')
+            Payload=payload
         )
         if rsp.get('StatusCode') != 200:
             raise Exception(
@@ -46,29 +74,78 @@ class QueryRDS:
 
     def download_file(self, bucket, key, results, s3_client=None):
         if not s3_client:
-            s3_client = boto3.client('s3')
+            s3_client = PyLOTHelpers.get_boto3_client('s3')
         print('Downloading query results...')
-        s3_client.download_file(
+        rate_limited(s3_client.download_file, 's3.download_file')(
             Bucket=bucket,
             Key=key,
-            Filename=f'{os.getcwd()}/{results}'
+            Filename=os.path.join(os.getcwd(), results)
         )
 
-        file = f'{os.getcwd()}/{results}'
+        file = os.path.join(os.getcwd(), results)
+        get_metrics().add_bytes('s3.download_file', os.path.getsize(file))
         return file
 
 
-def query_rds(query, results='query_results.json', **kwargs):
-    rds = QueryRDS()
+def load_query(rds, query):
+    """
+    Returns the query dictionary from a query file, a json query string or an already loaded query.
+    """
+    if isinstance(query, dict):
+        return query
     if isinstance(query, str) and os.path.isfile(query):
-        query = rds.read_json_file(query)
-    else:
-        query = json.loads(query)
+        return rds.read_json_file(query)
+    return json.loads(query)
+
+
+def substitute(value, params):
+    """
+    Replaces the $name placeholders in the string values of a query template, e.g. "collection_id = '$collection'".
+    """
+    if isinstance(value, dict):
+        return {key: substitute(item, params) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute(item, params) for item in value]
+    if isinstance(value, str):
+        try:
+            return Template(value).substitute(params)
+        except KeyError as err:
+            raise ValueError(f'The query parameter {err} is not defined in --query-params.')
+    return value
+
+
+def expand_queries(query, params=None):
+    """
+    Returns the list of query dictionaries given with -q. Each value can be a query file or json string holding a query
+    or a list of queries. With params every query is a template that is filled in once per parameter set, see
+    substitute. params is a file or json string holding a list of parameter dictionaries, or a dictionary of value
+    lists whose combinations are used, e.g. {"collection": ["nalma___1", "msutls___1"]}.
+    """
+    rds = QueryRDS()
+    queries = []
+    for value in query if isinstance(query, list) else [query]:
+        loaded = load_query(rds, value)
+        queries.extend(loaded if isinstance(loaded, list) else [loaded])
+    if params:
+        params = load_query(rds, params)
+        if isinstance(params, dict):
+            params = [dict(zip(params, values)) for values in product(*params.values())]
+        queries = [substitute(template, values) for template in queries for values in params]
+
+    return queries
+
 
-    query = {'rds_config': query, 'is_test': True}
+def invoke_query(rds, query, query_file='executed_query.sql'):
+    """
+    Invokes the RDS lambda with a query and returns the lambda's response payload containing the bucket and key of
+    the query results. The SQL the lambda executed is written to query_file.
+    """
+    query = {'rds_config': load_query(rds, query), 'is_test': True}
 
     rsp = rds.invoke_rds_lambda(query)
-    ret_dict = json.loads(rsp.get('Payload').read().decode('utf-8'))
+    payload = rsp.get('Payload').read()
+    get_metrics().add_bytes('lambda.invoke', len(payload))
+    ret_dict = json.loads(payload.decode('utf-8'))
     if 'exception' in ret_dict:
         print('There was an exception during the lambda execution')
         print(f'Lambda Stack Trace:\n{ret_dict.get("stack_trace", "")}')
@@ -76,16 +153,264 @@ def query_rds(query, results='query_results.json', **kwargs):
 
     if 'query' in ret_dict:
         query = ret_dict.get('query')
-        with open(f'{os.getcwd()}/executed_query.sql', 'w+') as query_file:
-            query_file.write(query)
+        with open(output_path(query_file), 'w+') as sql_file:
+            sql_file.write(query)
 
-    # Download results from S3
-    file = rds.download_file(bucket=ret_dict.get('bucket'), key=ret_dict.get('key'), results=results)
-    print(f'{ret_dict.get("count", "0")} {ret_dict.get("records", "records")} obtained: {os.getcwd()}/{results}')
+    return ret_dict
+
+
+def get_cached_query(cache, key, refresh=False):
+    if not cache or refresh:
+        return None
+    hit = cache.get(key)
+    if hit:
+        print(f'Using cached query results: {hit[0]}')
+    print(cache.summary())
+    return hit
+
+
+def query_rds(query, results='query_results.json', cache=None, refresh=False, **kwargs):
+    """
+    Runs the query and downloads the results to results. If a QueryCache is provided, a cached result for the same
+    query is used instead of invoking the lambda unless refresh is set, and new results are added to the cache.
+    """
+    rds = QueryRDS()
+    query = load_query(rds, query)
+    key = cache.key(query) if cache else None
+    hit = get_cached_query(cache, key, refresh)
+    if hit:
+        file = os.path.join(os.getcwd(), results)
+        shutil.copyfile(hit[0], file)
+        ret_dict = hit[1]
+    else:
+        ret_dict = invoke_query(rds, query)
+        # Download results from S3
+        file = rds.download_file(bucket=ret_dict.get('bucket'), key=ret_dict.get('key'), results=results)
+        if cache:
+            cache.put(key, file, ret_dict)
+    print(f'{ret_dict.get("count", "0")} {ret_dict.get("records", "records")} obtained: {file}')
 
     return file
 
 
+def stream_query_rds(query, results=None, s3_client=None, cache=None, refresh=False, **kwargs):
+    """
+    Generator yielding the query results while they are downloaded from S3 so API actions can start before the
+    download finishes. The results are only written to disk when a results file name is provided. If a QueryCache is
+    provided cached results are streamed from disk and new results are added to the cache once fully read.
+    """
+    rds = QueryRDS()
+    query = load_query(rds, query)
+    key = cache.key(query) if cache else None
+    hit = get_cached_query(cache, key, refresh)
+    cache_file = None
+    if hit:
+        stream = open(hit[0], 'rb')
+    else:
+        ret_dict = invoke_query(rds, query)
+        print(f'{ret_dict.get("count", "0")} {ret_dict.get("records", "records")} obtained, streaming from S3')
+        stream = open_s3_stream(bucket=ret_dict.get('bucket'), key=ret_dict.get('key'), s3_client=s3_client)
+        if cache:
+            cache_file = cache.tmp_file(cache.results_file(key))
+            stream = TeeReader(stream, open(cache_file, 'wb'))
+    if results:
+        results = os.path.join(os.getcwd(), results)
+        stream = TeeReader(stream, open(results, 'wb'))
+
+    completed = False
+    try:
+        yield from iter_json_records(stream)
+        completed = True
+    finally:
+        stream.close()
+        if cache_file and completed:
+            cache.commit(key, cache_file, ret_dict)
+        elif cache_file:
+            os.remove(cache_file)
+    if results:
+        print(f'Query results written to: {results}')
+
+
+def split_range(shard_range, shards):
+    """
+    Splits "start,end" into shards consecutive (low, high) SQL literals. Integers, floats and ISO 8601 timestamps are
+    supported.
+    """
+    start, end = [value.strip() for value in shard_range.split(',', maxsplit=1)]
+    try:
+        start, end = int(start), int(end)
+        bounds = [str(start + (end - start) * x // shards) for x in range(shards + 1)]
+    except ValueError:
+        try:
+            start, end = float(start), float(end)
+            bounds = [repr(start + (end - start) * x / shards) for x in range(shards + 1)]
+        except ValueError:
+            start, end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+            bounds = [f"'{(start + (end - start) * x / shards).isoformat()}'" for x in range(shards + 1)]
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def shard_query(query, shards, shard_column='cumulus_id', shard_range=None):
+    """
+    Splits a query into shards disjoint queries by adding a condition to its where clause. Without a range, rows are
+    assigned by mod(shard_column, shards) which requires an integer column. With a range, the range is split into equal
+    intervals of shard_column and rows outside the range are not returned.
+    :return: list of queries
+    """
+    if shard_range:
+        conditions = []
+        for x, (low, high) in enumerate(split_range(shard_range, shards)):
+            operator = '<=' if x == shards - 1 else '<'
+            conditions.append(f'{shard_column} >= {low} AND {shard_column} {operator} {high}')
+    else:
+        conditions = [f'mod({shard_column}, {shards}) = {x}' for x in range(shards)]
+
+    where = query.get('where')
+    return [{**query, 'where': f'({where}) AND {condition}' if where else condition} for condition in conditions]
+
+
+def stream_sharded_query_rds(query, shards, shard_column='cumulus_id', shard_range=None, results=None, s3_client=None,
+                             order_by=None, **kwargs):
+    """
+    Generator that invokes the RDS lambda for every shard of the query concurrently and yields the records of each
+    shard's results in shard order as soon as that shard is available. Records split by mod(shard_column, shards) are
+    therefore not in the query's order, while a shard_range split is ordered by shard_column. With order_by, "column"
+    or "column desc", the results of the shards, each sorted by that column, are merged into one sorted stream once
+    every shard is available. The query's limit applies to the merged results. If results is provided the merged
+    records are also written to it as a json array.
+    """
+    rds = QueryRDS()
+    query = load_query(rds, query)
+    writer = get_record_writer('json-stream', os.path.join(os.getcwd(), results)) if results else None
+    count = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=shards) as executor, ExitStack() as streams:
+        futures = [
+            executor.submit(bind_command(invoke_query), rds, shard, f'executed_query_shard_{x}.sql')
+            for x, shard in enumerate(shard_query(query, shards, shard_column, shard_range))
+        ]
+
+        def read_shard(x, future):
+            ret_dict = future.result()
+            print(f'Shard {x + 1}/{shards}: {ret_dict.get("count", "0")} {ret_dict.get("records", "records")}')
+            stream = open_s3_stream(bucket=ret_dict.get('bucket'), key=ret_dict.get('key'), s3_client=s3_client)
+            yield from iter_json_records(streams.enter_context(closing(stream)))
+
+        try:
+            shard_iters = [read_shard(x, future) for x, future in enumerate(futures)]
+            if order_by:
+                column, _, direction = order_by.partition(' ')
+                records = heapq.merge(
+                    *shard_iters, key=lambda record: (record.get(column) is None, record.get(column)),
+                    reverse=direction.strip().lower() == 'desc'
+                )
+            else:
+                records = chain.from_iterable(shard_iters)
+            batch = []
+            for record in islice(records, query.get('limit')):
+                count += 1
+                batch.append(record)
+                yield record
+                if writer and len(batch) >= 1000:
+                    writer.write(batch)
+                    batch = []
+            if writer:
+                writer.write(batch)
+        finally:
+            for future in futures:
+                future.cancel()
+            if writer:
+                writer.close()
+
+    print(f'{count} records obtained from {shards} shards')
+
+
+def stream_multi_query_rds(queries, max_workers=4, dedupe_key=None, results=None, s3_client=None, **kwargs):
+    """
+    Generator that invokes the RDS lambda for the queries with up to max_workers invocations at a time and yields the
+    records of each query's results in query order as soon as that query is available. With a dedupe_key only the first
+    record with each value of that field is yielded. If results is provided the merged records are also written to it
+    as a json array. A table of the lambda time, streaming time and row count of each query is printed at the end.
+    Unlike a single query, the results are not cached.
+    """
+    rds = QueryRDS()
+
+    def run_query(x, query):
+        start = perf_counter()
+        ret_dict = invoke_query(rds, query, f'executed_query_{x}.sql')
+        return ret_dict, perf_counter() - start
+
+    writer = get_record_writer('json-stream', os.path.join(os.getcwd(), results)) if results else None
+    seen = set()
+    table = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        futures = [executor.submit(bind_command(run_query), x, query) for x, query in enumerate(queries)]
+        try:
+            for x, (query, future) in enumerate(zip(queries, futures)):
+                ret_dict, lambda_seconds = future.result()
+                start = perf_counter()
+                rows = duplicates = 0
+                stream = open_s3_stream(bucket=ret_dict.get('bucket'), key=ret_dict.get('key'), s3_client=s3_client)
+                with closing(stream):
+                    batch = []
+                    for record in iter_json_records(stream):
+                        rows += 1
+                        if dedupe_key and record.get(dedupe_key) is not None:
+                            value = json.dumps(record.get(dedupe_key), sort_keys=True)
+                            if value in seen:
+                                duplicates += 1
+                                continue
+                            seen.add(value)
+                        batch.append(record)
+                        yield record
+                        if writer and len(batch) >= 1000:
+                            writer.write(batch)
+                            batch = []
+                    if writer:
+                        writer.write(batch)
+                table.append([
+                    x + 1, str(query.get('where', ''))[:60], round(lambda_seconds, 2), round(perf_counter() - start, 2),
+                    rows, duplicates
+                ])
+        finally:
+            for future in futures:
+                future.cancel()
+            if writer:
+                writer.close()
+
+    print(tabulate(
+        table, headers=['Query', 'Where', 'Lambda Seconds', 'Stream Seconds', 'Rows', 'Duplicates'], tablefmt='psql'
+    ))
+    print(f'{sum(row[4] - row[5] for row in table)} records obtained from {len(queries)} queries')
+
+
+def stream_queries(kwargs, results=None, cache=None, refresh=False):
+    """
+    Generator of the records of the -q queries, fanned out with stream_multi_query_rds when there are several, split
+    with stream_sharded_query_rds with --shards and otherwise streamed with stream_query_rds.
+    """
+    query = kwargs['query']
+    if isinstance(query, list):
+        return stream_multi_query_rds(query, kwargs.get('query_workers', 4), kwargs.get('dedupe_key'), results)
+    if kwargs.get('shards', 1) > 1:
+        return stream_sharded_query_rds(
+            query, kwargs['shards'], kwargs.get('shard_column', 'cumulus_id'), kwargs.get('shard_range'),
+            results=results, order_by=kwargs.get('shard_order')
+        )
+    return stream_query_rds(query, results, cache=cache, refresh=refresh)
+
+
+def export_records(records, output_format, output, fields=None, batch_size=10000):
+    """
+    Writes records to output in batches as they are read, e.g. to convert streamed query results to csv or parquet.
+    """
+    with get_record_writer(output_format, output, fields) as writer:
+        while batch := list(islice(records, batch_size)):
+            writer.write(batch)
+
+    return writer.record_count
+
+
 def return_parser(subparsers):
     query = {
         'records': 'granules',
@@ -96,14 +421,16 @@ def return_parser(subparsers):
     subparser = subparsers.add_parser(
         'rds',
         description='This plugin can send queries to the RDS lambda to directly query the Cumulus RDS. It can also apply '
-             'Cumulus API functions to query results either from a query results file or immediately after querying.',
+                    'Cumulus API functions to query results either from a query results file or immediately after '
+                    'querying.',
         help='Submit queries to the Cumulus RDS instance.\n'
-                    f'Example query: {json.dumps(query)}',
+             f'Example query: {json.dumps(query)}',
         argument_default=argparse.SUPPRESS
     )
     subparser.add_argument(
         '-i', '--input',
-        help='The name of the input file containing RDS query results. You should specify an appripriate action when using this. See -a \n'
+        help='The name of the input file containing RDS query results. You should specify an appripriate action when '
+             'using this. See -a \n'
              'Example: pylot rds -i input.json -a apply_workflow_to_granule -args workflow_name=PublishGranule',
         metavar=''
     )
@@ -111,14 +438,102 @@ def return_parser(subparsers):
         '-q', '--query',
         help='A file containing an RDS Lambda query: <filename>.json or a json query string '
              'using the RDS DSL syntax: https://github.com/ghrcdaac/ghrc_rds_lambda?tab=readme-ov-file#querying\n'
-             f'Example: {json.dumps(query)}',
+             f'Example: {json.dumps(query)}\n'
+             'Several queries, or files holding a json list of queries, can be given. They are run concurrently and '
+             'their results merged into one output. See --query-params',
+        metavar='',
+        nargs='+'
+    )
+    subparser.add_argument(
+        '--query-params',
+        help='Run the query as a template once per parameter set, replacing $name placeholders in its string values. '
+             'A file or json string holding a list of parameter dictionaries or a dictionary of value lists, e.g. '
+             '\'{"collection": ["nalma___1", "msutls___1"]}\' for "where": "collection_id = \'$collection\'".',
+        metavar=''
+    )
+    subparser.add_argument(
+        '--query-workers',
+        help='The maximum number of queries run at one time when there are several. Defaults to 4.',
+        metavar='',
+        type=int
+    )
+    subparser.add_argument(
+        '--dedupe-key',
+        help='When several queries are run only keep the first record with each value of this field, e.g. granule_id.',
         metavar=''
     )
     subparser.add_argument(
         '-o', '--output',
-        help='The name to give to the query results file.',
+        help='The name to give to the query results file. Defaults to query_results.json when no action is applied. '
+             'When an action is applied the results are streamed from S3 and only written to disk if this is provided.',
+        metavar=''
+    )
+    subparser.add_argument(
+        '-s', '--shards',
+        help='Split the query into this many disjoint queries that are run as concurrent RDS lambda invocations and '
+             'merged into one output.',
         metavar='',
-        default='query_results.json'
+        type=int
+    )
+    subparser.add_argument(
+        '--shard-column',
+        help='The column used to partition a sharded query. Without --shard-range this must be an integer column. '
+             'Defaults to cumulus_id.',
+        metavar=''
+    )
+    subparser.add_argument(
+        '--shard-range',
+        help='Partition a sharded query into equal ranges of --shard-column between "start,end", e.g. '
+             '"2023-01-01,2024-01-01". Rows outside the range are not returned.',
+        metavar=''
+    )
+    subparser.add_argument(
+        '--shard-order',
+        help='Merge the results of a sharded query in the order of this column, "column" or "column desc". The results '
+             'of each shard must be sorted by the column. Without it the shards are joined one after the other, which '
+             'only keeps an order by --shard-column with --shard-range.',
+        metavar=''
+    )
+    subparser.add_argument(
+        '--shard',
+        help='Only process the records of this shard, given as <index>/<count> with 0 <= index < count, e.g. 0/4. '
+             'Records are assigned by a hash of --shard-key so separate processes or hosts given the same count '
+             'process disjoint records. The journal and -o file names get a .shard-<index>-of-<count> suffix.',
+        metavar=''
+    )
+    subparser.add_argument(
+        '--shard-key',
+        help='The record field hashed to assign records to shards. Defaults to granule_id.',
+        metavar=''
+    )
+    subparser.add_argument(
+        '-w', '--workers',
+        help='Apply the action with this many worker processes, each processing one --shard of the records. The query '
+             'is run once and each worker writes its output to rds.shard-<index>-of-<count>.log. The worker journals '
+             'are merged into --journal when every worker has finished.',
+        metavar='',
+        type=int
+    )
+    subparser.add_argument(
+        '--merge',
+        help='Merge the shard journals of --journal, e.g. written by --shard runs on several hosts, into --journal.',
+        action='store_true'
+    )
+    subparser.add_argument(
+        '--all-columns',
+        help='Keep the query\'s columns when applying an action. By default the query only returns the columns the '
+             'action reads, the arguments of its Cumulus API function not provided with -args.',
+        action='store_true'
+    )
+    subparser.add_argument(
+        '--no-cache',
+        help='Do not read or write the local query results cache.',
+        action='store_true'
+    )
+    subparser.add_argument(
+        '--refresh',
+        help='Ignore cached results for the query and replace them with fresh results.',
+        action='store_true'
     )
     subparser.add_argument(
         '-l', '--list-cumulus-api-methods',
@@ -138,11 +553,46 @@ def return_parser(subparsers):
     )
     subparser.add_argument(
         '-b', '--batch-size',
-        help='Limit the numbe of API actions that will be taken at one time.',
+        help='The maximum number of API actions kept in flight at one time. Fewer may be in flight while the Cumulus '
+             'API is throttling requests.',
         metavar='',
         default=10,
         type=int
     )
+    subparser.add_argument(
+        '--bulk-size',
+        help='Apply apply_workflow_to_granule, reingest_granule and delete_granule with Cumulus bulk granule '
+             'operations of this many granules instead of one call per record. -b sets the bulk requests in flight. '
+             'Records without a collection_id are sent by granule id.',
+        metavar='',
+        type=int
+    )
+    subparser.add_argument(
+        '-r', '--max-rate',
+        help='The maximum number of Cumulus API requests per second across all endpoints.',
+        metavar='',
+        type=float
+    )
+    subparser.add_argument(
+        '-f', '--format',
+        dest='output_format',
+        help='The format API action responses are written to stdout in. ndjson and json-stream write each response '
+             'as soon as it completes. Without an action, csv and parquet export the query results to -o, or '
+             'query_results.<format>, with the query columns as the file columns. parquet requires pyarrow.',
+        choices=RECORD_WRITERS,
+        default='ndjson'
+    )
+    subparser.add_argument(
+        '-j', '--journal',
+        help='Append the submission and outcome of each API action to this file so an interrupted run can be resumed.',
+        metavar=''
+    )
+    subparser.add_argument(
+        '--resume',
+        help='Skip records the journal reports as completed and retry failed or unfinished ones. Requires --journal.',
+        action='store_true'
+    )
+    add_aggregation_arguments(subparser)
     subparser.add_argument(
         '-args', '--api-arguments',
         nargs='+',
@@ -150,6 +600,7 @@ def return_parser(subparsers):
         metavar=''
     )
 
+
 def list_methods(input):
     capi = CumulusApi
     res = inspect.getmembers(capi, is_action_function)
@@ -163,94 +614,515 @@ def list_methods(input):
     print(tabulate(table, headers=['Function Name', 'Parameters'], tablefmt='psql'))
     print('API Documentation: https://nasa.github.io/cumulus-api/ \n')
 
+
 def read_json_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as infile:
-        res = json.load(infile)
-    return res
-
-def monitor_batch(responses, capi):
-    print(f'monitoring: {responses}')
-    execution_arns = []
-    for response in responses:
-        granule_id = response.get('granuleId', '')
-        execution_url = capi.get_granule(granule_id=granule_id).get('execution', '')
-        # print(capi.get_granule(granule_id=granule_id))
-        msg = f'(granule_id, execution_arn): ({granule_id}'
-        if execution_url:
-            execution_arn = execution_url.rsplit('/')[-1]
-            execution_arns.append(execution_arn)
-            msg = f'{msg}, {execution_arn})'
-        else:
-            msg = f'{msg}, ) '
-
-        print(f'{granule_id}: {execution_url}')
-
-    sfn = boto3.client('stepfunctions')
-    done = False
-    while not done and len(execution_arns) > 0:
-        for execution_arn in execution_arns:
-            rsp = sfn.describe_execution(executionArn=execution_arn)
-            status = rsp.get('status')
-            print(f'{status}: {execution_arn}')
-            if  status == 'RUNNING':
-                done = False
-                sleep(5)
-                break
-            else:
-                done = True
-    pass
+    """
+    Reads records from a json array file or a newline delimited json file.
+    """
+    return list(iter_json_records(file_path))
+
+
+def monitor_batch(responses, capi, started_after=None):
+    """
+    Waits for the executions started by the API responses and prints a summary of the ones that did not succeed.
+    :param started_after: time the requests were submitted, earlier executions of the granules are not monitored
+    :return: list of failed executions
+    """
+    print(f'Monitoring {len(responses)} responses')
+    # The granules are looked up until their new execution is recorded, which a cached response would hide
+    if isinstance(capi, CachingCumulusApi):
+        capi = capi.api
+    monitor = ExecutionMonitor()
+    failures = monitor.wait(monitor.resolve_execution_arns(responses, capi, started_after))
+    monitor.print_summary()
+
+    return failures
+
+
+def build_call_args(records, required_args, api_arg_dict):
+    """
+    Generator producing the keyword arguments for each record. Values found in the record take precedence over the
+    values provided with -args.
+    """
+    for record in records:
+        call_args = {}
+        for required_arg in required_args:
+            call_args.update({required_arg: record.get(required_arg, api_arg_dict.get(required_arg))})
+        yield call_args
+
+
+def is_error_response(rsp):
+    """
+    The Cumulus API returns errors as a response body, e.g. {"error": "Not Found", "statusCode": 404, ...}
+    """
+    return isinstance(rsp, dict) and ('error' in rsp or rsp.get('statusCode', 200) >= 400)
+
+
+def print_skipped(journal):
+    if journal and journal.skipped:
+        print(f'Skipped {journal.skipped} records completed in a previous run')
+
+
+def record_outcome(chunk, failed, message, throughput, journal=None):
+    """
+    Counts and journals the outcome of every granule of a bulk request.
+    """
+    for call_args in chunk:
+        throughput.add(failed=failed)
+        if journal:
+            journal.record(FAILED if failed else COMPLETED, call_args, message)
+
+
+def bulk_chunks(call_args_iter, bulk_size):
+    """
+    Generator of the sliding_window arguments of submit_bulk_requests: {"label": "Chunk <n>", "chunk": [call_args]}
+    """
+    number = 0
+    while chunk := list(islice(call_args_iter, bulk_size)):
+        number += 1
+        yield {'label': f'Chunk {number}', 'chunk': chunk}
+
+
+def submit_bulk_requests(capi, action, api_arg_dict, chunks, batch_size, throughput, journal=None):
+    """
+    Submits the chunks as requests of the action's bulk operation with up to batch_size requests in flight. The
+    granules of rejected requests are recorded as failed.
+    :return: ({async operation id: (label, chunk)}, list of failed chunks)
+    """
+    function_name = BULK_ACTIONS.get(action).get('function')
+    bulk_function = rate_limited(getattr(capi, function_name), f'cumulus.{function_name}')
+
+    def submit(label, chunk):
+        print(f'{label}: submitting {len(chunk)} granules to {function_name}')
+        return bulk_function(data=bulk_request(chunk, action, api_arg_dict))
+
+    operations = {}
+    failures = []
+    for call_args, future in sliding_window(submit, chunks, batch_size):
+        label, chunk = call_args.get('label'), call_args.get('chunk')
+        try:
+            rsp = future.result()
+        except Exception as err:
+            rsp = {'error': type(err).__name__, 'message': str(err)}
+        if is_error_response(rsp) or not rsp.get('id'):
+            print(f'{label}: {function_name} failed: {rsp}')
+            failures.append({'chunk': label, 'granules': len(chunk), 'response': rsp})
+            record_outcome(chunk, True, rsp.get('message', '') if isinstance(rsp, dict) else '', throughput, journal)
+            continue
+        print(f'{label}: {len(chunk)} granules submitted as async operation {rsp.get("id")}')
+        operations[rsp.get('id')] = (label, chunk)
+
+    return operations, failures
+
 
+def apply_bulk_action(results, action, api_arg_dict, bulk_size, batch_size, writer=None, journal=None, resume=False):
+    """
+    Applies a per-granule action through its Cumulus bulk granule operation. The records are grouped into requests of
+    bulk_size granules with up to batch_size requests in flight and the async operations they start are polled until
+    they finish. The journal records the outcome of each granule so a resumed run only resubmits granules whose
+    operation failed. The -args are checked before any request is submitted.
+    """
+    check_bulk_arguments(action, api_arg_dict)
+    capi = PyLOTHelpers.get_cumulus_api_instance()
+    submitted = datetime.now(timezone.utc)
+    call_args_iter = build_call_args(results, ['granule_id', 'collection_id'], api_arg_dict)
+    if journal:
+        call_args_iter = journal.track(call_args_iter, resume)
+    throughput = Throughput(report_every=0)
+    operations, failures = submit_bulk_requests(
+        capi, action, api_arg_dict, bulk_chunks(call_args_iter, bulk_size), batch_size, throughput, journal
+    )
+
+    responses = []
+    finished = wait_for_async_operations(capi, {operation_id: label for operation_id, (label, _) in operations.items()})
+    for operation_id, operation in finished.items():
+        label, chunk = operations.get(operation_id)
+        if writer:
+            writer.write([operation])
+        failed = operation.get('status') != 'SUCCEEDED'
+        record_outcome(chunk, failed, operation.get('output', '') if failed else '', throughput, journal)
+        if failed:
+            failures.append({'chunk': label, 'granules': len(chunk), 'response': operation})
+        elif BULK_ACTIONS.get(action).get('executions'):
+            responses.extend({'granuleId': call_args.get('granule_id')} for call_args in chunk)
+
+    print_skipped(journal)
+    print(throughput.summary())
+    if responses:
+        failures.extend(monitor_batch(responses, capi, submitted))
 
-def apply_api_action(results, action, api_arg_dict, batch_size):
+    return responses, failures
+
+
+def record_response(call_args, rsp, writer=None, journal=None):
+    """
+    Writes, or prints, the response of an action call and journals its outcome.
+    :return: True if the response reports an error
+    """
+    if writer:
+        writer.write([rsp])
+    else:
+        print(rsp)
+    failed = is_error_response(rsp)
+    if journal:
+        journal.record(FAILED if failed else COMPLETED, call_args, rsp.get('message', '') if failed else '')
+
+    return failed
+
+
+def apply_api_action(results, action, api_arg_dict, batch_size, writer=None, journal=None, resume=False,
+                     bulk_size=None):
+    """
+    Applies the Cumulus API action to every record keeping batch_size calls in flight. Executions started by the calls
+    of EXECUTION_ACTIONS are monitored once every record has been submitted. If a journal is provided the submission
+    and outcome of each call are appended to it and, when resuming, records that already completed are skipped. With a
+    bulk_size, actions that have a bulk granule operation are applied with apply_bulk_action instead.
+    """
+    if bulk_size:
+        if action in BULK_ACTIONS:
+            return apply_bulk_action(results, action, api_arg_dict, bulk_size, batch_size, writer, journal, resume)
+        print(f'{action} has no bulk operation, applying it to each record. Bulk actions: {", ".join(BULK_ACTIONS)}')
     capi = PyLOTHelpers.get_cumulus_api_instance()
     capi_function = getattr(capi, action)
     spec = inspect.getfullargspec(capi_function)
     required_args = spec.args[1:]
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        batch = []
-        for x in range(math.ceil(len(results))):
-            futures = []
-            i = x * batch_size
-            batch = results[i:i + batch_size]
-            for record in batch:
-                call_args = {}
-                for required_arg in required_args:
-                    call_args.update({required_arg: record.get(required_arg, api_arg_dict.get(required_arg))})
-                print(f'Executing: {action}({call_args})')
-                futures.append(executor.submit(capi_function, **call_args))
-
-            responses = []
-            for future in concurrent.futures.as_completed(futures):
-                rsp = future.result()
-                print(rsp)
-                responses.append(rsp)
-            sleep(5)
-            monitor_batch(responses, capi)
+    limited_function = rate_limited(capi_function, f'cumulus.{action}')
+    submitted = datetime.now(timezone.utc)
 
+    def call_action(**call_args):
+        print(f'Executing: {action}({call_args})')
+        return limited_function(**call_args)
 
-def main(**kwargs):
+    call_args_iter = build_call_args(results, required_args, api_arg_dict)
+    if journal:
+        call_args_iter = journal.track(call_args_iter, resume)
+
+    throughput = Throughput()
+    # Only the granule ids are kept for monitoring so memory does not grow with the size of the responses
+    responses = []
+    for call_args, future in sliding_window(call_action, call_args_iter, batch_size):
+        try:
+            rsp = future.result()
+        except Exception as err:
+            print(f'Failed: {action}({call_args}): {err}')
+            throughput.add(failed=True)
+            if journal:
+                journal.record(FAILED, call_args, err)
+            continue
+
+        failed = record_response(call_args, rsp, writer, journal)
+        if isinstance(rsp, dict) and 'granuleId' in rsp:
+            responses.append({'granuleId': rsp.get('granuleId')})
+        throughput.add(failed=failed)
+
+    print_skipped(journal)
+    print(throughput.summary())
+    failures = monitor_batch(responses, capi, submitted) if action in EXECUTION_ACTIONS else []
+
+    return responses, failures
+
+
+def required_fields(action, api_args, bulk_size=None, extra=()):
+    """
+    :param api_args: names of the arguments provided with -args
+    :return: the record fields apply_api_action reads for the action
+    """
+    if bulk_size and action in BULK_ACTIONS:
+        return list(dict.fromkeys(['granule_id', 'collection_id', *extra]))
+    return action_fields(getattr(PyLOTHelpers.get_cumulus_api_instance(), action), api_args, extra)
+
+
+def action_query(kwargs, query):
+    """
+    Projects the query to the columns the -a action reads from each record, see project_query.
+    :return: the query dictionary
+    """
+    api_args = [arg.split('=', maxsplit=1)[0] for arg in kwargs.get('api_arguments', [])]
+    # The records are assigned to shards by the shard key after they are queried
+    sharded = 'shard' in kwargs or kwargs.get('workers', 1) > 1
+    extra = [kwargs.get('shard_key', 'granule_id')] if sharded else []
+    # The shards of a sharded query are merged on the --shard-order column
+    if kwargs.get('shards', 1) > 1 and kwargs.get('shard_order'):
+        extra.append(kwargs['shard_order'].split()[0])
+    fields = required_fields(kwargs['api_action'], api_args, kwargs.get('bulk_size'), extra)
+
+    return project_query(query, fields) if fields else query
+
+
+def prepare_queries(kwargs):
+    """
+    Expands the -q queries and projects them to the columns of the -a action unless --all-columns is set.
+    :return: the query dictionary, or a list of them when there are several queries
+    """
+    queries = expand_queries(kwargs['query'], kwargs.get('query_params'))
+    if len(queries) > 1 and kwargs.get('shards', 1) > 1:
+        raise ValueError('--shards splits a single query and can not be combined with several queries.')
+    if 'api_action' in kwargs and not kwargs.get('all_columns'):
+        queries = [action_query(kwargs, query) for query in queries]
+
+    return queries if len(queries) > 1 else queries[0]
+
+
+def worker_settings(workers):
+    """
+    Collects the process wide settings made by the global options, e.g. --api-timeout and --api-cache, for the worker
+    processes, which do not inherit them. Rate limits are divided between the workers so together they stay within
+    the limits of a single process.
+    """
+    limits = {
+        endpoint: {**settings, **{key: settings[key] / workers for key in ['rate', 'service_rate'] if settings.get(key)}}
+        for endpoint, settings in DEFAULT_LIMITS.items()
+    }
+    cache = get_api_cache()
+
+    return {'limits': limits, 'api_cache': (cache.ttl, cache.max_entries) if cache else None}
+
+
+def apply_worker_settings(settings):
+    for endpoint, limits in settings.get('limits', {}).items():
+        configure_rate_limits(endpoint, **limits)
+    if settings.get('api_cache'):
+        configure_api_cache(*settings.get('api_cache'))
+    reset_metrics()
+
+
+def run_shard(kwargs, log_file, settings=None, metrics_file=None):
+    """
+    Runs main for one shard with its output written to log_file. Used as the worker process entry point.
+    :param settings: the parent's worker_settings
+    :param metrics_file: file the shard's metrics are written to for the parent to merge
+    :return: main's return code
+    """
+    with open(log_file, 'w', encoding='utf-8') as log, redirect_stdout(log), command_context(log):
+        apply_worker_settings(settings or {})
+        try:
+            return main(**kwargs)
+        except Exception as err:
+            print(f'{type(err).__name__}: {err}')
+            return 1
+        finally:
+            if metrics_file:
+                get_metrics().dump(metrics_file)
+
+
+def merge_shard_metrics(path):
+    """
+    Adds the metrics of the shard files of path to this process's metrics and removes them.
+    :return: list of merged shard files
+    """
+    files = shard_files(path)
+    for file in files:
+        with open(file, 'r', encoding='utf-8') as _file:
+            get_metrics().merge(json.load(_file))
+        os.remove(file)
+
+    return files
+
+
+def run_workers(kwargs, workers, mp_context=None):
+    """
+    Runs the query once and applies the action to its results with one process per shard. The shard journals are
+    merged into the journal once every worker has finished.
+    :return: 0 if every shard succeeded, 1 otherwise
+    """
+    if 'api_action' not in kwargs:
+        raise ValueError('--workers requires an action. See -a')
+    if 'shard' in kwargs:
+        raise ValueError('--workers assigns the shards itself and can not be combined with --shard')
+
+    worker_kwargs = {key: value for key, value in kwargs.items() if key not in ['workers', 'merge', 'query', 'shards']}
+    if 'query' in kwargs:
+        kwargs = {**kwargs, 'query': prepare_queries(kwargs)}
+        results = kwargs.get('output') or output_path('query_results.json')
+        if isinstance(kwargs['query'], list) or kwargs.get('shards', 1) > 1:
+            deque(stream_queries(kwargs, results), maxlen=0)
+        else:
+            query_rds(kwargs['query'], results, cache=None if kwargs.get('no_cache') else QueryCache(),
+                      refresh=kwargs.get('refresh', False))
+        worker_kwargs.update({'input': results})
+        worker_kwargs.pop('output', None)
+
+    if 'max_rate' in kwargs:
+        worker_kwargs['max_rate'] = kwargs['max_rate'] / workers
+    settings = worker_settings(workers)
+    log_files = [output_path(f'rds.shard-{x}-of-{workers}.log') for x in range(workers)]
+    metrics_file = output_path(WORKER_METRICS)
+
+    print(f'Applying {kwargs["api_action"]} with {workers} worker processes')
+    context = mp_context or multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(
+                run_shard, {**worker_kwargs, 'shard': f'{x}/{workers}'}, log_files[x], settings,
+                shard_path(metrics_file, x, workers)
+            )
+            for x in range(workers)
+        ]
+        return_codes = [future.result() for future in futures]
+    merge_shard_metrics(metrics_file)
+
+    table = []
+    for x, return_code in enumerate(return_codes):
+        states = Counter()
+        if 'journal' in kwargs:
+            states.update(Journal(shard_path(kwargs['journal'], x, workers)).load().values())
+        table.append([
+            f'{x}/{workers}', return_code, states.get(COMPLETED, 0), states.get(FAILED, 0),
+            log_files[x]
+        ])
+    print(tabulate(table, headers=['Shard', 'Return Code', 'Completed', 'Failed', 'Log'], tablefmt='psql'))
+    if 'journal' in kwargs:
+        merged = merge_shard_files(kwargs['journal'])
+        print(f'Merged {len(merged)} shard journals into {kwargs["journal"]}')
+
+    return 0 if not any(return_codes) else 1
+
+
+def merge_journals(kwargs):
+    if 'journal' not in kwargs:
+        raise ValueError('--merge requires the --journal the shards were run with.')
+    merged = merge_shard_files(kwargs['journal'])
+    print(f'Merged {len(merged)} shard journals into {kwargs["journal"]}: {", ".join(merged)}')
+
+
+def apply_shard(kwargs):
+    """
+    Parses --shard and adds the shard suffix to the -j and -o file names in kwargs.
+    :return: (index, count), or None without --shard
+    """
+    if 'shard' not in kwargs:
+        return None
+    shard = parse_shard(kwargs['shard'])
+    if 'api_action' not in kwargs:
+        raise ValueError('--shard requires an action. See -a')
+    for key in ['journal', 'output']:
+        if key in kwargs:
+            kwargs[key] = shard_path(kwargs[key], *shard)
+
+    return shard
+
+
+def read_records(kwargs, stream):
+    """
+    Reads the records of the -i input file or of the -q queries. Query results are parsed as they are streamed when
+    stream is set, so the first call of an action is made as soon as data is available, and are otherwise downloaded
+    to the -o file.
+    :return: iterator of records, or None when the query results were only downloaded
+    """
+    if 'input' in kwargs:
+        return iter_json_records(kwargs['input'])
+    if 'query' not in kwargs:
+        raise ValueError('An input file or query file are required but neither have been provided.')
+
+    cache = None if kwargs.get('no_cache') else QueryCache()
+    refresh = kwargs.get('refresh', False)
+    if 'api_action' in kwargs:
+        results = kwargs.get('output')
+    else:
+        results = None if stream else kwargs.get('output') or output_path('query_results.json')
+    if stream or isinstance(kwargs['query'], list) or kwargs.get('shards', 1) > 1:
+        records = stream_queries(kwargs, results, cache, refresh)
+        if stream:
+            return records
+        deque(records, maxlen=0)
+    else:
+        query_rds(kwargs['query'], results, cache=cache, refresh=refresh)
+
+    return None
+
+
+def export_results(kwargs, records, output_format):
+    """
+    Writes the records to the -o file in a columnar format, with the query columns as the file columns.
+    """
+    output = kwargs.get('output') or output_path(f'query_results.{output_format}')
+    queries = kwargs['query'] if isinstance(kwargs.get('query'), list) else [kwargs.get('query', {})]
+    columns = None
+    if all(query.get('columns') for query in queries):
+        columns = list(dict.fromkeys(column for query in queries for column in query.get('columns')))
+    count = export_records(records, output_format, os.path.join(os.getcwd(), output), columns)
+    print(f'{count} records exported to: {output}')
+
+
+def parse_api_arguments(api_args):
+    """
+    ["name_1=value_1", "name_2=value_2"] -> {"name_1": "value_1", "name_2": "value_2"}
+    """
+    api_arg_dict = {}
+    for arg in api_args:
+        key_val_list = arg.split('=')
+        api_arg_dict.update({key_val_list[0]: key_val_list[1]})
+
+    return api_arg_dict
+
+
+def run_action(kwargs, records, output_format):
+    """
+    Applies the -a action to the records with the -args, journaling each call to -j.
+    :return: 1 if any call failed, 0 otherwise
+    """
+    api_arg_dict = parse_api_arguments(kwargs.get('api_arguments', []))
+    if kwargs.get('resume') and 'journal' not in kwargs:
+        raise ValueError('--resume requires a --journal file.')
+    with get_record_writer(output_format) as writer, \
+            Journal(kwargs.get('journal')) if 'journal' in kwargs else nullcontext() as journal:
+        _, failures = apply_api_action(
+            records, kwargs['api_action'], api_arg_dict, kwargs.get('batch_size'), writer, journal,
+            kwargs.get('resume', False), kwargs.get('bulk_size')
+        )
+
+    return 1 if failures else 0
+
+
+def process_records(kwargs):
+    """
+    Reads the -i input or -q query results and exports or aggregates them, or applies the -a action to them.
+    :return: main's return code
+    """
+    shard = apply_shard(kwargs)
+    if 'query' in kwargs:
+        kwargs['query'] = prepare_queries(kwargs)
+    output_format = kwargs.get('output_format', 'ndjson')
+    aggregator = None if 'api_action' in kwargs else get_aggregator(**kwargs)
+    export = 'api_action' not in kwargs and not aggregator and output_format in COLUMNAR_FORMATS
+    # Query results are only downloaded to a file when they are not consumed by an action, export or aggregation
+    records = read_records(kwargs, 'api_action' in kwargs or export or aggregator is not None)
+    if shard:
+        print(f'Processing shard {shard[0]}/{shard[1]} of the records by {kwargs.get("shard_key", "granule_id")}')
+        records = shard_records(records, *shard, kwargs.get('shard_key', 'granule_id'))
+
+    if export:
+        export_results(kwargs, records, output_format)
+    elif aggregator:
+        aggregator.add_all(records)
+        print(aggregator.summary())
+        with get_record_writer(output_format, kwargs.get('output')) as writer:
+            writer.write(aggregator.results())
+
+    if 'max_rate' in kwargs:
+        configure_rate_limits('cumulus', service_rate=kwargs['max_rate'])
+    if 'api_action' in kwargs:
+        return run_action(kwargs, records, output_format)
+
+    return 0
+
+
+def run(kwargs):
     print(kwargs)
     if 'list_cumulus_api_methods' in kwargs:
         list_methods(kwargs['list_cumulus_api_methods'])
-
+    elif kwargs.get('merge'):
+        merge_journals(kwargs)
+    elif kwargs.get('workers', 1) > 1:
+        return run_workers(kwargs, kwargs['workers'])
     else:
-        if 'input' in kwargs:
-            input_file = kwargs['input']
-        elif 'query' in kwargs:
-            input_file = query_rds(kwargs['query'])
-        else:
-            raise ValueError('An input file or query file are required but neither have been provided.')
+        return process_records(kwargs)
 
-        res = read_json_file(input_file)
-        if 'api_action' in kwargs and len(res) > 0:
-            action = kwargs['api_action']
-            api_arg_dict = {}
-            if 'api_arguments' in kwargs:
-                api_args = kwargs['api_arguments']
-                for arg in api_args:
-                    key_val_list = arg.split('=')
-                    api_arg_dict.update({key_val_list[0]: key_val_list[1]})
+    return 0
 
-            apply_api_action(res, action, api_arg_dict, kwargs.get('batch_size'))
 
-    return 0
+def main(**kwargs):
+    # Action responses, and aggregations without -o, are written to stdout
+    aggregated = 'api_action' not in kwargs and 'output' not in kwargs and get_aggregator(**kwargs) is not None
+    with records_to_stdout('api_action' in kwargs or aggregated):
+        return run(kwargs)
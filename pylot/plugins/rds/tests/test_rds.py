@@ -1,9 +1,49 @@
 import argparse
+import io
+import json
+import multiprocessing
 import os
+import tempfile
 import unittest
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from unittest.mock import patch, MagicMock
 
-from pylot.plugins.rds.main import return_parser, QueryRDS, query_rds
+from pylot.plugins.helpers.api_cache import configure_api_cache, get_api_cache, reset_api_cache
+from pylot.plugins.helpers.bulk_operations import bulk_request, check_bulk_arguments
+from pylot.plugins.helpers.journal import Journal
+from pylot.plugins.helpers.metrics import get_metrics, reset_metrics
+from pylot.plugins.helpers.query_cache import QueryCache
+from pylot.plugins.helpers.rate_limiter import DEFAULT_LIMITS, configure_rate_limits, reset_rate_limiters
+from pylot.plugins.rds.main import return_parser, QueryRDS, query_rds, read_json_file, apply_api_action, \
+    stream_query_rds, shard_query, split_range, stream_sharded_query_rds, run_workers, expand_queries, \
+    worker_settings, apply_worker_settings, main
+from pylot.tests.fake_stack import FakeStack
+
+
+@contextmanager
+def working_directory(path):
+    """
+    Runs the block in path so the files main writes to the working directory, e.g. executed_query.sql, stay there.
+    """
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(cwd)
+
+
+class FakeCumulusApi:
+    def __init__(self):
+        self.calls = []
+
+    def apply_workflow_to_granule(self, granule_id, workflow_name):
+        self.calls.append(granule_id)
+        if granule_id == 'bad':
+            raise ValueError('bad granule')
+        if granule_id == 'missing':
+            return {'error': 'Not Found', 'message': 'Granule not found', 'statusCode': 404}
+        return {'granuleId': granule_id, 'workflow': workflow_name}
 
 
 class TestRDS(unittest.TestCase):
@@ -25,6 +65,13 @@ class TestRDS(unittest.TestCase):
         data = rds.read_json_file(f'{os.path.dirname(os.path.realpath(__file__))}/test_file.json')
         self.assertEqual(data, {"some": "json"})
 
+    def test_read_ndjson_file(self):
+        with tempfile.NamedTemporaryFile('w+', suffix='.ndjson') as file:
+            file.write('{"granule_id": "g1"}\n\n{"granule_id": "g2"}\n')
+            file.flush()
+            data = read_json_file(file.name)
+        self.assertEqual(data, [{'granule_id': 'g1'}, {'granule_id': 'g2'}])
+
     @patch('json.loads')
     @patch('pylot.plugins.rds.main.QueryRDS')
     def test_query_rds(self, mock_opensearch, mock_json_loads):
@@ -33,6 +80,82 @@ class TestRDS(unittest.TestCase):
         query_rds(query={}, record_type='')
         pass
 
+    @patch('pylot.plugins.rds.main.open_s3_stream')
+    @patch('pylot.plugins.rds.main.invoke_query')
+    def test_stream_query_rds(self, mock_invoke_query, mock_open_s3_stream):
+        mock_invoke_query.return_value = {'bucket': 'bucket', 'key': 'key', 'count': 2}
+        mock_open_s3_stream.return_value = io.BytesIO(b'[{"granule_id": "g1"}, {"granule_id": "g2"}]')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            records = stream_query_rds('{}', results=os.path.join(tmp_dir, 'results.json'))
+            mock_invoke_query.assert_not_called()
+            self.assertEqual(list(records), [{'granule_id': 'g1'}, {'granule_id': 'g2'}])
+            self.assertEqual(
+                read_json_file(os.path.join(tmp_dir, 'results.json')), [{'granule_id': 'g1'}, {'granule_id': 'g2'}]
+            )
+
+    @patch('pylot.plugins.rds.main.invoke_query')
+    @patch('pylot.plugins.rds.main.QueryRDS')
+    def test_query_rds_cache(self, mock_rds, mock_invoke_query):
+        mock_invoke_query.return_value = {'bucket': 'bucket', 'key': 'key', 'count': 1}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, 'downloaded.json')
+            with open(source, 'w', encoding='utf-8') as _file:
+                _file.write('[{"granule_id": "g1"}]')
+            mock_rds.return_value.download_file.return_value = source
+            cache = QueryCache(cache_dir=os.path.join(tmp_dir, 'cache'))
+            results = os.path.join(tmp_dir, 'results.json')
+            query_rds({'records': 'granules'}, results=results, cache=cache)
+            query_rds({'records': 'granules'}, results=results, cache=cache)
+            self.assertEqual(mock_invoke_query.call_count, 1)
+            self.assertEqual(read_json_file(results), [{'granule_id': 'g1'}])
+            query_rds({'records': 'granules'}, results=results, cache=cache, refresh=True)
+            self.assertEqual(mock_invoke_query.call_count, 2)
+
+    def test_shard_query(self):
+        query = {'records': 'granules', 'where': "collection_id = 'nalma'", 'limit': 10}
+        self.assertEqual(
+            [shard.get('where') for shard in shard_query(query, 2)],
+            ["(collection_id = 'nalma') AND mod(cumulus_id, 2) = 0", "(collection_id = 'nalma') AND mod(cumulus_id, 2) = 1"]
+        )
+        self.assertEqual(
+            [shard.get('where') for shard in shard_query({}, 2, 'created_at', '2024-01-01,2024-01-03')],
+            ["created_at >= '2024-01-01T00:00:00' AND created_at < '2024-01-02T00:00:00'",
+             "created_at >= '2024-01-02T00:00:00' AND created_at <= '2024-01-03T00:00:00'"]
+        )
+        self.assertEqual(split_range('0,10', 3), [('0', '3'), ('3', '6'), ('6', '10')])
+
+    @patch('pylot.plugins.rds.main.open_s3_stream')
+    @patch('pylot.plugins.rds.main.invoke_query')
+    def test_stream_sharded_query_rds(self, mock_invoke_query, mock_open_s3_stream):
+        mock_invoke_query.side_effect = lambda rds, query, query_file: {'key': query.get('where')[-1]}
+        mock_open_s3_stream.side_effect = lambda bucket, key, s3_client: io.BytesIO(
+            f'[{{"shard": {key}}}, {{"shard": {key}}}]'.encode('utf-8')
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = os.path.join(tmp_dir, 'results.json')
+            records = list(stream_sharded_query_rds({'records': 'granules', 'limit': 5}, 3, results=results))
+            self.assertEqual([record.get('shard') for record in records], [0, 0, 1, 1, 2])
+            self.assertEqual(read_json_file(results), records)
+        self.assertEqual(mock_invoke_query.call_count, 3)
+
+    @patch('pylot.plugins.rds.main.open_s3_stream')
+    @patch('pylot.plugins.rds.main.invoke_query')
+    def test_stream_sharded_query_rds_order(self, mock_invoke_query, mock_open_s3_stream):
+        # Shard x of 3 holds the ids x, x + 3, ... sorted by id
+        mock_invoke_query.side_effect = lambda rds, query, query_file: {'key': query.get('where')[-1]}
+        mock_open_s3_stream.side_effect = lambda bucket, key, s3_client: io.BytesIO(
+            json.dumps([{'id': x} for x in range(int(key), 10, 3)]).encode('utf-8')
+        )
+        query = {'records': 'granules', 'limit': 7}
+        records = list(stream_sharded_query_rds(query, 3, order_by='id'))
+        self.assertEqual([record.get('id') for record in records], list(range(7)))
+
+        mock_open_s3_stream.side_effect = lambda bucket, key, s3_client: io.BytesIO(
+            json.dumps([{'id': x} for x in reversed(range(int(key), 10, 3))]).encode('utf-8')
+        )
+        records = list(stream_sharded_query_rds(query, 3, order_by='id desc'))
+        self.assertEqual([record.get('id') for record in records], list(range(9, 2, -1)))
+
     def test_invoke_rds_lambda(self):
         rds = QueryRDS()
         os.environ['RDS_LAMBDA_ARN'] = 'FAKE_ARN'
@@ -47,6 +170,211 @@ class TestRDS(unittest.TestCase):
             rds.invoke_rds_lambda(query_data={}, lambda_client=mock_client)
             self.assertTrue('The ARN for the RDS lambda is not defined' in context.exception)
 
+    def test_main_export_csv(self):
+        query = '{"records": "granules", "columns": ["granule_id", "status"], "limit": 3}'
+        with FakeStack(10) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'granules.csv')
+            with working_directory(tmp_dir), redirect_stdout(io.StringIO()):
+                self.assertEqual(main(query=query, output=output, output_format='csv', no_cache=True), 0)
+            with open(output, 'r', encoding='utf-8') as file:
+                self.assertEqual(file.read().splitlines(), [
+                    'granule_id,status', 'granule_00000000,completed', 'granule_00000001,failed',
+                    'granule_00000002,running'
+                ])
+
+    def test_main_aggregation(self):
+        with FakeStack(9) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'counts.ndjson')
+            with working_directory(tmp_dir), redirect_stdout(io.StringIO()):
+                main(query='{"records": "granules"}', output=output, group_by='status', max_fields='granule_id',
+                     no_cache=True)
+            with open(output, 'r', encoding='utf-8') as file:
+                self.assertEqual(file.read().splitlines()[0],
+                                 '{"count": 3, "max_granule_id": "granule_00000006", "status": "completed"}')
+
     def test_download_file(self):
         rds = QueryRDS()
         rds.download_file(bucket='', key='', results='', s3_client=MagicMock())
+
+    @patch('pylot.plugins.rds.main.monitor_batch')
+    @patch('pylot.plugins.rds.main.PyLOTHelpers')
+    def test_apply_api_action(self, mock_helpers, mock_monitor):
+        mock_helpers.get_cumulus_api_instance.return_value = FakeCumulusApi()
+        records = [{'granule_id': 'g1'}, {'granule_id': 'bad'}, {'granule_id': 'g2', 'workflow_name': 'Other'}]
+        responses, _ = apply_api_action(records, 'apply_workflow_to_granule', {'workflow_name': 'Publish'}, batch_size=2)
+        self.assertEqual(sorted(responses, key=lambda x: x.get('granuleId')), [{'granuleId': 'g1'}, {'granuleId': 'g2'}])
+        mock_monitor.assert_called_once()
+
+    @patch('pylot.plugins.rds.main.monitor_batch')
+    @patch('pylot.plugins.rds.main.PyLOTHelpers')
+    def test_apply_api_action_resume(self, mock_helpers, mock_monitor):
+        capi = FakeCumulusApi()
+        mock_helpers.get_cumulus_api_instance.return_value = capi
+        records = [{'granule_id': x} for x in ['g1', 'bad', 'missing', 'g2']]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with Journal(os.path.join(tmp_dir, 'run.log')) as journal:
+                apply_api_action(records, 'apply_workflow_to_granule', {'workflow_name': 'Publish'}, 2, journal=journal)
+            capi.calls.clear()
+            with Journal(os.path.join(tmp_dir, 'run.log')) as journal:
+                apply_api_action(records, 'apply_workflow_to_granule', {'workflow_name': 'Publish'}, 2, journal=journal,
+                                 resume=True)
+        self.assertEqual(sorted(capi.calls), ['bad', 'missing'])
+
+    @patch('pylot.plugins.helpers.bulk_operations.sleep')
+    def test_apply_api_action_bulk(self, mock_sleep):
+        records = [{'granule_id': f'granule_{x:08d}', 'collection_id': f'collection___{x % 10}'} for x in range(25)]
+        with FakeStack(25) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir, \
+                redirect_stdout(io.StringIO()):
+            with Journal(os.path.join(tmp_dir, 'run.log')) as journal:
+                responses, failures = apply_api_action(
+                    records, 'apply_workflow_to_granule', {'workflow_name': 'Publish'}, 2, journal=journal,
+                    bulk_size=10
+                )
+            with open(os.path.join(tmp_dir, 'run.log'), 'r', encoding='utf-8') as file:
+                completed = [line for line in file if line.startswith('D\t')]
+            calls = {endpoint: len(latencies) for endpoint, latencies in stack.recorder.latencies.items()}
+        self.assertEqual(len(responses), 25)
+        self.assertEqual(failures, [])
+        self.assertEqual(len(completed), 25)
+        self.assertEqual(sorted(stack.capi.granule_executions), [record.get('granule_id') for record in records])
+        self.assertEqual(calls.get('cumulus.bulk_granules'), 3)
+        self.assertNotIn('cumulus.apply_workflow_to_granule', calls)
+
+    @patch('pylot.plugins.helpers.bulk_operations.sleep')
+    def test_apply_api_action_bulk_poll_errors(self, mock_sleep):
+        records = [{'granule_id': f'granule_{x:08d}', 'collection_id': f'collection___{x % 10}'} for x in range(25)]
+        with FakeStack(25) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir, \
+                redirect_stdout(io.StringIO()):
+            stack.capi.get_async_operation = MagicMock(return_value={'error': 'Not Found', 'statusCode': 404})
+            with Journal(os.path.join(tmp_dir, 'run.log')) as journal:
+                responses, failures = apply_api_action(
+                    records, 'apply_workflow_to_granule', {'workflow_name': 'Publish'}, 2, journal=journal,
+                    bulk_size=10
+                )
+            with open(os.path.join(tmp_dir, 'run.log'), 'r', encoding='utf-8') as file:
+                failed = [line for line in file if line.startswith('F\t')]
+        # Each operation is given up on after 5 failed polls and its granules journaled as failed
+        self.assertEqual(stack.capi.get_async_operation.call_count, 15)
+        self.assertEqual(responses, [])
+        self.assertEqual([failure.get('response').get('status') for failure in failures], ['POLL_FAILED'] * 3)
+        self.assertEqual(len(failed), 25)
+
+    def test_apply_api_action_bulk_missing_arguments(self):
+        records = ({'granule_id': f'granule_{x:08d}'} for x in range(25))
+        with FakeStack(25) as stack, stack.patch(), redirect_stdout(io.StringIO()):
+            with self.assertRaisesRegex(ValueError, 'workflow_name'):
+                apply_api_action(records, 'apply_workflow_to_granule', {}, 2, bulk_size=10)
+            self.assertNotIn('cumulus.bulk_granules', stack.recorder.latencies)
+
+    def test_main_action_projection(self):
+        with FakeStack(6) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'query_results.json')
+            with working_directory(tmp_dir), redirect_stdout(io.StringIO()):
+                self.assertEqual(main(
+                    query='{"records": "granules"}', api_action='apply_workflow_to_granule',
+                    api_arguments=['workflow_name=Publish'], output=output, batch_size=2, no_cache=True
+                ), 0)
+            # Only the granule_id column was queried since the workflow name is provided with -args
+            self.assertEqual(read_json_file(output), [{'granule_id': f'granule_{x:08d}'} for x in range(6)])
+            self.assertEqual(len(stack.capi.granule_executions), 6)
+
+    def test_main_action_stdout(self):
+        with FakeStack(6) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+            with working_directory(tmp_dir), redirect_stdout(io.StringIO()) as stdout, \
+                    redirect_stderr(io.StringIO()) as stderr:
+                self.assertEqual(main(query='{"records": "granules"}', api_action='get_granule', batch_size=2,
+                                      no_cache=True), 0)
+        # The responses are the only output on stdout, the progress goes to stderr
+        responses = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(sorted(response.get('granuleId') for response in responses),
+                         [f'granule_{x:08d}' for x in range(6)])
+        self.assertIn('Executing: get_granule', stderr.getvalue())
+
+    def test_expand_queries(self):
+        template = {'records': 'granules', 'where': "collection_id = '$collection' AND status = '$status'"}
+        self.assertEqual(len(expand_queries(['{"records": "granules"}', '[{"limit": 1}, {"limit": 2}]'])), 3)
+        queries = expand_queries(json.dumps(template), '{"collection": ["a", "b"], "status": ["failed"]}')
+        self.assertEqual([query.get('where') for query in queries], [
+            "collection_id = 'a' AND status = 'failed'", "collection_id = 'b' AND status = 'failed'"
+        ])
+        queries = expand_queries(json.dumps(template), '[{"collection": "c", "status": "running"}]')
+        self.assertEqual(queries, [{'records': 'granules', 'where': "collection_id = 'c' AND status = 'running'"}])
+        with self.assertRaises(ValueError):
+            expand_queries(json.dumps(template), '[{"collection": "c"}]')
+
+    def test_main_multi_query(self):
+        with FakeStack(10) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+            with working_directory(tmp_dir), redirect_stdout(io.StringIO()) as stdout:
+                self.assertEqual(main(
+                    query=['{"records": "granules", "limit": 3}', '{"records": "granules", "limit": 5}'],
+                    dedupe_key='granule_id', query_workers=2, no_cache=True
+                ), 0)
+            records = read_json_file(os.path.join(tmp_dir, 'query_results.json'))
+            invocations = stack.lambda_client.invocations
+        self.assertEqual([record.get('granule_id') for record in records], [f'granule_{x:08d}' for x in range(5)])
+        self.assertEqual(invocations, 2)
+        self.assertIn('5 records obtained from 2 queries', stdout.getvalue())
+
+    def test_main_workers(self):
+        cwd = os.getcwd()
+        with FakeStack(30) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                input_file = os.path.join(tmp_dir, 'records.ndjson')
+                with open(input_file, 'w', encoding='utf-8') as file:
+                    file.writelines(f'{{"granule_id": "granule_{x:08d}"}}\n' for x in range(30))
+                kwargs = {
+                    'input': input_file, 'api_action': 'apply_workflow_to_granule',
+                    'api_arguments': ['workflow_name=A'], 'journal': os.path.join(tmp_dir, 'run.journal'), 'batch_size': 4
+                }
+                reset_metrics()
+                with redirect_stdout(io.StringIO()):
+                    return_code = run_workers(kwargs, 3, multiprocessing.get_context('fork'))
+                logs = sorted(file for file in os.listdir(tmp_dir) if file.endswith('.log'))
+                completed = Journal(kwargs.get('journal')).load()
+                shard_files = [file for file in os.listdir(tmp_dir) if '.shard-' in file and not file.endswith('.log')]
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(return_code, 0)
+        self.assertEqual(logs, [f'rds.shard-{x}-of-3.log' for x in range(3)])
+        self.assertEqual(len(completed), 30)
+        self.assertEqual(set(completed.values()), {'D'})
+        self.assertEqual(shard_files, [])
+        # The metrics of the workers are merged into the parent's
+        endpoints = get_metrics().to_dict().get('endpoints')
+        self.assertEqual(endpoints.get('cumulus.apply_workflow_to_granule').get('calls'), 30)
+
+    def test_worker_settings(self):
+        limits = {endpoint: dict(settings) for endpoint, settings in DEFAULT_LIMITS.items()}
+        try:
+            configure_rate_limits('cumulus', rate=8, service_rate=20, timeout=30)
+            configure_api_cache(10, 100)
+            settings = worker_settings(4)
+            reset_api_cache()
+            DEFAULT_LIMITS['cumulus'] = {}
+            apply_worker_settings(settings)
+            self.assertEqual(DEFAULT_LIMITS.get('cumulus'), {
+                **limits.get('cumulus'), 'rate': 2, 'service_rate': 5, 'timeout': 30
+            })
+            self.assertEqual(DEFAULT_LIMITS.get('stepfunctions.describe_execution').get('rate'), 5)
+            self.assertEqual((get_api_cache().ttl, get_api_cache().max_entries), (10, 100))
+        finally:
+            DEFAULT_LIMITS.clear()
+            DEFAULT_LIMITS.update(limits)
+            reset_rate_limiters()
+            reset_api_cache()
+
+    def test_bulk_request(self):
+        self.assertEqual(
+            bulk_request([{'granule_id': 'g1', 'collection_id': 'c___1'}], 'apply_workflow_to_granule',
+                         {'workflow_name': 'Publish'}),
+            {'workflowName': 'Publish', 'granules': [{'granuleId': 'g1', 'collectionId': 'c___1'}]}
+        )
+        self.assertEqual(
+            bulk_request([{'granule_id': 'g1', 'collection_id': None}], 'delete_granule',
+                         {'force_remove_from_cmr': 'true'}),
+            {'forceRemoveFromCmr': True, 'ids': ['g1']}
+        )
+        with self.assertRaises(ValueError):
+            check_bulk_arguments('apply_workflow_to_granule', {})
+        check_bulk_arguments('delete_granule', {})
@@ -0,0 +1 @@
+PLUGIN_HELP = 'Interactive pylot session that reuses one Cumulus API client.'
@@ -0,0 +1,61 @@
+import cmd
+import shlex
+from time import perf_counter
+
+from .. import shell
+from pylot.plugins.helpers.session import Session
+
+
+class PyLOTShell(cmd.Cmd):
+    intro = 'PyLOT shell. Enter pylot commands without "pylot", e.g. cumulus list granules limit=10. ' \
+            'Type help or exit.'
+    prompt = 'pylot> '
+
+    def __init__(self, session=None, **kwargs):
+        super().__init__(**kwargs)
+        self.session = session or Session()
+
+    def default(self, line):
+        try:
+            argv = shlex.split(line)
+            start = perf_counter()
+            return_code = self.session.run(argv)
+            print(f'[{return_code}] {perf_counter() - start:.3f}s')
+        except Exception as err:
+            print(f'{type(err).__name__}: {err}')
+
+    def emptyline(self):
+        pass
+
+    def do_help(self, arg):
+        if arg:
+            self.default(f'{arg} -h')
+        else:
+            self.session.run(['-h'])
+
+    def do_exit(self, arg):
+        """
+        Exit the shell.
+        """
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, arg):
+        print()
+        return True
+
+
+def return_parser(subparsers):
+    subparsers.add_parser(
+        'shell',
+        help=shell.PLUGIN_HELP,
+        description='Starts an interactive session. Commands are entered without "pylot" and run in one process so '
+                    'they share the plugin imports, the Cumulus API client and the AWS connection pools.'
+    )
+
+
+def main(**kwargs):
+    PyLOTShell().cmdloop()
+
+    return 0
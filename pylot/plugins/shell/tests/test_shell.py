@@ -0,0 +1,23 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+
+from pylot.plugins.shell.main import PyLOTShell
+from pylot.tests.fake_stack import FakeStack
+
+
+class TestShell(unittest.TestCase):
+    def test_shell(self):
+        commands = io.StringIO('cumulus --count list granules limit=15\nrds -b not_a_number\n\nexit\n')
+        with FakeStack(15) as stack, stack.patch(), redirect_stdout(io.StringIO()) as stdout:
+            shell = PyLOTShell(stdin=commands)
+            shell.use_rawinput = False
+            shell.cmdloop()
+        output = stdout.getvalue()
+        self.assertIn('"count": 15', output)
+        self.assertIn('[0]', output)
+        self.assertIn('[2]', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
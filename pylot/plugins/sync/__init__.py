@@ -0,0 +1 @@
+PLUGIN_HELP = 'Mirror Cumulus granules into a local SQLite database and query or act on the mirror.'
@@ -0,0 +1,209 @@
+from contextlib import nullcontext
+from itertools import islice
+from time import perf_counter, time
+
+from .. import sync
+from pylot.plugins.helpers.aggregator import add_aggregation_arguments, get_aggregator
+from pylot.plugins.helpers.granule_mirror import GranuleMirror
+from pylot.plugins.helpers.journal import Journal
+from pylot.plugins.helpers.projection import cumulus_field
+from pylot.plugins.helpers.pylot_helpers import PyLOTHelpers
+from pylot.plugins.helpers.rate_limiter import configure_rate_limits, rate_limited
+from pylot.plugins.helpers.record_writers import RECORD_WRITERS, get_record_writer
+from pylot.plugins.rds.main import apply_api_action, required_fields
+
+
+def return_parser(subparsers):
+    subparser = subparsers.add_parser(
+        'sync',
+        help=sync.PLUGIN_HELP,
+        description='Keeps a local SQLite mirror of Cumulus granules. The first sync of a collection loads every '
+                    'granule, later syncs only request the granules updated since the last one. Queries and API '
+                    'actions then read the mirror instead of the Cumulus API or the RDS lambda.\n'
+                    'Examples:\n'
+                    ' - pylot sync granules --collection nalma___1\n'
+                    ' - pylot sync query --collection nalma___1 --where "status = \'failed\'" -o failed.ndjson\n'
+                    ' - pylot sync query --where "status = \'failed\'" -a reingest_granule'
+    )
+    subparser.add_argument(
+        '-d', '--database',
+        help='The SQLite mirror file. Defaults to <tmp>/pylot_cache/granules.sqlite.',
+        metavar=''
+    )
+    sync_subparsers = subparser.add_subparsers(title='commands', dest='sync_command', required=True)
+
+    granules_parser = sync_subparsers.add_parser(
+        'granules',
+        help='Load the granules updated since the last sync into the mirror.',
+        description='Loads the granules updated since the last sync of the collection into the mirror. Granules are '
+                    'requested in updatedAt order and the watermark is saved with every page so an interrupted sync '
+                    'continues where it stopped. Deleted granules are only removed by a --full sync.'
+    )
+    granules_parser.add_argument('--collection', help='The collection id to sync. Defaults to every collection.')
+    granules_parser.add_argument(
+        '--full', action='store_true',
+        help='Reload every granule and remove granules that no longer exist in Cumulus.'
+    )
+    granules_parser.add_argument(
+        '--page-size', metavar='N', type=int, default=100, help='granules requested per page. Defaults to 100.'
+    )
+    granules_parser.add_argument(
+        '-r', '--max-rate', metavar='N', type=float,
+        help='maximum number of Cumulus API requests per second across all endpoints.'
+    )
+
+    query_parser = sync_subparsers.add_parser(
+        'query',
+        help='Write or act on the mirrored granules.',
+        description='Reads granule records from the mirror. The records are written with -f/-o, aggregated with the '
+                    'aggregation options or passed to a Cumulus API action as rds -i input records would be. Each '
+                    'record also has granule_id and collection_id for the action arguments.'
+    )
+    query_parser.add_argument('--collection', help='Only read granules of this collection.')
+    query_parser.add_argument(
+        '-w', '--where',
+        help='SQL condition over collection_id, granule_id, status, created_at and updated_at (epoch milliseconds) '
+             'or the json record, e.g. "status = \'failed\' AND json_extract(record, \'$.provider\') = \'ghrc\'".',
+        metavar=''
+    )
+    query_parser.add_argument('-l', '--limit', metavar='N', type=int, help='maximum number of granules to read.')
+    query_parser.add_argument('-o', '--output', metavar='', help='the file to write the records to. Defaults to stdout.')
+    query_parser.add_argument(
+        '-f', '--format', dest='output_format', choices=RECORD_WRITERS, default='ndjson',
+        help='the format the records, aggregation results or API action responses are written in.'
+    )
+    query_parser.add_argument('--fields', metavar='', help='comma separated fields written by csv and parquet.')
+    add_aggregation_arguments(query_parser)
+    query_parser.add_argument(
+        '-a', '--api-action', metavar='', help='apply this Cumulus API action to each granule, e.g. reingest_granule.'
+    )
+    query_parser.add_argument(
+        '-b', '--batch-size', metavar='', type=int, default=10,
+        help='the maximum number of API actions kept in flight at one time.'
+    )
+    query_parser.add_argument(
+        '--bulk-size', metavar='', type=int,
+        help='apply apply_workflow_to_granule, reingest_granule and delete_granule with Cumulus bulk granule '
+             'operations of this many granules instead of one call per granule.'
+    )
+    query_parser.add_argument('-j', '--journal', metavar='', help='append the progress of each API action to this file.')
+    query_parser.add_argument(
+        '--resume', action='store_true', help='skip granules the journal reports as completed. Requires --journal.'
+    )
+    query_parser.add_argument(
+        '-args', '--api-arguments', nargs='+', metavar='',
+        help='Additional arguments the API action may require provided as "name_1=value_1 name_2=value_2"'
+    )
+
+
+def sync_granules(mirror, collection=None, full=False, page_size=100):
+    """
+    Requests the granules updated since the collection's watermark, or every granule for a full sync, in updatedAt
+    order and writes them to the mirror one page at a time. Pages are keyed on updatedAt rather than numbered: each
+    request starts from the last updatedAt received, so a granule updated during the sync, which moves to the end of
+    the order, can not shift the pages and cause other granules to be skipped.
+    :return: (granules written, granules removed)
+    """
+    capi = PyLOTHelpers.get_cumulus_api_instance()
+    list_granules = rate_limited(capi.list_granules, 'cumulus.list_granules')
+    state = None if full else mirror.get_state(collection)
+    watermark = state.get('watermark') if state else None
+
+    kwargs = {'sort_by': 'updatedAt', 'order': 'asc', 'limit': page_size}
+    if collection:
+        kwargs.update({'collectionId': collection})
+    if watermark is not None:
+        print(f'Requesting granules updated since {watermark}')
+    else:
+        print('Requesting every granule')
+
+    sync_id = int(time() * 1000)
+    written = 0
+    # updatedAt__from is inclusive so the granules received at the cursor are returned again and skipped
+    cursor, page, seen = watermark, 1, set()
+    while True:
+        cursor_kwargs = {'updatedAt__from': cursor} if cursor is not None else {}
+        rsp = list_granules(**kwargs, **cursor_kwargs, page=page)
+        if not isinstance(rsp, dict) or 'results' not in rsp:
+            raise ValueError(f'Listing granules failed: {rsp}')
+        results = rsp.get('results')
+        records = [
+            record for record in results
+            if cursor is None or record.get('updatedAt') != cursor or record.get('granuleId') not in seen
+        ]
+        if records:
+            watermark = mirror.upsert(records, collection, sync_id, watermark)
+            written += len(records)
+        if len(results) < page_size:
+            break
+
+        last = results[-1].get('updatedAt')
+        if last == cursor:
+            # A full page of granules updated in the same millisecond, continue through them by page number
+            page += 1
+        else:
+            cursor, page, seen = last, 1, set()
+        seen.update(record.get('granuleId') for record in results if record.get('updatedAt') == cursor)
+    removed = mirror.delete_stale(collection, sync_id) if state is None else 0
+
+    return written, removed
+
+
+def read_mirror(mirror, collection=None, where=None, limit=None, fields=None):
+    """
+    Generator of mirrored granule records with the snake case identifiers API actions take as arguments.
+    :param fields: only read these snake case fields, e.g. granule_id, from the records
+    """
+    if fields:
+        for record in mirror.query(collection, where, limit=limit, fields=[cumulus_field(field) for field in fields]):
+            yield {field: record.get(cumulus_field(field)) for field in fields}
+        return
+    for record in mirror.query(collection, where, limit=limit):
+        yield {'granule_id': record.get('granuleId'), 'collection_id': record.get('collectionId'), **record}
+
+
+def main(sync_command, database=None, collection=None, **kwargs):
+    with GranuleMirror(database) as mirror:
+        if sync_command == 'granules':
+            if kwargs.get('max_rate'):
+                configure_rate_limits('cumulus', service_rate=kwargs.get('max_rate'))
+            start = perf_counter()
+            written, removed = sync_granules(
+                mirror, collection, kwargs.get('full', False), kwargs.get('page_size', 100)
+            )
+            print(
+                f'Synced {written} granules and removed {removed} in {perf_counter() - start:.1f}s. '
+                f'{mirror.count(collection)} granules mirrored in {mirror.database}'
+            )
+            return 0
+
+        output_format = kwargs.get('output_format', 'ndjson')
+        aggregator = get_aggregator(**kwargs)
+        if kwargs.get('api_action'):
+            api_arg_dict = dict(arg.split('=', maxsplit=1) for arg in kwargs.get('api_arguments') or [])
+            fields = required_fields(kwargs.get('api_action'), api_arg_dict, kwargs.get('bulk_size'))
+            records = read_mirror(mirror, collection, kwargs.get('where'), kwargs.get('limit'), fields)
+            if kwargs.get('resume') and not kwargs.get('journal'):
+                raise ValueError('--resume requires a --journal file.')
+            with get_record_writer(output_format, kwargs.get('output')) as writer, \
+                    Journal(kwargs.get('journal')) if kwargs.get('journal') else nullcontext() as journal:
+                _, failures = apply_api_action(
+                    records, kwargs.get('api_action'), api_arg_dict, kwargs.get('batch_size', 10), writer, journal,
+                    kwargs.get('resume', False), kwargs.get('bulk_size')
+                )
+            return 1 if failures else 0
+
+        records = mirror.query(collection, kwargs.get('where'), limit=kwargs.get('limit'))
+        with get_record_writer(output_format, kwargs.get('output'), None if aggregator else kwargs.get('fields')) \
+                as writer:
+            if aggregator:
+                aggregator.add_all(records)
+                print(aggregator.summary())
+                writer.write(aggregator.results())
+            else:
+                while batch := list(islice(records, 10000)):
+                    writer.write(batch)
+                if kwargs.get('output'):
+                    print(f'{writer.record_count} granules written to {kwargs.get("output")}')
+
+    return 0
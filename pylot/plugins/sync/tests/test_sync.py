@@ -0,0 +1,109 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from pylot.plugins.helpers.granule_mirror import GranuleMirror
+from pylot.plugins.sync.main import main, sync_granules
+from pylot.tests.fake_stack import FakeStack
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp_dir.name, 'granules.sqlite')
+        self.stack = FakeStack(100, page_size=10)
+        self.patcher = self.stack.patch()
+        self.patcher.__enter__()
+
+    def tearDown(self) -> None:
+        self.patcher.__exit__(None, None, None)
+        self.stack.close()
+        self.tmp_dir.cleanup()
+
+    def sync(self, **kwargs):
+        with GranuleMirror(self.database) as mirror, redirect_stdout(io.StringIO()):
+            return sync_granules(mirror, page_size=10, **kwargs)
+
+    def test_sync_delta(self):
+        self.assertEqual(self.sync(collection='collection___1'), (10, 0))
+        calls = len(self.stack.recorder.latencies['cumulus.list_granules'])
+        # Only the granule updated at or after the watermark is requested again
+        self.stack.capi.update_granule_record(21, status='failed', updatedAt=1800000000000)
+        self.assertEqual(self.sync(collection='collection___1'), (2, 0))
+        self.assertEqual(len(self.stack.recorder.latencies['cumulus.list_granules']) - calls, 1)
+
+        with GranuleMirror(self.database) as mirror:
+            self.assertEqual(mirror.count(), 10)
+            self.assertEqual(mirror.get_state('collection___1').get('watermark'), 1800000000000)
+            failed = list(mirror.query('collection___1', "status = 'failed'"))
+        self.assertEqual(
+            [record.get('granuleId') for record in failed], [f'granule_{x:08d}' for x in [1, 21, 31, 61, 91]]
+        )
+
+    def test_full_sync_removes_deleted_granules(self):
+        self.sync()
+        self.stack.capi.record_count = 90
+        self.assertEqual(self.sync(full=True), (90, 10))
+        with GranuleMirror(self.database) as mirror:
+            self.assertEqual(mirror.count(), 90)
+
+    def test_update_during_sync(self):
+        list_granules = self.stack.capi.list_granules
+        calls = []
+
+        def update_after_first_page(**kwargs):
+            rsp = list_granules(**kwargs)
+            calls.append(kwargs)
+            if len(calls) == 1:
+                # Moves granule 3 to the end of the updatedAt order while the sync is running
+                self.stack.capi.update_granule_record(3, status='failed', updatedAt=1800000000000)
+            return rsp
+
+        self.stack.capi.list_granules = update_after_first_page
+        self.assertEqual(self.sync(), (101, 0))
+        with GranuleMirror(self.database) as mirror:
+            self.assertEqual(mirror.count(), 100)
+            self.assertEqual(next(mirror.query(where="granule_id = 'granule_00000003'")).get('status'), 'failed')
+        self.assertEqual(calls[1].get('updatedAt__from'), 1700000000000 + 9 * 2000)
+
+    def test_same_updated_at(self):
+        for index in range(25):
+            self.stack.capi.update_granule_record(index, updatedAt=1600000000000)
+        self.assertEqual(self.sync(), (100, 0))
+        with GranuleMirror(self.database) as mirror:
+            self.assertEqual(mirror.count(), 100)
+
+    def test_main_query(self):
+        output = os.path.join(self.tmp_dir.name, 'failed.ndjson')
+        with redirect_stdout(io.StringIO()):
+            main('granules', self.database, 'collection___2')
+            main('query', self.database, 'collection___2', where="status = 'failed'", output=output)
+        with open(output, 'r', encoding='utf-8') as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0], self.stack.capi.granule(22))
+
+    def test_main_action(self):
+        with redirect_stdout(io.StringIO()):
+            main('granules', self.database)
+            self.assertEqual(main(
+                'query', self.database, where="granule_id < 'granule_00000005'",
+                api_action='apply_workflow_to_granule', api_arguments=['workflow_name=Reingest'], batch_size=2
+            ), 0)
+        self.assertEqual(
+            sorted(self.stack.capi.granule_executions),
+            [f'granule_{x:08d}' for x in range(5)]
+        )
+
+    def test_query_fields(self):
+        self.sync(collection='collection___3')
+        with GranuleMirror(self.database) as mirror:
+            records = list(mirror.query('collection___3', 'updated_at > ?', [0], 2, ['granuleId', 'files']))
+        self.assertEqual(records, [
+            {key: self.stack.capi.granule(x).get(key) for key in ['granuleId', 'files']} for x in [3, 13]
+        ])
+        with GranuleMirror(self.database) as mirror:
+            self.assertEqual(list(mirror.query('collection___3', limit=1, fields=['missing'])), [{'missing': None}])
@@ -6,27 +6,141 @@ import sys
 from json import JSONDecodeError
 
 
-def import_plugins():
+def discover_plugins():
+    """
+    Lists the plugin packages in the plugins directory without importing them.
+    :return: sorted list of plugin names
+    """
     plugin_filter = {
         'helpers'
     }
-    plugins = {}
     plugin_dir = f'{os.path.abspath(os.path.dirname(__file__))}/plugins'
-    for file in os.listdir(plugin_dir):
-        if not file.startswith('_') and file not in plugin_filter:
-            plugin = f'pylot.plugins.{file}.main'
-            print(f'Loading plugin: {plugin}')
-            module = importlib.import_module(plugin)
-            plugins[file] = module
+    return sorted(
+        file for file in os.listdir(plugin_dir)
+        if not file.startswith('_') and file not in plugin_filter and os.path.isdir(f'{plugin_dir}/{file}')
+    )
+
+
+def get_plugin_help(name):
+    """
+    Returns the PLUGIN_HELP string declared in the plugin package's __init__.py. Only the lightweight package is
+    imported, not the plugin's main module.
+    """
+    package = importlib.import_module(f'pylot.plugins.{name}')
+    return getattr(package, 'PLUGIN_HELP', '')
+
+
+def import_plugins(names=None):
+    plugins = {}
+    for name in discover_plugins() if names is None else names:
+        plugin = f'pylot.plugins.{name}.main'
+        print(f'Loading plugin: {plugin}')
+        module = importlib.import_module(plugin)
+        plugins[name] = module
 
     return plugins
 
 
-def create_arg_parser(plugins):
+def add_metrics_arguments(parser):
+    parser.add_argument(
+        '--metrics',
+        help='Write per-endpoint call counts, latency histograms, retries, bytes transferred and json encode/decode '
+             'time to this json file when the command exits.',
+        metavar=''
+    )
+    parser.add_argument(
+        '--openmetrics',
+        help='Write the metrics to this file in the OpenMetrics text format when the command exits.',
+        metavar=''
+    )
+
+
+def add_cache_arguments(parser):
+    parser.add_argument(
+        '--api-cache',
+        help='Cache the responses of Cumulus API get_* and list_* calls for the rest of the command. Identical '
+             'concurrent calls are made once and update, apply and delete calls invalidate the records they touch.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--api-cache-ttl',
+        help='Seconds a cached Cumulus API response is used for. Defaults to 60.',
+        metavar='',
+        type=float,
+        default=60
+    )
+    parser.add_argument(
+        '--api-cache-size',
+        help='Maximum number of cached Cumulus API responses. Defaults to 10000.',
+        metavar='',
+        type=int,
+        default=10000
+    )
+
+
+def add_retry_arguments(parser):
+    parser.add_argument(
+        '--api-timeout',
+        help='Seconds a Cumulus API call may take before it is abandoned. Reads that miss the deadline are retried, '
+             'other calls fail so a --resume can retry them.',
+        metavar='',
+        type=float
+    )
+    parser.add_argument(
+        '--api-hedge',
+        help='Send a second request for a Cumulus API get_* or list_* call that has not returned after the p95 '
+             'latency of the endpoint and use whichever response arrives first.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--api-hedge-delay',
+        help='Seconds after which --api-hedge sends the second request instead of the p95 latency.',
+        metavar='',
+        type=float
+    )
+    parser.add_argument(
+        '--api-retries',
+        help='Maximum retries of a throttled Cumulus API call, or of a read that failed with a server or connection '
+             'error. Defaults to 5.',
+        metavar='',
+        type=int
+    )
+
+
+def configure_retries(args):
+    """
+    Applies the --api-timeout, --api-hedge, --api-hedge-delay and --api-retries options to the Cumulus API limiters.
+    """
+    settings = {
+        'timeout': args.api_timeout, 'hedge': args.api_hedge or None, 'hedge_delay': args.api_hedge_delay,
+        'max_retries': args.api_retries
+    }
+    settings = {key: value for key, value in settings.items() if value is not None}
+    if settings:
+        from pylot.plugins.helpers.rate_limiter import configure_rate_limits
+        configure_rate_limits('cumulus', **settings)
+
+
+def create_global_parser():
+    """
+    Parser of the metrics, cache and retry options, which are accepted anywhere on the command line.
+    """
+    global_parser = argparse.ArgumentParser(add_help=False)
+    add_metrics_arguments(global_parser)
+    add_cache_arguments(global_parser)
+    add_retry_arguments(global_parser)
+
+    return global_parser
+
+
+def create_arg_parser(plugins, plugin_names=()):
     parser = argparse.ArgumentParser(
         usage='<plugin> -h to access help for each plugin. \n',
         description='PyLOT command line utility.'
     )
+    add_metrics_arguments(parser)
+    add_cache_arguments(parser)
+    add_retry_arguments(parser)
 
     # load plugin parsers
     subparsers = parser.add_subparsers(title='plugins', dest='command', required=True)
@@ -35,6 +149,12 @@ def create_arg_parser(plugins):
             module.return_parser(subparsers)
         except AttributeError:
             raise ValueError(f'Plugin {name} does not have a return_parser function.')
+
+    # Plugins that were not selected only need a name and help text in the top level help
+    for name in plugin_names:
+        if name not in plugins:
+            subparsers.add_parser(name, help=get_plugin_help(name))
+
     return parser
 
 
@@ -55,21 +175,46 @@ def process_unknown_args(unknown):
     return keyword_args
 
 
-def main():
-    if len(sys.argv) == 1:
-        sys.argv.append('-h')
-    plugins = import_plugins()
-    parser = create_arg_parser(plugins)
-    args, unknown = parser.parse_known_args()
+def run_command(plugins, parser, argv):
+    """
+    Parses a command line, without the program name, with the plugin parsers and calls the selected plugin's main.
+    :return: the plugin main's return code
+    """
+    args, unknown = parser.parse_known_args(argv)
     keyword_args = {**vars(args), **process_unknown_args(unknown)}
+    for key in vars(create_global_parser().parse_args([])):
+        keyword_args.pop(key, None)
     # Try to call the plugin's main
     command = keyword_args.pop('command')
     plugin = plugins.get(command)
-    getattr(plugin, 'main')(**keyword_args)
 
-    return 0
+    return getattr(plugin, 'main')(**keyword_args)
+
+
+def main():
+    if len(sys.argv) == 1:
+        sys.argv.append('-h')
+    global_args, argv = create_global_parser().parse_known_args(sys.argv[1:])
+    configure_retries(global_args)
+    if global_args.api_cache:
+        from pylot.plugins.helpers.api_cache import configure_api_cache
+        configure_api_cache(global_args.api_cache_ttl, global_args.api_cache_size)
+    # Only the selected plugin is imported, the rest are listed from the registry
+    plugin_names = discover_plugins()
+    selected = [name for name in argv[:1] if name in plugin_names]
+    plugins = import_plugins(selected)
+    parser = create_arg_parser(plugins, plugin_names)
+
+    try:
+        return run_command(plugins, parser, argv)
+    finally:
+        if global_args.api_cache:
+            from pylot.plugins.helpers.api_cache import get_api_cache
+            print(get_api_cache().summary())
+        if global_args.metrics or global_args.openmetrics:
+            from pylot.plugins.helpers.metrics import get_metrics
+            get_metrics().dump(global_args.metrics, global_args.openmetrics)
 
 
 if __name__ == '__main__':
-    main()
-    pass
+    sys.exit(main())
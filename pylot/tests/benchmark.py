@@ -0,0 +1,182 @@
+"""
+Benchmarks pylot's hot paths against the in-process FakeStack so they run offline and in CI:
+    cumulus_list  pylot cumulus -f ndjson list granules limit=N --parallel-pages 8
+    rds_query     pylot rds -q '{"records": "granules", "limit": N}' streamed from the fake S3
+    rds_apply     pylot rds -a apply_workflow_to_granule over N records including execution monitoring
+
+Each benchmark runs in its own process so the reported peak RSS belongs to that benchmark alone.
+    python -m pylot.tests.benchmark --sizes 1000,100000,1000000 --output benchmark.json
+
+With --baseline the results are checked against the thresholds of each benchmark and size in a json file, e.g.
+benchmark_baseline.json, and the exit code is 1 if any is exceeded:
+    python -m pylot.tests.benchmark --sizes 1000,100000 --baseline pylot/tests/benchmark_baseline.json
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from time import perf_counter
+from unittest.mock import patch
+
+from tabulate import tabulate
+
+from pylot.plugins.helpers import rate_limiter
+from pylot.plugins.helpers.rate_limiter import reset_rate_limiters
+from pylot.plugins.helpers.record_writers import get_record_writer
+from pylot.tests.fake_stack import FakeCumulusApi, FakeStack
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+# The fake stack has no service quotas so the client side limits are lifted to measure pylot's own overhead
+UNLIMITED = {
+    'stepfunctions.describe_execution': {'rate': None, 'max_concurrency': 100},
+    'stepfunctions.list_executions': {'rate': None, 'max_concurrency': 100},
+}
+
+
+def bench_cumulus_list(stack, size, output):
+    from pylot.plugins.cumulus.main import main
+    main('list', 'granules', output=output, parallel_pages=8, output_format='ndjson', limit=size)
+    return size
+
+
+def bench_rds_query(stack, size, output):
+    from pylot.plugins.rds.main import stream_query_rds
+    return sum(1 for _ in stream_query_rds({'records': 'granules', 'limit': size}, s3_client=stack.s3_client))
+
+
+def bench_rds_apply(stack, size, output):
+    from pylot.plugins.rds.main import apply_api_action
+    records = ({'granule_id': FakeCumulusApi.granule(x).get('granuleId')} for x in range(size))
+    with get_record_writer('ndjson', output) as writer:
+        responses, _ = apply_api_action(
+            records, 'apply_workflow_to_granule', {'workflow_name': 'Benchmark'}, 50, writer
+        )
+    return len(responses)
+
+
+# Baseline metrics that must not fall below their threshold, the others must not exceed it
+MINIMUM_METRICS = {'records/s'}
+
+BENCHMARKS = {
+    'cumulus_list': bench_cumulus_list,
+    'rds_query': bench_rds_query,
+    'rds_apply': bench_rds_apply,
+}
+
+
+def check_baseline(results, baseline):
+    """
+    Compares the results with {benchmark: {size: {metric: threshold}}}. records/s is a minimum and the other metrics,
+    e.g. calls and peak rss MiB, are maximums. Results without a baseline are not checked.
+    :return: list of the exceeded thresholds
+    """
+    exceeded = []
+    for result in results:
+        thresholds = baseline.get(result.get('benchmark'), {}).get(str(result.get('size')), {})
+        for metric, threshold in thresholds.items():
+            value = result.get(metric)
+            if metric in MINIMUM_METRICS and value < threshold:
+                exceeded.append(f'{result.get("benchmark")} {result.get("size")}: {metric} {value} < {threshold}')
+            elif metric not in MINIMUM_METRICS and value > threshold:
+                exceeded.append(f'{result.get("benchmark")} {result.get("size")}: {metric} {value} > {threshold}')
+
+    return exceeded
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_benchmark(name, size, latency=0.0, error_rate=0.0, throttle_rate=0.0):
+    """
+    Runs one benchmark in the current process.
+    :return: dictionary with records, seconds, records/s, p50/p99 call latency in ms and peak RSS in MiB
+    """
+    with FakeStack(size, page_size=100, latency=latency, error_rate=error_rate, throttle_rate=throttle_rate) as stack, \
+            tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, 'w') as devnull, \
+            patch.dict(rate_limiter.DEFAULT_LIMITS, UNLIMITED), stack.patch():
+        reset_rate_limiters()
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            start = perf_counter()
+            with redirect_stdout(devnull):
+                records = BENCHMARKS[name](stack, size, os.path.join(tmp_dir, 'output.json'))
+            seconds = perf_counter() - start
+        finally:
+            os.chdir(cwd)
+            reset_rate_limiters()
+        latencies = stack.latencies()
+
+    return {
+        'benchmark': name,
+        'size': size,
+        'records': records,
+        'seconds': round(seconds, 3),
+        'records/s': round(records / seconds, 1) if seconds else 0,
+        'calls': len(latencies),
+        'p50 ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99 ms': round(percentile(latencies, 0.99) * 1000, 3),
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        'peak rss MiB': round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024), 1
+        )
+    }
+
+
+def run_isolated(name, size, **kwargs):
+    """
+    Runs one benchmark in a fresh process so its peak RSS is not inflated by earlier benchmarks.
+    """
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_benchmark, name, size, **kwargs).result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pylot against an in-process fake Cumulus stack.')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='Comma separated record counts.')
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS), help='Comma separated benchmark names.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated seconds per API call.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API calls that return an error.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of API calls that are throttled.')
+    parser.add_argument('--output', help='Write the results to this json file.')
+    parser.add_argument('--baseline', help='Fail if the results exceed the thresholds in this json file.')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.benchmarks.split(','):
+        for size in [int(size) for size in args.sizes.split(',')]:
+            result = run_isolated(
+                name, size, latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate
+            )
+            print(', '.join(f'{key}: {value}' for key, value in result.items()), flush=True)
+            results.append(result)
+
+    print(tabulate([result.values() for result in results], headers=list(results[0]), tablefmt='psql'))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as _file:
+            json.dump(results, _file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as _file:
+            exceeded = check_baseline(results, json.load(_file))
+        for line in exceeded:
+            print(f'Baseline exceeded: {line}')
+        if exceeded:
+            return 1
+        print(f'All results are within the baseline {args.baseline}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
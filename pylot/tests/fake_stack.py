@@ -0,0 +1,317 @@
+"""
+In-process stand-ins for the Cumulus API, the RDS lambda, S3 and Step Functions used by the benchmarks and tests.
+Records are generated from their index so large stacks do not hold the records in memory, and S3 objects are kept in
+temporary files.
+"""
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from contextlib import ExitStack, contextmanager
+from time import perf_counter, sleep, time
+from unittest.mock import patch
+
+from pylot.plugins.helpers.pylot_helpers import PyLOTHelpers
+
+STATE_MACHINE_ARN = 'arn:aws:states:us-west-2:000000000000:stateMachine:{}'
+EXECUTION_ARN = 'arn:aws:states:us-west-2:000000000000:execution:{}:{}'
+
+
+class FakeCallRecorder:
+    """
+    Records the latency of every call per endpoint and simulates latency, throttling and errors.
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+
+    def call(self, endpoint, function, *args, **kwargs):
+        start = perf_counter()
+        if self.latency:
+            sleep(self.latency)
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.throttle_rate:
+            rsp = {'message': 'Too Many Requests', 'statusCode': 429}
+        elif roll < self.throttle_rate + self.error_rate:
+            rsp = {'error': 'Internal Server Error', 'message': f'Simulated {endpoint} failure', 'statusCode': 500}
+        else:
+            rsp = function(*args, **kwargs)
+        self.latencies[endpoint].append(perf_counter() - start)
+        return rsp
+
+    def all_latencies(self):
+        return [latency for latencies in self.latencies.values() for latency in latencies]
+
+
+class FakeStepFunctionsClient:
+    def __init__(self, duration=0.0, failure_rate=0.0, recorder=None):
+        self.duration = duration
+        self.failure_rate = failure_rate
+        self.recorder = recorder or FakeCallRecorder()
+        self.executions = {}
+        self.lock = threading.Lock()
+
+    def start_execution(self, state_machine, name):
+        execution_arn = EXECUTION_ARN.format(state_machine, name)
+        with self.lock:
+            self.executions[execution_arn] = time()
+        return execution_arn
+
+    def _status(self, execution_arn):
+        if time() - self.executions.get(execution_arn) < self.duration:
+            return 'RUNNING'
+        failed = (hash(execution_arn) % 1000) / 1000 < self.failure_rate
+        return 'FAILED' if failed else 'SUCCEEDED'
+
+    def describe_execution(self, executionArn):
+        def describe():
+            status = self._status(executionArn)
+            rsp = {
+                'executionArn': executionArn, 'status': status,
+                'startDate': datetime.fromtimestamp(self.executions.get(executionArn), timezone.utc)
+            }
+            if status == 'FAILED':
+                rsp.update({'error': 'States.TaskFailed'})
+            return rsp
+        return self.recorder.call('stepfunctions.describe_execution', describe)
+
+    def list_executions(self, stateMachineArn, statusFilter=None, maxResults=1000, nextToken=None):
+        def list_page():
+            state_machine = stateMachineArn.rsplit(':', maxsplit=1)[-1]
+            arns = [
+                arn for arn in list(self.executions)
+                if arn.split(':')[6] == state_machine and (not statusFilter or self._status(arn) == statusFilter)
+            ]
+            start = int(nextToken or 0)
+            rsp = {'executions': [{'executionArn': arn} for arn in arns[start:start + maxResults]]}
+            if start + maxResults < len(arns):
+                rsp.update({'nextToken': str(start + maxResults)})
+            return rsp
+        return self.recorder.call('stepfunctions.list_executions', list_page)
+
+
+class FakeCumulusApi:
+    """
+    Mimics the CumulusApi methods pylot uses over a stack of record_count generated granules.
+    """
+    def __init__(self, record_count=1000, page_size=10, recorder=None, sfn_client=None):
+        self.record_count = record_count
+        self.page_size = page_size
+        self.recorder = recorder or FakeCallRecorder()
+        self.sfn_client = sfn_client or FakeStepFunctionsClient()
+        self.granule_executions = {}
+        self.updates = {}
+        self.async_operations = {}
+        self.deleted_granules = set()
+
+    @staticmethod
+    def granule(index, execution=''):
+        return {
+            'granuleId': f'granule_{index:08d}',
+            'collectionId': f'collection___{index % 10}',
+            'status': ['completed', 'failed', 'running'][index % 3],
+            'createdAt': 1700000000000 + index * 1000,
+            'updatedAt': 1700000000000 + index * 2000,
+            'execution': execution,
+            'files': [{'bucket': 'protected', 'key': f'collection/granule_{index:08d}.dat', 'size': index}]
+        }
+
+    def update_granule_record(self, index, **fields):
+        """
+        Simulates a change to a granule, e.g. update_granule_record(3, status='failed', updatedAt=...)
+        """
+        self.updates.setdefault(index, {}).update(fields)
+
+    def get_record(self, index):
+        return {**self.granule(index), **self.updates.get(index, {})}
+
+    def filter_records(self, collectionId=None, status=None, updatedAt__from=None, sort_by=None, order='asc', **kwargs):
+        records = [
+            record for record in map(self.get_record, range(self.record_count))
+            if (collectionId is None or record.get('collectionId') == collectionId) and
+               (status is None or record.get('status') == status) and
+               (updatedAt__from is None or record.get('updatedAt') >= int(updatedAt__from))
+        ]
+        if sort_by:
+            records.sort(key=lambda record: record.get(sort_by), reverse=order == 'desc')
+        return records
+
+    def list_granules(self, page=1, limit=None, **kwargs):
+        def list_page():
+            page_size = int(limit or self.page_size)
+            start = (int(page) - 1) * page_size
+            if self.updates or set(kwargs) & {'collectionId', 'status', 'updatedAt__from', 'sort_by'}:
+                records = self.filter_records(**kwargs)
+                return {
+                    'meta': {'count': len(records), 'page': int(page), 'limit': page_size},
+                    'results': records[start:start + page_size]
+                }
+            return {
+                'meta': {'count': self.record_count, 'page': int(page), 'limit': page_size},
+                'results': [self.granule(x) for x in range(start, min(start + page_size, self.record_count))]
+            }
+        return self.recorder.call('cumulus.list_granules', list_page)
+
+    def get_granule(self, granule_id, **kwargs):
+        def get():
+            index = int(granule_id.rsplit('_', maxsplit=1)[-1])
+            execution_arn = self.granule_executions.get(granule_id, '')
+            execution = f'https://console.aws.amazon.com/states/home#/executions/details/{execution_arn}' \
+                if execution_arn else ''
+            return {**self.get_record(index), 'execution': execution}
+        return self.recorder.call('cumulus.get_granule', get)
+
+    def apply_workflow_to_granule(self, granule_id, workflow_name):
+        def apply():
+            self.granule_executions[granule_id] = self.sfn_client.start_execution(workflow_name, granule_id)
+            return {'action': f'applyWorkflow {workflow_name}', 'granuleId': granule_id, 'status': 'SUCCESS'}
+        return self.recorder.call('cumulus.apply_workflow_to_granule', apply)
+
+    def _start_async_operation(self, endpoint, data, operation):
+        def start():
+            granule_ids = data.get('ids') or [granule.get('granuleId') for granule in data.get('granules', [])]
+            operation_id = f'{endpoint}-{len(self.async_operations)}'
+            # The operation runs when it is first polled and is reported as finished on the second poll
+            self.async_operations[operation_id] = {'run': lambda: operation(granule_ids), 'polls': 0}
+            return {'id': operation_id, 'status': 'RUNNING', 'description': endpoint}
+        return self.recorder.call(f'cumulus.{endpoint}', start)
+
+    def bulk_granules(self, data):
+        def apply(granule_ids):
+            workflow_name = data.get('workflowName')
+            for granule_id in granule_ids:
+                self.granule_executions[granule_id] = self.sfn_client.start_execution(workflow_name, granule_id)
+        return self._start_async_operation('bulk_granules', data, apply)
+
+    def bulk_reingest(self, data):
+        return self.bulk_granules({**data, 'workflowName': data.get('workflowName', 'IngestGranule')})
+
+    def bulk_delete(self, data):
+        def delete(granule_ids):
+            self.deleted_granules.update(granule_ids)
+        return self._start_async_operation('bulk_delete', data, delete)
+
+    def get_async_operation(self, async_operation_id):
+        def get():
+            operation = self.async_operations.get(async_operation_id)
+            operation['polls'] += 1
+            if operation['polls'] == 1:
+                operation['run']()
+                return {'id': async_operation_id, 'status': 'RUNNING'}
+            return {'id': async_operation_id, 'status': 'SUCCEEDED', 'output': '[]'}
+        return self.recorder.call('cumulus.get_async_operation', get)
+
+
+class FakeS3Client:
+    def __init__(self, object_dir, recorder=None):
+        self.object_dir = object_dir
+        self.recorder = recorder or FakeCallRecorder()
+
+    def _path(self, bucket, key):
+        return os.path.join(self.object_dir, bucket, key)
+
+    def put_file(self, bucket, key, filename):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(filename, path)
+
+    def head_object(self, Bucket, Key):
+        return self.recorder.call('s3.head_object', lambda: {'ContentLength': os.path.getsize(self._path(Bucket, Key))})
+
+    def get_object(self, Bucket, Key, Range=None):
+        def get():
+            with open(self._path(Bucket, Key), 'rb') as _file:
+                if Range:
+                    start, end = Range.replace('bytes=', '').split('-')
+                    _file.seek(int(start))
+                    return {'Body': io.BytesIO(_file.read(int(end) - int(start) + 1))}
+                return {'Body': io.BytesIO(_file.read())}
+        return self.recorder.call('s3.get_object', get)
+
+    def download_file(self, Bucket, Key, Filename):
+        return self.recorder.call('s3.download_file', shutil.copyfile, self._path(Bucket, Key), Filename)
+
+
+class FakeLambdaClient:
+    """
+    Stand-in for the RDS lambda. Query results are generated from FakeCumulusApi.granule and written to the fake S3.
+    """
+    def __init__(self, s3_client, record_count=1000, recorder=None):
+        self.s3_client = s3_client
+        self.record_count = record_count
+        self.recorder = recorder or FakeCallRecorder()
+        self.invocations = 0
+
+    def invoke(self, FunctionName, Payload):
+        def invoke():
+            rds_config = json.loads(Payload).get('rds_config', {})
+            count = min(int(rds_config.get('limit', self.record_count)), self.record_count)
+            columns = rds_config.get('columns')
+            self.invocations += 1
+            key = f'query_results/{self.invocations}.json'
+            with tempfile.NamedTemporaryFile('w', delete=False, dir=self.s3_client.object_dir) as _file:
+                _file.write('[')
+                for x in range(count):
+                    record = FakeCumulusApi.granule(x)
+                    record = {'granule_id': record.pop('granuleId'), **record}
+                    if columns:
+                        record = {column: record.get(column) for column in columns}
+                    _file.write(f'{"," if x else ""}\n{json.dumps(record)}')
+                _file.write('\n]')
+            self.s3_client.put_file('internal', key, _file.name)
+            payload = {'bucket': 'internal', 'key': key, 'count': count, 'records': 'granules', 'query': 'SELECT 1'}
+            return {'StatusCode': 200, 'Payload': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+        return self.recorder.call('lambda.invoke', invoke)
+
+
+class FakeStack:
+    """
+    A Cumulus API, RDS lambda, S3 and Step Functions. Errors and throttling are only simulated for the Cumulus API while
+    every service gets the simulated latency. patch() routes pylot's boto3 clients and
+    PyLOTHelpers.get_cumulus_api_instance to the stack.
+    """
+    def __init__(self, record_count=1000, page_size=10, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                 execution_duration=0.0, execution_failure_rate=0.0):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.recorder = FakeCallRecorder(latency, error_rate, throttle_rate)
+        self.aws_recorder = FakeCallRecorder(latency)
+        self.sfn_client = FakeStepFunctionsClient(execution_duration, execution_failure_rate, self.aws_recorder)
+        self.capi = FakeCumulusApi(record_count, page_size, self.recorder, self.sfn_client)
+        self.s3_client = FakeS3Client(self.tmp_dir.name, self.aws_recorder)
+        self.lambda_client = FakeLambdaClient(self.s3_client, record_count, self.aws_recorder)
+        self.clients = {'stepfunctions': self.sfn_client, 's3': self.s3_client, 'lambda': self.lambda_client}
+
+    def client(self, service, *args, **kwargs):
+        return self.clients[service]
+
+    @contextmanager
+    def patch(self):
+        with ExitStack() as stack:
+            PyLOTHelpers.reset_clients()
+            stack.callback(PyLOTHelpers.reset_clients)
+            stack.enter_context(patch('boto3.client', side_effect=self.client))
+            stack.enter_context(patch.object(PyLOTHelpers, 'get_cumulus_api_instance', return_value=self.capi))
+            stack.enter_context(patch.dict(os.environ, {'RDS_LAMBDA_ARN': 'arn:aws:lambda:fake'}))
+            yield self
+
+    def close(self):
+        self.tmp_dir.cleanup()
+
+    def latencies(self):
+        return [*self.recorder.all_latencies(), *self.aws_recorder.all_latencies()]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,55 @@
+import unittest
+
+from pylot.tests.benchmark import BENCHMARKS, check_baseline, percentile, run_benchmark
+from pylot.tests.fake_stack import STATE_MACHINE_ARN, FakeStack
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_benchmarks(self):
+        for name in BENCHMARKS:
+            result = run_benchmark(name, 250)
+            self.assertEqual(result.get('records'), 250, name)
+            self.assertGreater(result.get('records/s'), 0, name)
+            self.assertGreater(result.get('calls'), 0, name)
+            self.assertGreaterEqual(result.get('p99 ms'), result.get('p50 ms'), name)
+            self.assertGreater(result.get('peak rss MiB'), 0, name)
+
+    def test_benchmark_with_errors(self):
+        result = run_benchmark('rds_apply', 100, error_rate=0.2)
+        self.assertLess(result.get('records'), 100)
+
+    def test_check_baseline(self):
+        results = [
+            {'benchmark': 'rds_query', 'size': 1000, 'records/s': 900, 'calls': 3, 'peak rss MiB': 120},
+            {'benchmark': 'rds_query', 'size': 5, 'records/s': 1, 'calls': 1, 'peak rss MiB': 1}
+        ]
+        baseline = {'rds_query': {'1000': {'records/s': 1000, 'calls': 3, 'peak rss MiB': 100}}}
+        self.assertEqual(check_baseline(results, baseline), [
+            'rds_query 1000: records/s 900 < 1000', 'rds_query 1000: peak rss MiB 120 > 100'
+        ])
+        self.assertEqual(check_baseline(results[:1], {'rds_query': {'1000': {'calls': 3}}}), [])
+
+    def test_percentile(self):
+        self.assertEqual(percentile(list(range(100)), 0.5), 50)
+        self.assertEqual(percentile(list(range(100)), 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0)
+
+    def test_fake_stack_pages(self):
+        with FakeStack(25, page_size=10) as stack:
+            page = stack.capi.list_granules(page=3)
+            self.assertEqual(page.get('meta').get('count'), 25)
+            self.assertEqual([granule.get('granuleId') for granule in page.get('results')],
+                             [f'granule_{x:08d}' for x in range(20, 25)])
+
+    def test_fake_stack_executions(self):
+        with FakeStack(10, execution_duration=60) as stack:
+            stack.capi.apply_workflow_to_granule('granule_00000001', 'Workflow')
+            execution_url = stack.capi.get_granule('granule_00000001').get('execution')
+            execution_arn = execution_url.rsplit('/')[-1]
+            self.assertEqual(stack.sfn_client.describe_execution(execution_arn).get('status'), 'RUNNING')
+            running = stack.sfn_client.list_executions(STATE_MACHINE_ARN.format('Workflow'), 'RUNNING')
+            self.assertEqual(running.get('executions'), [{'executionArn': execution_arn}])
+
+
+if __name__ == '__main__':
+    unittest.main()
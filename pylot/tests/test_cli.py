@@ -1,6 +1,15 @@
+import io
+import json
+import os
+import tempfile
 import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
 
-from pylot.pylot_cli import import_plugins, create_arg_parser, process_unknown_args
+from pylot.plugins.helpers.metrics import reset_metrics
+from pylot.plugins.helpers.rate_limiter import DEFAULT_LIMITS, get_rate_limiter, reset_rate_limiters
+from pylot.pylot_cli import import_plugins, create_arg_parser, process_unknown_args, discover_plugins, main
+from pylot.tests.fake_stack import FakeStack
 
 
 class TestCli(unittest.TestCase):
@@ -8,13 +17,51 @@ class TestCli(unittest.TestCase):
 
     def test_import_plugins(self):
         plugins = import_plugins()
-        self.assertEqual(len(plugins), 2)
+        self.assertEqual(len(plugins), 5)
 
     def test_create_argparser(self):
         plugins = import_plugins()
         parser = create_arg_parser(plugins)
 
+    def test_discover_plugins(self):
+        self.assertEqual(discover_plugins(), ['batch', 'cumulus', 'rds', 'shell', 'sync'])
+
+    def test_create_argparser_selected_plugin(self):
+        plugins = import_plugins(['rds'])
+        parser = create_arg_parser(plugins, discover_plugins())
+        args, _ = parser.parse_known_args(['rds', '-l', 'granule'])
+        self.assertEqual(args.command, 'rds')
+        args, _ = parser.parse_known_args(['cumulus'])
+        self.assertEqual(args.command, 'cumulus')
+
     def test_process_unknown_args(self):
         args = ['limit=1', 'sort_by=granuleId']
         res = process_unknown_args(args)
         self.assertEqual(res, {'limit': 1, 'sort_by': 'granuleId'})
+
+    def test_main_metrics(self):
+        reset_metrics()
+        with FakeStack(30) as stack, stack.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+            metrics = os.path.join(tmp_dir, 'metrics.json')
+            openmetrics = os.path.join(tmp_dir, 'metrics.prom')
+            argv = ['pylot', 'cumulus', 'list', 'granules', 'limit=30', '--metrics', metrics, '--openmetrics', openmetrics]
+            with patch('sys.argv', argv), redirect_stdout(io.StringIO()):
+                self.assertEqual(main(), 0)
+            with open(metrics, 'r', encoding='utf-8') as _file:
+                rsp = json.load(_file)
+            self.assertEqual(rsp.get('endpoints').get('cumulus.list_granules').get('calls'), 3)
+            self.assertEqual(rsp.get('json').get('encode').get('records'), 30)
+            with open(openmetrics, 'r', encoding='utf-8') as _file:
+                self.assertIn('pylot_api_calls_total{endpoint="cumulus.list_granules"} 3', _file.read())
+
+    def test_main_retries(self):
+        limits = dict(DEFAULT_LIMITS.get('cumulus'))
+        argv = ['pylot', '--api-timeout', '5', 'cumulus', 'list', 'granules', 'limit=10', '--api-hedge']
+        try:
+            with FakeStack(10) as stack, stack.patch(), patch('sys.argv', argv), redirect_stdout(io.StringIO()):
+                self.assertEqual(main(), 0)
+            limiter = get_rate_limiter('cumulus.list_granules')
+            self.assertEqual((limiter.timeout, limiter.hedge, limiter.max_retries), (5, True, 5))
+        finally:
+            DEFAULT_LIMITS['cumulus'] = limits
+            reset_rate_limiters()
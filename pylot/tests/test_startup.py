@@ -0,0 +1,53 @@
+import subprocess
+import sys
+import time
+import unittest
+
+# Modules that dominate startup time and must only be imported once a command needs them
+HEAVY_MODULES = ['boto3', 'botocore', 'cumulus_api', 'pylot.plugins.cumulus.main', 'pyarrow']
+
+
+# Runs the cli and writes the names of all imported modules to stderr on exit
+CLI_SCRIPT = '''
+import atexit
+import sys
+atexit.register(lambda: sys.stderr.write('\\n'.join(sys.modules)))
+from pylot.pylot_cli import main
+sys.argv = ['pylot', *sys.argv[1:]]
+main()
+'''
+
+
+def run_cli(*args):
+    start = time.perf_counter()
+    rsp = subprocess.run([sys.executable, '-c', CLI_SCRIPT, *args], capture_output=True, text=True, check=False)
+    return rsp, time.perf_counter() - start
+
+
+class TestStartup(unittest.TestCase):
+    def test_help_does_not_import_plugins(self):
+        rsp, _ = run_cli('-h')
+        self.assertEqual(rsp.returncode, 0)
+        self.assertIn('cumulus', rsp.stdout)
+        self.assertIn('rds', rsp.stdout)
+        modules = rsp.stderr.splitlines()
+        for module in ['pylot.plugins.cumulus.main', 'pylot.plugins.rds.main', 'boto3', 'tabulate']:
+            self.assertNotIn(module, modules)
+
+    def test_selected_plugin_only(self):
+        rsp, _ = run_cli('rds', '-l', 'granule')
+        self.assertEqual(rsp.returncode, 0)
+        modules = rsp.stderr.splitlines()
+        self.assertIn('pylot.plugins.rds.main', modules)
+        self.assertNotIn('boto3', modules)
+
+    def test_startup_benchmark(self):
+        runs = [run_cli('-h') for _ in range(3)]
+        for rsp, _ in runs:
+            self.assertEqual(rsp.returncode, 0)
+            modules = rsp.stderr.splitlines()
+            for module in HEAVY_MODULES:
+                self.assertNotIn(module, modules)
+        # The wall time depends on the machine so it is only reported
+        timings = sorted(seconds for _, seconds in runs)
+        print(f'pylot -h median wall time: {timings[1]:.3f}s')